@@ -0,0 +1,296 @@
+r'''
+    Module for turning animations into Roy Lichtenstein style animations.
+
+    The idea behind this module is to apply lichtenstein.lichtenstein() to
+    every frame of an animated GIF or a folder of numbered frames. Since the
+    frames don't depend on each other, they are generated across a pool of
+    processes a few at a time. The frames are read as they are needed and 
+    each generated frame is written out as soon as it arrives, so only a 
+    few frames are held at once. The frames and the generated frames are 
+    handed between the processes in shared memory with sharedImage, so 
+    they aren't copied through pipes. Frames written to a folder are saved
+    straight away, but the Pillow GIF writer keeps a palette copy of every
+    frame, which is a third of the size of the RGB frame, until the whole 
+    GIF is written.
+
+    If each frame was quantized on its own, every frame would have its own
+    adaptive colours and the colours would flicker between frames. Instead a
+    single palette is estimated from a stratified sample of the pixels of all
+    the frames and every frame is quantized to it. Frames that are exactly
+    the same as the frame before them aren't generated again and reuse the
+    result of the frame before.
+
+    A size can be given to generate a smaller animation, such as a preview.
+    Frames from files are then decoded at a reduced size where the format
+    allows it, with PILAddons.open_draft(), instead of being decoded at
+    their full size and scaled down.
+
+    Here is an example of how the code works:
+
+        >>> frames = []
+        >>> for i in xrange(10):
+        ...     img = Image.new('RGB', (200,150), (255,255,255))
+        ...     drw = ImageDraw.Draw(img)
+        ...     drw.ellipse((i*10, 40, i*10+60, 100), fill=(200,40,40))
+        ...     frames.extend([img, img])
+        ...
+        >>> frames[0].save('ball.gif', save_all=True, append_images=frames[1:])
+        >>> lichtenstein_animation('ball.gif', 'ball-lich.gif', htBox=5)
+        >>> lichtenstein_animation('ball.gif', 'ball-frames', workers=2)
+        >>> lichtenstein_animation('ball-frames', 'ball-small.gif', 
+        ...                        size=(100,75), htBox=4)
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the animation module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(animation)
+
+'''
+import itertools
+import os
+import re
+import multiprocessing
+from PIL import Image, ImageChops, ImageDraw, ImageSequence
+import PILAddons as pila
+import lichtenstein as li
+import quantize as qt
+import sharedImage as sh
+
+FRAME_EXTENSIONS = ('.bmp', '.gif', '.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+
+def frame_files(dirName):
+    '''Finds the image files in a folder of numbered frames.
+
+    Parameters:
+        dirName [str] : The folder containing the frames.
+
+    On Exit:
+        Returns a list of the locations of the image files in 'dirName' in
+        the order of the numbers in their names, so that 'frame10' comes
+        after 'frame9'.
+
+    '''
+    def frame_number(fileName):
+        return [int(part) if part.isdigit() else part
+                for part in re.split(r'(\d+)', fileName)]
+    files = [f for f in os.listdir(dirName)
+             if os.path.splitext(f)[1].lower() in FRAME_EXTENSIONS]
+    return [os.path.join(dirName, f) for f in sorted(files, key=frame_number)]
+
+
+def read_frames(source, size=None):
+    '''Creates a generator for the frames of an animation.
+
+    Parameters:
+        source [str]  : The location of an animated image file, such as a 
+                        GIF, or a folder of numbered frames.
+        size [tuple]  : The (width, height) the frames must fit within, or 
+                        None for their full size. The files of a folder of 
+                        frames are decoded straight to a reduced size.
+
+    On Exit:
+        Yields each frame as an RGB PIL image along with how long it is shown
+        for in milliseconds, which is None for a folder of frames.
+
+    '''
+    if os.path.isdir(source):
+        for fileName in frame_files(source):
+            if size is None:
+                yield Image.open(fileName).convert('RGB'), None
+            else:
+                yield pila.open_draft(fileName, size), None
+    else:
+        img = Image.open(source)
+        for frame in ImageSequence.Iterator(img):
+            rgb = frame.convert('RGB')
+            if size is not None:
+                # The frames of one file can't be decoded at a reduced size
+                rgb.thumbnail(size, Image.ANTIALIAS)
+            yield rgb, frame.info.get('duration')
+
+
+def frame_durations(source):
+    '''Finds how long each frame of an animation is shown for.
+
+    Parameters:
+        source [str] : The location of an animated image file, such as a 
+                       GIF, or a folder of numbered frames.
+
+    On Exit:
+        Returns a list with the duration in milliseconds of every frame, 
+        which is None for each frame of a folder of frames.
+
+    '''
+    if os.path.isdir(source):
+        return [None]*len(frame_files(source))
+    return [frame.info.get('duration')
+            for frame in ImageSequence.Iterator(Image.open(source))]
+
+
+def animation_palette(frames, nCols=8, maxPixels=262144, nFrames=None):
+    '''Estimates a single quantize palette for all the frames of an
+    animation from a stratified sample of the pixels of every frame.
+
+    Parameters:
+        frames [list]   : A list of the PIL image frames, or any iterable of
+                          them such as a generator.
+        nCols [int]     : The number of colours the palette is made of.
+        maxPixels [int] : The rough number of pixels sampled across all the
+                          frames.
+        nFrames [int]   : The number of frames, which must be given if
+                          'frames' has no length.
+
+    On Exit:
+        Returns a list of 'nCols' 3-tuple RGB colours to quantize every frame
+        to.
+
+    '''
+    if nFrames is None:
+        nFrames = len(frames)
+    perFrame = max(1, maxPixels/nFrames)
+    sample = []
+    for i, frame in enumerate(frames):
+        sample.extend(qt.sample_pixels(frame, perFrame, seed=i))
+    return qt.sample_palette(sample, nCols)
+
+
+def render_frame(job):
+    '''Generates the Roy Lichtenstein image for a single frame. This is
+    called by each process of the pool.
+
+    Parameters:
+        job [tuple] : A 2-tuple of the sharedImage.ImageHandle of the frame 
+                      and a dictionary of the lichtenstein() parameters.
+
+    On Exit:
+        Returns the ImageHandle of the generated image.
+
+    '''
+    handle, params = job
+    return sh.share(li.lichtenstein(sh.crop_shared(handle), **params))
+
+
+def generate_frames(pool, frames, params, batch):
+    '''Creates a generator for the Roy Lichtenstein frames of an animation,
+    which are generated 'batch' frames at a time across a pool of processes.
+
+    Parameters:
+        pool [Pool]     : The multiprocessing pool to generate the frames in.
+        frames [iter]   : An iterable of the PIL image frames.
+        params [dict]   : The lichtenstein() parameters.
+        batch [int]     : The number of frames read at once.
+
+    On Exit:
+        Yields each generated frame in order. Frames that are exactly the
+        same as the frame before them yield the frame generated before.
+
+    '''
+    frames = iter(frames)
+    lastFrame, lastLich = None, None
+    while True:
+        group = list(itertools.islice(frames, batch))
+        if not group:
+            break
+        new = []
+        for frame in group:
+            new.append(lastFrame is None or frame.size != lastFrame.size or 
+                       ImageChops.difference(frame, lastFrame).getbbox() 
+                       is not None)
+            lastFrame = frame
+        handles, results = [], []
+        try:
+            for frame, isNew in zip(group, new):
+                if isNew:
+                    handles.append(sh.share(frame))
+            del group
+            results = sh.gather(pool.imap(render_frame, 
+                                          [(handle, params) 
+                                           for handle in handles]))
+            # The processes have finished with the frames
+            for handle in handles:
+                sh.release(handle)
+            results.reverse()
+            for isNew in new:
+                if isNew:
+                    result = results.pop()
+                    lastLich = sh.crop_shared(result)
+                    sh.release(result)
+                yield lastLich
+        finally:
+            # The frames, and the results that weren't read if writing failed
+            for handle in handles + results:
+                sh.release(handle)
+
+
+def lichtenstein_animation(source, output, workers=None, size=None, 
+                           **params):
+    '''Generates a Roy Lichtenstein animation from an animation.
+
+    Parameters:
+        source [str]  : The location of an animated image file, such as a
+                        GIF, or a folder of numbered frames.
+        output [str]  : The location to write the animation to. If it ends in
+                        '.gif' an animated GIF is written, otherwise it is a
+                        folder the frames are saved to as numbered PNG files.
+        workers [int] : The number of processes used to generate the frames.
+                        By default this is the number of CPUs.
+        size [tuple]  : The (width, height) the frames are scaled down to
+                        fit within before they are generated, or None to 
+                        generate them at their full size. See read_frames().
+        params        : Any of the parameters of lichtenstein.lichtenstein(),
+                        given by name. If 'qtPalette' isn't given, a palette
+                        for all the frames is found with animation_palette().
+
+    On Exit:
+        Generates every frame of 'source' and writes them to 'output'.
+
+    '''
+    durations = frame_durations(source)
+    if len(durations) == 0:
+        raise ValueError, "'{0}' has no frames".format(source)
+
+    if params.get('qtPalette') is None:
+        frames = (frame for frame, _ in read_frames(source, size))
+        params['qtPalette'] = animation_palette(frames, 
+                                                params.get('qtNCols', 8),
+                                                nFrames=len(durations))
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        batch = 2*(workers or multiprocessing.cpu_count())
+        lichFrames = generate_frames(pool, (frame for frame, _ in 
+                                            read_frames(source, size)),
+                                     params, batch)
+        if output.lower().endswith('.gif'):
+            # The GIF writer takes the rest of the frames as they are made
+            saveParams = {'save_all': True, 'append_images': lichFrames,
+                          'loop': 0}
+            if None not in durations:
+                saveParams['duration'] = durations
+            next(lichFrames).save(output, **saveParams)
+        else:
+            if not os.path.isdir(output):
+                os.makedirs(output)
+            digits = len(str(len(durations)))
+            for i, frame in enumerate(lichFrames):
+                frame.save(os.path.join(output, 
+                                        'frame{0:0{1}d}.png'.format(i, digits)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == "__main__":
+    frames = []
+    for i in xrange(10):
+        img = Image.new('RGB', (200,150), (255,255,255))
+        drw = ImageDraw.Draw(img)
+        drw.ellipse((i*10, 40, i*10+60, 100), fill=(200,40,40))
+        frames.extend([img, img])
+    frames[0].save('ball.gif', save_all=True, append_images=frames[1:])
+    lichtenstein_animation('ball.gif', 'ball-lich.gif', htBox=5)
+    lichtenstein_animation('ball.gif', 'ball-frames', workers=2)
+    lichtenstein_animation('ball-frames', 'ball-small.gif', size=(100,75),
+                           htBox=4)
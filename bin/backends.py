@@ -0,0 +1,182 @@
+r'''
+    Module for choosing between the implementations of the pixel kernels.
+
+    The kernels are the parts of the processes that work on every pixel of
+    an image, such as the Canny Edge Detect gradients, the luminosity of each
+    pixel, the sampling of each halftoning box and the masks of the 
+    composite. Each kernel can have several implementations, called 
+    backends, which give the same results:
+
+        python : plain Python, which always works. The reference each
+                 kernel is checked against is also in plain Python.
+        pil    : built from PIL's own operations such as point tables, bands
+                 and filters, which run in C.
+        numpy  : built from NumPy arrays, which is only available when NumPy
+                 is installed.
+
+    The modules register their backends for each kernel with register() and
+    call the kernel with run(). By default the fastest backend a kernel has
+    on the machine is used, in the order of PRIORITY. This can be changed by
+    setting the LICHTENSTEIN_BACKEND environment variable to a backend name,
+    or to a list of kernels and backends such as
+    'edge_candidates=pil,colour_mask=python', with set_backend() or by giving
+    the backend to run(). A backend that a kernel doesn't have is skipped.
+    The backend that last ran each kernel is recorded so it can be reported.
+
+    Here is an example of how the code works:
+
+        >>> from PIL import Image
+        >>> import lichtenstein as li
+        >>> img = Image.new('RGB', (128,128), (90,30,200))
+        >>> lich = li.lichtenstein(img)
+        >>> print report() # doctest: +ELLIPSIS
+        colour_mask        ... of ...pil, python
+        edge_candidates    ... of ...pil, python
+        halftone_samples   ... of ...python
+        luminosity         ... of ...pil, python
+        summed_area_tables -        of ...python
+        >>> set_backend('python')
+        >>> lich = li.lichtenstein(img)
+        >>> print report() # doctest: +ELLIPSIS
+        colour_mask        python   of ...pil, python
+        edge_candidates    python   of ...pil, python
+        halftone_samples   python   of ...python
+        luminosity         python   of ...pil, python
+        summed_area_tables -        of ...python
+        >>> set_backend(None)
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the backends module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(backends)
+
+'''
+import os
+from collections import OrderedDict
+
+PRIORITY = ('numpy', 'pil', 'python')
+ENV_VAR = 'LICHTENSTEIN_BACKEND'
+
+registry = {} # kernel : {backend : function}
+ran = OrderedDict() # kernel : the backend that last ran it
+
+
+def parse_choice(value):
+    '''Reads a choice of backends such as 'pil' or 'edge_candidates=pil,
+    colour_mask=python'.
+
+    Parameters:
+        value [str] : A backend for every kernel and/or a comma separated
+                      list of kernel=backend pairs.
+
+    On Exit:
+        Returns a dictionary of each kernel to its backend, where the backend
+        for every kernel is under '*'.
+
+    '''
+    choice = {}
+    for part in (value or '').split(','):
+        if '=' in part:
+            kernel, backend = part.split('=', 1)
+            choice[kernel.strip()] = backend.strip()
+        elif part.strip():
+            choice['*'] = part.strip()
+    return choice
+
+choice = parse_choice(os.environ.get(ENV_VAR))
+
+
+def register(kernel, backend, function):
+    '''Adds an implementation of a kernel.
+
+    Parameters:
+        kernel [str]   : The name of the kernel.
+        backend [str]  : The name of the backend, one of PRIORITY.
+        function       : The implementation. Every backend of a kernel must
+                         take the same parameters and give the same results.
+
+    '''
+    if backend not in PRIORITY:
+        raise ValueError, "'{0}' must be one of {1}".format(backend, PRIORITY)
+    registry.setdefault(kernel, {})[backend] = function
+
+
+def available(kernel):
+    '''Finds the backends of a kernel, fastest first.'''
+    return [b for b in PRIORITY if b in registry.get(kernel, {})]
+
+
+def select(kernel, backend=None):
+    '''Chooses the backend to run a kernel with.
+
+    Parameters:
+        kernel [str]  : The name of the kernel.
+        backend [str] : A backend to use, which the kernel must have. By
+                        default the backend chosen with set_backend() or the
+                        environment variable is used if the kernel has it,
+                        otherwise the fastest backend of the kernel.
+
+    On Exit:
+        Returns the name of the backend.
+
+    '''
+    backends = available(kernel)
+    if not backends:
+        raise ValueError, "'{0}' has no backends".format(kernel)
+    if backend is not None:
+        if backend not in backends:
+            raise ValueError, "'{0}' has no '{1}' backend, only {2}".format(
+                              kernel, backend, backends)
+        return backend
+    for backend in (choice.get(kernel), choice.get('*')):
+        if backend in backends:
+            return backend
+    return backends[0]
+
+
+def run(kernel, *args, **kwargs):
+    '''Runs a kernel with its chosen backend. The backend can be given with
+    the 'backend' keyword, and the rest of the parameters are given to the
+    kernel.'''
+    backend = select(kernel, kwargs.pop('backend', None))
+    ran[kernel] = backend
+    return registry[kernel][backend](*args, **kwargs)
+
+
+def set_backend(backend, kernel='*'):
+    '''Chooses the backend for a kernel, or for every kernel by default. A
+    backend of None goes back to the fastest backend.'''
+    if backend is None:
+        choice.pop(kernel, None)
+    else:
+        choice[kernel] = backend
+
+
+def report():
+    '''Lists the backend that last ran each kernel along with the backends
+    each kernel has.'''
+    lines = []
+    for kernel in sorted(registry):
+        lines.append('{0:<18} {1:<8} of {2}'.format(kernel,
+                     ran.get(kernel, '-'), ', '.join(available(kernel))))
+    return '\n'.join(lines)
+
+
+try:
+    import numpyBackend
+except ImportError:
+    numpyBackend = False
+
+
+if __name__ == "__main__":
+    # The kernels are registered with the imported module, not __main__
+    from PIL import Image
+    import backends
+    import lichtenstein as li
+    img = Image.new('RGB', (128,128), (90,30,200))
+    lich = li.lichtenstein(img)
+    print backends.report()
+    backends.set_backend('python')
+    lich = li.lichtenstein(img)
+    print backends.report()
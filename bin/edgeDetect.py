@@ -28,11 +28,27 @@ r'''
         (25, 127, 0)
         >>>
     
-    Functions that are included are traversing adjacent pixels for linking
-    edge pixels, a Sobel Pixel Desnsity calculator which is used to calculate
-    the gradient of a pixel dependent on the directional Sobel, a find max 
-    value for a dictionary array, the creation of a zeroes 2d dict array
-    and the actual Canny Edge Detection function itself.
+    The dict arrays take hundreds of bytes for each pixel, so 
+    suppressed_magnitudes() keeps its arrays in grid.Grid2D instead, which 
+    is indexed the same way but only takes a few bytes for each pixel. The 
+    functions for 2d dict arrays below accept either of them. Rather than
+    keeping whole images, candidate_rows() does the blur, gradients and non
+    maximum suppression in one pass down the image over a few rows at a 
+    time, which is how the steps are done in plain Python.
+    
+    The pure Python steps are still slow for large images, so without NumPy
+    the gradients and non maximum suppression can also be found with PIL's 
+    own filters and image maths, which run in C. This is the 'pil' backend 
+    of the 'edge_candidates' kernel, see backends, and only the linking of 
+    the edges is left to Python.
+    
+    Functions that are included are linking edge pixels, a Sobel Pixel 
+    Desnsity calculator which is used to calculate the gradient of a pixel 
+    dependent on the directional Sobel, a find max value for a dictionary 
+    array, the creation of a zeroes 2d dict array and the actual Canny Edge
+    Detection function itself. GradientField keeps the steps of Canny Edge
+    Detection that don't depend on the thresholds, so the edges for several
+    thresholds can be found without repeating them.
     
     Here is an example of how the Canny Edge Detect code works:
     
@@ -63,11 +79,13 @@ r'''
     
 '''
 
-import copy
 import math
-from PIL import Image, ImageFilter, ImageDraw
+from itertools import compress, izip, islice
+from PIL import Image, ImageFilter, ImageDraw, ImageMath, ImageChops
 from collections import defaultdict
 import PILAddons as pila
+import backends
+import grid
 
 SOBEL_X = ((-1, 0, 1),
            (-2, 0, 2),
@@ -77,29 +95,6 @@ SOBEL_Y = ((-1,-2,-1),
            ( 0, 0, 0),
            ( 1, 2, 1))
 
-def traverse(coX, coY, edgH, edgL, lineCol):
-    '''Used to check all the adjacent pixels of an assured edge pixel and check 
-    if the pixel from the lower threshold image is an edge, and set that pixel
-    to be an edge.
-    
-    Parameters:
-        coX [int]        : Coordinate-X for the pixel on the image.
-        coY [int]        : Coordinate-Y for the pixel on the image.
-        edgeH [2d array] : The 2d array for the higher threshold edge image.
-        edgeL [2d array] : The 2d array for the lower threshold edge image.
-        lineCol          : The line colour for the edges.
-        
-    On Exit:
-        Mark as valid edge pixels all the weak pixels in 'edgeL' that are 
-        adjacent to the pixel at position [x,y] and are not a valid edge in
-        'edgeH'.
-    
-    '''
-    for x,y in pila.adjacent_pixels(coX, coY):
-        if edgH[x][y]==0 and edgL[x][y]!=0:
-            edgH[x][y]=lineCol+(255,)
-            traverse(x, y, edgH, edgL, lineCol)
-
 def round_degrees(deg):
     '''Rounds the degrees to be either horizontal, vertical or diagonal.
     
@@ -128,6 +123,35 @@ def round_degrees(deg):
     else:
         return 135
 
+# The gradients within 22.5 degrees of horizontal have |gy| <= TAN_22_5*|gx|
+# and those within 22.5 degrees of vertical have |gy| > TAN_67_5*|gx|.
+TAN_22_5 = math.tan(math.radians(22.5))
+TAN_67_5 = math.tan(math.radians(67.5))
+
+def gradient_direction(gx, gy):
+    '''Rounds the direction of a gradient to be either horizontal, vertical or
+    diagonal without finding its angle.
+    
+    Parameters:
+        gx [int] : The horizontal gradient from SOBEL_X.
+        gy [int] : The vertical gradient from SOBEL_Y.
+        
+    On Exit:
+        Returns the same as round_degrees() of the angle of the gradient,
+        either 0, 45, 90 or 135. This is exact for the gradients of 'L' 
+        images.
+        
+    '''
+    ax, ay = abs(gx), abs(gy)
+    if ay <= TAN_22_5*ax:
+        return 0
+    elif ay > TAN_67_5*ax:
+        return 90
+    elif gx*gy > 0: # The same sign is 45 degrees either way
+        return 45
+    else:
+        return 135
+
 def sobel_pixel_density(imgPix, x, y, sobel):
     '''Calculates the pixel density/gradient in a 3 x 3 square using the 
     specified by the sobel.
@@ -166,6 +190,8 @@ def max_2d_dict_array(dArray):
         Returns the maximum value contained within the 2d dict array.
     
     '''
+    if isinstance(dArray, grid.Grid2D):
+        return dArray.max()
     return max(v if not(isinstance(v, defaultdict)) \
                else max_2d_dict_array(v) for v in dArray.itervalues())
     
@@ -180,6 +206,8 @@ def min_2d_dict_array(dArray):
         Returns the minimum value contained within the 2d dict array.
     
     '''
+    if isinstance(dArray, grid.Grid2D):
+        return dArray.min()
     return min(v if not(isinstance(v, defaultdict)) \
                else min_2d_dict_array(v) for v in dArray.itervalues())
 
@@ -230,12 +258,11 @@ def img_from_dict_2darry(dArray, mode='RGB'):
         specified colour mode.
     
     '''
+    if isinstance(dArray, grid.Grid2D) and \
+       grid.IMAGE_MODES.get(dArray.typecode, (None,))[0] == mode:
+        return dArray.to_image()
     size = dict_2darray_max_size(dArray)
-    img = Image.new(mode, size)
-    pix = img.load()
-    for x,y in pila.pixel_generator(*size):
-        pix[x,y] = dArray[x][y]
-    return img
+    return pila.image_from_columns(mode, size, dArray)
         
 def dict_2darray_max_size(dArray):
     '''Finds the max value from a 2d dict array
@@ -248,30 +275,29 @@ def dict_2darray_max_size(dArray):
         Returns the maximum value from within the 2d array
 
     '''
+    if isinstance(dArray, grid.Grid2D):
+        return dArray.size
     yKey = (key for val in dArray.itervalues() for key in val.iterkeys() )
     return max(dArray)+1,max(yKey)+1
         
-def canny_edge_detection(img, sigma=1.4, thresHigh=0.2, thresLow=0.1, 
-                         lineCol=(255,255,255)):
-    '''Uses a method of Canny Edge Deteciton to draw the edges of an image.
+def suppressed_magnitudes(img, sigma=1.4, squared=False):
+    '''Finds the gradient magnitude of each pixel of an image after non 
+    maximum suppression, which are the first steps of Canny Edge Detection.
     
     Parameters:
-        img [PIL image]   : a PIL image object
-        sigma [float]     : the amount of gaussian blur applied to an image to
-                            remove the noise from it.
-        thresHigh [float] : the higher threshold boundry for use with edge
-                            normalisation and linking.
-        thresLow [float]  : the lower threshold boundry for use with edge
-                            normalisation and linking.
-        lineCol [colour]  : a valid PIL colour. Most common format is a 3-tuple
-                            RGB colour.
-                            
+        img [PIL image] : a PIL image object
+        sigma [float]   : the amount of gaussian blur applied to an image to
+                          remove the noise from it.
+        squared [bool]  : whether to use the squared magnitudes, which are 
+                          integers and are compared in the same order 
+                          without finding any square roots.
+                          
     On Exit:
-        Returns an RGBA image with a black background and the edges of the image
-        drawn in the colour 'lineCol' created from the image 'img'.
-        
-    ''' 
+        Returns a grid.Grid2D the size of 'img' holding the magnitude of the
+        gradient at each pixel, with every pixel that isn't the maximum along
+        its gradient direction set to zero.
         
+    '''
     bwImg = img.convert('L') # change image to black and white
     #noNoise = bwImg.filter(ImageFilter.BLUR)
     noNoise = bwImg.filter(ImageFilter.GaussianBlur(sigma))
@@ -281,82 +307,629 @@ def canny_edge_detection(img, sigma=1.4, thresHigh=0.2, thresLow=0.1,
     pix = noNoise.load() # create a pixel access object for pixel colours
     width, height = img.size
 
-    gradX = zeroes_dict_2darray(*img.size) # create 2d arrays with zeroes
-    gradY = zeroes_dict_2darray(*img.size) # the size of the image
-
+    # create 2d arrays with zeroes the size of the image. The gradients of an
+    # 'L' image are at most 1020, so they are kept as 16 bit integers.
+    gradX = grid.Grid2D(width, height, 0, 'h')
+    gradY = grid.Grid2D(width, height, 0, 'h')
+    # The grids are used through their flat arrays, where the pixel at (x,y)
+    # is at y*width + x and its neighbours are 1 and 'width' either side.
+    gxs, gys = gradX.data, gradY.data
 
     # A 1 pixel offset is used since the first edge slides from the corners of
     # the images due to the Sobel edge detection technique
     for x,y in pila.pixel_generator(width,height, 1,1): 
-        px = sobel_pixel_density(pix, x, y, SOBEL_X) 
-        py = sobel_pixel_density(pix, x, y, SOBEL_Y) 
-        gradX[x][y] = px # stores the gradient intensity at each pixel point
-        gradY[x][y] = py # gradX stores the horizontal sobel, gradY the vertical
-    
-    sobelOutMag = dict_array() # Will store the magnitude of each pixel gradient
-    sobelOutDir = dict_array() # Will store the direction of each pixel gradient
-    
-    for x,y in pila.pixel_generator(width, height):
-        sobelOutMag[x][y] = math.hypot(gradX[x][y], gradY[x][y])
-        sobelOutDir[x][y] = math.degrees(math.atan2(gradY[x][y], gradX[x][y]))
-        if sobelOutDir[x][y] < 0:
-            sobelOutDir[x][y] += 360
+        i = y*width + x
+        gxs[i] = sobel_pixel_density(pix, x, y, SOBEL_X) # stores the gradient
+        gys[i] = sobel_pixel_density(pix, x, y, SOBEL_Y) # intensity at each
+                                                         # pixel point
+    
+    # Will store the magnitude and direction of each pixel gradient
+    sobelOutMag = grid.Grid2D(width, height, 0, 'i' if squared else 'd')
+    sobelOutDir = grid.Grid2D(width, height, 0, 'B')
+    mags, dirs = sobelOutMag.data, sobelOutDir.data
+    
+    for i, (gx, gy) in enumerate(izip(gxs, gys)):
+        if squared:
+            mags[i] = gx*gx + gy*gy
+        else:
+            mags[i] = math.hypot(gx, gy)
         # Round each of the grad directions to either horizontal(0), vertical(90)
         # left diagonal(45) or right diagonal(135)
-        sobelOutDir[x][y] = round_degrees(sobelOutDir[x][y])
-                
-    magSup = copy.deepcopy(sobelOutMag)
+        dirs[i] = gradient_direction(gx, gy)
+    del gradX, gradY, gxs, gys # The gradients aren't needed any more
     
     # For each pixel in the direction matrix, if the corresponding pixels
     # magnitude is less than its diagonals, vertical or horizontal we make that
-    # pixel 0.
+    # pixel 0. The offsets to the neighbours along each direction are:
+    steps = {0: 1, 45: width+1, 90: width, 135: width-1}
+    # The magnitudes are suppressed in place rather than in a copy, so each
+    # pixel that is suppressed is marked in the direction grid first, which
+    # a pixel doesn't need once it has been compared, and the magnitudes are
+    # only changed once all of them have been compared.
+    SUPPRESS = 255
     for x,y in pila.pixel_generator(width, height, 1,1):
-        if sobelOutDir[x][y]==0:
-            if (sobelOutMag[x][y]<=sobelOutMag[x+1][y]) or \
-               (sobelOutMag[x][y]<=sobelOutMag[x-1][y]):
-                magSup[x][y]=0
-        elif sobelOutDir[x][y]==45:
-            if (sobelOutMag[x][y]<=sobelOutMag[x+1][y+1]) or \
-               (sobelOutMag[x][y]<=sobelOutMag[x-1][y-1]):
-                magSup[x][y]=0
-        elif sobelOutDir[x][y]==90:
-            if (sobelOutMag[x][y]<=sobelOutMag[x][y+1]) or \
-               (sobelOutMag[x][y]<=sobelOutMag[x][y-1]):
-                magSup[x][y]=0 
+        i = y*width + x
+        step = steps[dirs[i]]
+        if mags[i] <= mags[i+step] or mags[i] <= mags[i-step]:
+            dirs[i] = SUPPRESS
+    for i, mark in enumerate(dirs):
+        if mark == SUPPRESS:
+            mags[i] = 0
+    magSup = sobelOutMag
+
+    return magSup
+
+
+def link_edges(candidates, th, tl):
+    '''Links the edge pixels of the suppressed gradient magnitudes using a 
+    higher and lower threshold.
+    
+    Parameters:
+        candidates [list] : A list of the (x, y, magnitude) of every pixel with 
+                            a non zero suppressed magnitude, not including the
+                            border pixels, ordered by x and then y.
+        th [float]        : The magnitude a pixel must reach to be an edge.
+        tl [float]        : The magnitude a pixel must reach to be an edge 
+                            when it is linked to another edge pixel.
+                            
+    On Exit:
+        Returns a set of the (x,y) positions of the edge pixels. The pixels
+        are visited in the order of 'candidates' and a weak pixel can only be
+        linked to an edge found before the pixel itself is visited.
+        
+    '''
+    weak = set((x,y) for x,y,mag in candidates if tl <= mag < th)
+    edges = set()
+    for x,y,mag in candidates:
+        if mag >= th:
+            edges.add((x,y))
+            stack = [(x,y)]
+            while stack: # follow the weak pixels connected to the edge
+                for nxt in pila.adjacent_pixels(*stack.pop()):
+                    if nxt in weak:
+                        weak.remove(nxt)
+                        edges.add(nxt)
+                        stack.append(nxt)
         else:
-            if (sobelOutMag[x][y]<=sobelOutMag[x-1][y+1]) or \
-               (sobelOutMag[x][y]<=sobelOutMag[x+1][y-1]):
-                magSup[x][y]=0
-
-                 
-    maxMag = max_2d_dict_array(magSup) # Maximum value in magSup
-    th = thresHigh*maxMag # Higher threshold
-    tl = thresLow*maxMag  # lower threshold
-    
-    edgesHigh = zeroes_dict_2darray(width, height)
-    edgesLow = zeroes_dict_2darray(width, height)
-    
-    for x,y in pila.pixel_generator(width, height):
-        # Store pixels with non maximum suppression above th and tl in 
-        # edgesHigh and edgesLow respectively
-        if magSup[x][y] >= th:
-            edgesHigh[x][y] = magSup[x][y]
-        if magSup[x][y] >= tl:
-            edgesLow[x][y] = magSup[x][y]
-        # Normalise the edges by removing all the higher threshold lines from
-        # the lower threshold lines image
-        edgesLow[x][y] -= edgesHigh[x][y]
+            weak.discard((x,y))
+    return edges
+
+
+def edge_candidates(magSup, size):
+    '''Finds the pixels of the suppressed gradient magnitudes that could be 
+    edges.
     
+    Parameters:
+        magSup [2d array] : The 2d array of suppressed gradient magnitudes 
+                            from suppressed_magnitudes().
+        size [tuple]      : The (width, height) of the image.
+                            
+    On Exit:
+        Returns a list of the (x, y, magnitude) of every pixel that isn't on 
+        the border and has a non zero magnitude, ordered by x and then y as 
+        used by link_edges().
+        
+    '''
+    width, height = size
+    candidates = []
+    for x in xrange(1, width-1):
+        col = magSup[x]
+        for y in xrange(1, height-1):
+            if col[y]:
+                candidates.append((x, y, col[y]))
+    return candidates
+
+
+def python_edge_candidates(img, sigma=1.4, squared=False):
+    '''The reference for the 'edge_candidates' kernel, which the backends 
+    are checked against. See backends.
     
-    for x,y in pila.pixel_generator(width, height, 1,1):
-        if edgesHigh[x][y]: # If an edge in edgesHigh doesn't = 0
-            edgesHigh[x][y]= lineCol+(255,) # Make that pixel the specified line colour
-            traverse(x,y,edgesHigh,edgesLow,lineCol) # check adjacent pixels
+    Parameters:
+        img [PIL image] : a PIL image object
+        sigma [float]   : the amount of gaussian blur applied to an image to
+                          remove the noise from it.
+        squared [bool]  : whether to use the squared magnitudes. See 
+                          suppressed_magnitudes().
+                          
+    On Exit:
+        Returns the edge_candidates() of the suppressed_magnitudes() of 'img'
+        along with the largest suppressed magnitude.
+        
+    '''
+    magSup = suppressed_magnitudes(img, sigma, squared)
+    return edge_candidates(magSup, img.size), max_2d_dict_array(magSup)
+
+def blur_halo(sigma):
+    '''Finds how many pixels a gaussian blur of 'sigma' reaches out from each
+    pixel, including the rows needed by the Sobel and non maximum
+    suppression.'''
+    return int(math.ceil(4*sigma)) + 4
+
+
+def blurred_rows(img, sigma=1.4, bandHeight=64):
+    '''Creates a generator for the rows of the blurred black and white image
+    used by Canny Edge Detection, blurring only a band of rows at a time.
+    
+    Parameters:
+        img [PIL image]  : a PIL image object
+        sigma [float]    : the amount of gaussian blur applied to an image to
+                           remove the noise from it.
+        bandHeight [int] : the number of rows blurred at a time, which are 
+                           blurred along with the rows within blur_halo() of
+                           them so they are the same as blurring the whole
+                           image.
+                           
+    On Exit:
+        Yields a bytearray of the blurred pixels of each row from the top.
+        
+    '''
+    width, height = img.size
+    halo = blur_halo(sigma)
+    for y0 in xrange(0, height, bandHeight):
+        y1 = min(y0+bandHeight, height)
+        top, bottom = max(y0-halo, 0), min(y1+halo, height)
+        band = img.crop((0, top, width, bottom)).convert('L')
+        band = band.filter(ImageFilter.GaussianBlur(sigma))
+        rows = bytearray(band.crop((0, y0-top, width, y1-top)).tobytes())
+        for y in xrange(y1-y0):
+            yield rows[y*width:(y+1)*width]
+
+
+def candidate_rows(img, sigma=1.4, squared=False, bandHeight=64):
+    '''Creates a generator for the edge candidates of each row of an image, 
+    doing the blur, gradients, directions and non maximum suppression in a
+    single pass down the image.
+    
+    Only the blurred rows of one band and the few rows of gradients that the
+    Sobel and the suppression look at are kept at a time, so the memory used
+    doesn't depend on the height of the image and each row is still in the
+    cache for every step.
+    
+    Parameters:
+        img [PIL image]  : a PIL image object
+        sigma [float]    : the amount of gaussian blur applied to an image to
+                           remove the noise from it.
+        squared [bool]   : whether to use the squared magnitudes. See 
+                           suppressed_magnitudes().
+        bandHeight [int] : the number of rows blurred at a time. See 
+                           blurred_rows().
+                           
+    On Exit:
+        Yields the y of each row with a non zero suppressed magnitude that 
+        isn't on the border, along with a list of the (x, magnitude) of those
+        pixels from the left, the same as suppressed_magnitudes().
+        
+    '''
+    width, height = img.size
+    if width < 3 or height < 3:
+        return
+    inner = xrange(1, width-1)
+    zeroes = [0]*width
+    
+    # The last three blurred rows, then the magnitudes of the last three rows
+    # and the gradients of the middle one, each along with its y
+    blurred = []
+    mags = [(0, zeroes)] # The top row has no gradient
+    grads = None
+    for y, row in enumerate(blurred_rows(img, sigma, bandHeight)):
+        blurred = blurred[-2:] + [row]
+        if y < 2:
+            continue
+        up, mid, down = blurred
+        if up == mid == down and mid.count(mid[:1]) == width:
+            # The rows are flat, so they have no gradient or edges
+            rowMags, rowGrads = zeroes, None
         else:
-            edgesHigh[x][y] = (0,0,0,0)
-                
-                
-    return img_from_dict_2darry(edgesHigh, 'RGBA')
+            # The Sobel of the middle row, split into its smoothing and 
+            # differencing parts, which is the same as sobel_pixel_density().
+            vSmooth = [u + 2*m + d for u, m, d in izip(up, mid, down)]
+            vDiff = [d - u for u, d in izip(up, down)]
+            gxs = [0] + [vSmooth[x+1] - vSmooth[x-1] for x in inner] + [0]
+            gys = [0] + [vDiff[x-1] + 2*vDiff[x] + vDiff[x+1] 
+                         for x in inner] + [0]
+            if squared:
+                rowMags = [gx*gx + gy*gy for gx, gy in izip(gxs, gys)]
+            else:
+                rowMags = map(math.hypot, gxs, gys)
+            rowGrads = gxs, gys
+        mags = mags[-2:] + [(y-1, rowMags)]
+        grads, rowGrads = rowGrads, grads
+        if y > 2:
+            rowCands = suppress_row(mags, rowGrads, inner)
+            if rowCands:
+                yield mags[1][0], rowCands
+    
+    # The bottom row has no gradient
+    mags = mags[-2:] + [(height-1, zeroes)]
+    rowCands = suppress_row(mags, grads, inner)
+    if rowCands:
+        yield mags[1][0], rowCands
+
+
+def suppress_row(mags, rowGrads, inner):
+    '''Does the non maximum suppression of a row for candidate_rows().
+    
+    Parameters:
+        mags [list]      : The (y, magnitudes) of the row before, the row and 
+                           the row after.
+        rowGrads [tuple] : The lists of the horizontal and vertical gradients
+                           of the row, or None if the row is flat.
+        inner [list]     : The x of each pixel that isn't on the border.
+        
+    On Exit:
+        Returns a list of the (x, magnitude) of each pixel of the row which 
+        is larger than both of the pixels next to it along its direction.
+        
+    '''
+    if rowGrads is None:
+        return []
+    up, mid, down = [rowMags for y, rowMags in mags]
+    gxs, gys = rowGrads
+    rowCands = []
+    # Pixels in flat areas have no magnitude and can't be larger than the 
+    # pixels next to them, so only the rest need a direction.
+    for x in compress(inner, islice(mid, 1, None)):
+        mag = mid[x]
+        d = gradient_direction(gxs[x], gys[x])
+        if d == 0:
+            if mag > mid[x+1] and mag > mid[x-1]:
+                rowCands.append((x, mag))
+        elif d == 45:
+            if mag > down[x+1] and mag > up[x-1]:
+                rowCands.append((x, mag))
+        elif d == 90:
+            if mag > down[x] and mag > up[x]:
+                rowCands.append((x, mag))
+        elif mag > down[x-1] and mag > up[x+1]:
+            rowCands.append((x, mag))
+    return rowCands
+
+
+def stream_edge_candidates(img, sigma=1.4, squared=False):
+    '''The same as python_edge_candidates() but using candidate_rows(), 
+    which is faster and only keeps a few rows of the image at a time.'''
+    candidates = [(x, y, mag) for y, rowCands in candidate_rows(img, sigma, 
+                                                                squared)
+                  for x, mag in rowCands]
+    candidates.sort() # By x and then y, as there is one for each pixel
+    if not candidates:
+        return candidates, 0 if squared else 0.0
+    return candidates, max(mag for x,y,mag in candidates)
+
+backends.register('edge_candidates', 'python', stream_edge_candidates)
+
+
+def pil_sobel(bwImg, sobel):
+    '''Calculates the gradient of every pixel of an image with PIL's kernel 
+    filter.
+    
+    A kernel filter gives an 'L' image, which can't hold the negative or 
+    large gradients, so the filter is used on the top and bottom four bits of 
+    each pixel separately with an offset of 128. Each of these is at most 60 
+    from the offset, so neither is clipped and they are put back together 
+    exactly. PIL's kernel filter uses the first row of the kernel for the
+    row below each pixel, so the rows of the sobel are reversed.
+    
+    Parameters:
+        bwImg [PIL Image]   : An 'L' image.
+        sobel [list][tuple] : The sobel used to calculate the gradient, either
+                              'SOBEL_X' or 'SOBEL_Y'.
+                              
+    On Exit:
+        Returns an 'I' image of the same gradients as sobel_pixel_density()
+        for all but the border pixels, which aren't meaningful.
+        
+    '''
+    kernel = ImageFilter.Kernel((3,3), sum(sobel[::-1], ()), scale=1, 
+                                offset=128)
+    high = bwImg.point(lambda v: v >> 4).filter(kernel)
+    low = bwImg.point(lambda v: v & 15).filter(kernel)
+    return ImageMath.eval("(high - 128)*16 + (low - 128)", high=high, low=low)
+
+
+def pil_gradient_directions(gradX, gradY):
+    '''Rounds the direction of the gradients of an image the same as 
+    gradient_direction().
+    
+    ImageMath only has 32 bit floats, so instead of comparing against 
+    TAN_22_5 the test is done with integers. tan(22.5) is sqrt(2)-1, so 
+    |gy| <= (sqrt(2)-1)*|gx| is the same as (|gx|+|gy|)**2 <= 2*gx**2, which
+    can't be equal unless both are zero. Vertical is the same with gx and gy
+    swapped, and the rest are diagonal in the direction given by their 
+    signs.
+    
+    Parameters:
+        gradX [PIL Image] : An 'I' image of the horizontal gradients.
+        gradY [PIL Image] : An 'I' image of the vertical gradients.
+        
+    On Exit:
+        Returns a list of four 'I' masks of the pixels with directions 0, 45,
+        90 and 135 degrees, which are 1 for those pixels and 0 elsewhere.
+        
+    '''
+    horiz = ImageMath.eval("(abs(gx)+abs(gy))*(abs(gx)+abs(gy)) <= 2*gx*gx",
+                           gx=gradX, gy=gradY)
+    vert = ImageMath.eval("((abs(gx)+abs(gy))*(abs(gx)+abs(gy)) < 2*gy*gy)*"
+                          "(1-h)", gx=gradX, gy=gradY, h=horiz)
+    diag = ImageMath.eval("(gx*gy > 0)*(1-h)*(1-v)", gx=gradX, gy=gradY,
+                          h=horiz, v=vert)
+    antiDiag = ImageMath.eval("(1-h)*(1-v)*(1-d)", h=horiz, v=vert, d=diag)
+    return [horiz, diag, vert, antiDiag]
+
+
+# The pixel before and after each pixel along each gradient direction, in 
+# the order of the directions of pil_gradient_directions(), as the offsets
+# that ImageChops.offset() moves the neighbour onto the pixel with.
+NMS_OFFSETS = (((-1,0), (1,0)),   # 0 degrees, (x+1,y) and (x-1,y)
+               ((-1,-1), (1,1)),  # 45 degrees, (x+1,y+1) and (x-1,y-1)
+               ((0,-1), (0,1)),   # 90 degrees, (x,y+1) and (x,y-1)
+               ((1,-1), (-1,1)))  # 135 degrees, (x-1,y+1) and (x+1,y-1)
+
+
+def pil_edge_candidates(img, sigma=1.4, squared=False):
+    '''The 'pil' 'edge_candidates' kernel, which gives the same results as 
+    python_edge_candidates() using PIL's operations on whole images.
+    
+    The magnitudes are compared squared, which are integers and in the same 
+    order as the magnitudes, except that two pixels with the same squared 
+    magnitude can have magnitudes that differ in the last bit. Those few 
+    pixels are checked with the real magnitudes afterwards. The directions
+    are found from the gradients with the integer tests of 
+    pil_gradient_directions(), so no angles are needed.
+    
+    Parameters:
+        img [PIL image] : a PIL image object
+        sigma [float]   : the amount of gaussian blur applied to an image to
+                          remove the noise from it.
+        squared [bool]  : whether to use the squared magnitudes. See 
+                          suppressed_magnitudes().
+                          
+    On Exit:
+        Returns the same as python_edge_candidates().
+        
+    '''
+    width, height = img.size
+    if width < 3 or height < 3:
+        return [], 0 if squared else 0.0
+    noNoise = img.convert('L').filter(ImageFilter.GaussianBlur(sigma))
+    
+    # The border pixels have no gradient
+    inner = Image.new('I', img.size, 0)
+    inner.paste(1, (1, 1, width-1, height-1))
+    gradX = ImageMath.eval("g*inner", g=pil_sobel(noNoise, SOBEL_X), 
+                           inner=inner)
+    gradY = ImageMath.eval("g*inner", g=pil_sobel(noNoise, SOBEL_Y), 
+                           inner=inner)
+    magSq = ImageMath.eval("gx*gx + gy*gy", gx=gradX, gy=gradY)
+    directions = pil_gradient_directions(gradX, gradY)
+    
+    # The squared magnitudes before and after each pixel along its direction
+    before = after = None
+    for d, offsets in zip(directions, NMS_OFFSETS):
+        shifted = [ImageMath.eval("d*m", d=d, m=ImageChops.offset(magSq, *o))
+                   for o in offsets]
+        if before is None:
+            before, after = shifted
+        else:
+            before = ImageMath.eval("a+b", a=before, b=shifted[0])
+            after = ImageMath.eval("a+b", a=after, b=shifted[1])
+    
+    # 2 where the pixel is the maximum, 1 where it is only as large as one of
+    # the pixels next to it and must be checked, and 0 where it isn't
+    state = ImageMath.eval("inner*(m > 0)*(m >= b)*(m >= a)*"
+                           "(1 + (m > b)*(m > a))", inner=inner, m=magSq, 
+                           b=before, a=after)
+    
+    gxData, gyData = gradX.getdata(), gradY.getdata()
+    def magnitude(x, y):
+        i = y*width + x
+        if squared:
+            return gxData[i]**2 + gyData[i]**2
+        return math.hypot(gxData[i], gyData[i])
+    
+    # The transposed image is ordered by x and then y
+    stateT = state.convert('L').transpose(Image.TRANSPOSE)
+    stateData = stateT.getdata()
+    candidates = []
+    for i in compress(xrange(width*height), bytearray(stateT.tobytes())):
+        x, y = divmod(i, height)
+        mag = magnitude(x, y)
+        if stateData[i] == 1:
+            # Check which direction the pixel has against its neighbours 
+            for n, d in enumerate(directions):
+                if d.getpixel((x,y)):
+                    break
+            if any(mag <= magnitude(x-dx, y-dy) for dx,dy in NMS_OFFSETS[n]):
+                continue
+        candidates.append((x, y, mag))
+    if not candidates:
+        return candidates, 0 if squared else 0.0
+    return candidates, max(mag for x,y,mag in candidates)
+
+backends.register('edge_candidates', 'pil', pil_edge_candidates)
+
+
+def edges_image(edges, size, lineCol=(255,255,255), mode='RGBA'):
+    '''Draws a set of edge pixels.
+    
+    Parameters:
+        edges [set]      : The (x,y) positions of the edge pixels.
+        size [tuple]     : The (width, height) of the image.
+        lineCol [colour] : a valid PIL colour. Most common format is a 3-tuple
+                           RGB colour.
+        mode [str]       : The PIL mode of the image, either 'RGBA' or an 'L'
+                           or '1' mask.
+                           
+    On Exit:
+        Returns an RGBA image with a transparent background and the pixels in
+        'edges' drawn in the colour 'lineCol'. For the 'L' and '1' modes a 
+        mask is returned instead which is 255 at the edge pixels and 0 
+        everywhere else, and 'lineCol' isn't used.
+        
+    '''
+    if mode not in ('RGBA', 'L', '1'):
+        raise ValueError, "'{0}' must be 'RGBA', 'L' or '1'".format(mode)
+    width = size[0]
+    buf = bytearray(width*size[1])
+    for x,y in edges:
+        buf[y*width + x] = 255
+    mask = pila.image_from_buffer('L', size, buf)
+    if mode == 'RGBA':
+        img = Image.new(mode, size, (0,0,0,0))
+        pila.fill_masked(img, tuple(lineCol)+(255,), mask)
+        return img
+    return mask.convert(mode)
+
+
+def hysteresis_edges(magSup, size, th, tl, lineCol=(255,255,255), mode='RGBA'):
+    '''Links the edges from the suppressed gradient magnitudes of an image 
+    using a higher and lower threshold, which is the last step of Canny Edge 
+    Detection.
+    
+    Parameters:
+        magSup [2d array] : The 2d array of suppressed gradient magnitudes 
+                            from suppressed_magnitudes().
+        size [tuple]      : The (width, height) of the image.
+        th [float]        : The magnitude a pixel must reach to be an edge.
+        tl [float]        : The magnitude a pixel must reach to be an edge 
+                            when it is linked to another edge pixel.
+        lineCol [colour]  : a valid PIL colour. Most common format is a 3-tuple
+                            RGB colour.
+        mode [str]        : 'RGBA', or 'L' or '1' for a mask of the edges. See
+                            edges_image().
+                            
+    On Exit:
+        Returns an RGBA image with a transparent background and the linked 
+        edges drawn in the colour 'lineCol'.
+        
+    '''
+    edges = link_edges(edge_candidates(magSup, size), th, tl)
+    return edges_image(edges, size, lineCol, mode)
+
+
+class GradientField(object):
+    '''The suppressed gradient magnitudes of an image, which are the steps of 
+    Canny Edge Detection that don't depend on the thresholds. The edges for 
+    any number of thresholds can be found from the same GradientField, each 
+    only costing the edge linking.
+    
+    Parameters:
+        img [PIL image] : a PIL image object
+        sigma [float]   : the amount of gaussian blur applied to an image to
+                          remove the noise from it.
+        maxMag [float]  : the gradient magnitude that the thresholds are 
+                          relative to. By default this is the largest 
+                          magnitude in 'img'.
+        backend [str]   : the backend of the 'edge_candidates' kernel to use.
+                          By default this is chosen by backends.select().
+        squared [bool]  : whether to keep the squared magnitudes, see 
+                          suppressed_magnitudes(). 'maxMag' must then be
+                          squared as well, and the thresholds are squared
+                          when they are used so they stay relative to the
+                          magnitude.
+                          
+    Attributes:
+        size [tuple]      : The (width, height) of the image.
+        sigma [float]     : The gaussian blur used.
+        maxMag [float]    : The magnitude the thresholds are relative to.
+        squared [bool]    : Whether the magnitudes are squared.
+        
+    '''
+    def __init__(self, img, sigma=1.4, maxMag=None, backend=None, 
+                 squared=False):
+        self.size = img.size
+        self.sigma = sigma
+        self.squared = squared
+        self._candidates, imgMax = backends.run('edge_candidates', img, sigma,
+                                                squared, backend=backend)
+        if maxMag is None:
+            maxMag = imgMax
+        self.maxMag = maxMag
+        
+    @property
+    def magSup(self):
+        '''The grid.Grid2D of the suppressed magnitudes the same as from 
+        suppressed_magnitudes(), which is made when it is needed.'''
+        magSup = grid.Grid2D(self.size[0], self.size[1], 0, 
+                             'i' if self.squared else 'd')
+        for x,y,mag in self._candidates:
+            magSup[x,y] = mag
+        return magSup
+        
+    def edge_pixels(self, thresHigh=0.2, thresLow=0.1):
+        '''Finds the edge pixels for a pair of thresholds.
+        
+        Parameters:
+            thresHigh [float] : the higher threshold relative to 'maxMag'.
+            thresLow [float]  : the lower threshold relative to 'maxMag'.
+            
+        On Exit:
+            Returns a set of the (x,y) positions of the linked edge pixels.
+            
+        '''
+        if self.squared:
+            thresHigh, thresLow = thresHigh**2, thresLow**2
+        return link_edges(self._candidates, thresHigh*self.maxMag, 
+                          thresLow*self.maxMag)
+        
+    def edges(self, thresHigh=0.2, thresLow=0.1, lineCol=(255,255,255), 
+              mode='RGBA'):
+        '''Draws the edges for a pair of thresholds.
+        
+        Parameters:
+            thresHigh [float] : the higher threshold relative to 'maxMag'.
+            thresLow [float]  : the lower threshold relative to 'maxMag'.
+            lineCol [colour]  : a valid PIL colour. Most common format is a 
+                                3-tuple RGB colour.
+            mode [str]        : 'RGBA', or 'L' or '1' for a mask of the edges.
+                                See edges_image().
+                                
+        On Exit:
+            Returns the same image as canny_edge_detection().
+            
+        '''
+        return edges_image(self.edge_pixels(thresHigh, thresLow), self.size,
+                           lineCol, mode)
+
+
+def canny_edge_detection(img, sigma=1.4, thresHigh=0.2, thresLow=0.1, 
+                         lineCol=(255,255,255), maxMag=None, mode='RGBA',
+                         backend=None, squared=False):
+    '''Uses a method of Canny Edge Deteciton to draw the edges of an image.
+    
+    Parameters:
+        img [PIL image]   : a PIL image object
+        sigma [float]     : the amount of gaussian blur applied to an image to
+                            remove the noise from it.
+        thresHigh [float] : the higher threshold boundry for use with edge
+                            normalisation and linking.
+        thresLow [float]  : the lower threshold boundry for use with edge
+                            normalisation and linking.
+        lineCol [colour]  : a valid PIL colour. Most common format is a 3-tuple
+                            RGB colour.
+        maxMag [float]    : the gradient magnitude that the thresholds are 
+                            relative to. By default this is the largest 
+                            magnitude in 'img', but the largest magnitude of a
+                            whole image can be given when 'img' is only a part
+                            of it so every part uses the same thresholds.
+        mode [str]        : 'RGBA', or 'L' or '1' for a mask of the edges 
+                            which is coloured when it is composited. Masks 
+                            use a quarter of the memory and the same mask can
+                            be used for any line colour.
+        backend [str]     : the backend of the 'edge_candidates' kernel. See
+                            GradientField.
+        squared [bool]    : whether to compare the squared magnitudes. See
+                            GradientField.
+                            
+    On Exit:
+        Returns an RGBA image with a black background and the edges of the image
+        drawn in the colour 'lineCol' created from the image 'img', or a mask
+        of the edges in the 'L' and '1' modes. To find the edges of the same 
+        image for several thresholds use GradientField.
+        
+    ''' 
+    field = GradientField(img, sigma, maxMag, backend, squared)
+    return field.edges(thresHigh, thresLow, lineCol, mode)
     
     
 if __name__ == "__main__":
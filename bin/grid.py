@@ -0,0 +1,173 @@
+r'''
+    Module containing a compact 2D grid of numbers for image processing.
+
+    The 2D dict arrays used by edgeDetect keep every value in nested
+    dictionaries, which costs hundreds of bytes for each pixel. Grid2D keeps
+    the values in one flat array.array instead, row by row, so each pixel
+    only costs the size of its type, such as 8 bytes for a float ('d'), 4 for
+    an int ('i') or 1 for a small number ('B'), and NumPy isn't needed.
+
+    A Grid2D can be indexed by [x][y] the same as a 2D dict array, so it can
+    be given to code that was written for them, or by [x, y], which is
+    faster since no column has to be made. Finding the largest or smallest
+    value and filling the grid are done over the whole array at once, and
+    the grid can be turned into a PIL image straight from its bytes.
+
+    Here is an example of how the code works:
+
+        >>> grd = Grid2D(4, 3, typecode='i')
+        >>> grd[2][1] = 7
+        >>> grd[2, 1]
+        7
+        >>> grd.max(), grd.min()
+        (7, 0)
+        >>> grd.to_image().getpixel((2,1))
+        7
+        >>> grd.fill(3)
+        >>> grd[2][1]
+        3
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the grid module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(grid)
+
+'''
+import array
+from PIL import Image
+
+# The PIL mode and raw mode of an image made from each type of array, which
+# are in the byte order of the machine.
+IMAGE_MODES = {'B': ('L', 'L'),
+               'h': ('I', 'I;16S'),
+               'H': ('I', 'I;16'),
+               'i': ('I', 'I'),
+               'f': ('F', 'F'),
+               'd': ('F', 'F;64F')}
+
+# The type of array that holds the pixels of each PIL mode
+IMAGE_TYPECODES = {'L': 'B', 'I': 'i', 'F': 'f'}
+
+
+class Column(object):
+    '''A column of a Grid2D, so that grid[x][y] can be used the same as with
+    a 2D dict array. The values are still kept in the grid, and a y outside
+    the grid raises an IndexError instead of reaching another row.'''
+    __slots__ = ('data', 'x', 'width', 'height')
+
+    def __init__(self, grd, x):
+        self.data = grd.data
+        self.x = x
+        self.width = grd.width
+        self.height = grd.height
+
+    def __getitem__(self, y):
+        if not 0 <= y < self.height:
+            raise IndexError, "row {0} is outside the grid".format(y)
+        return self.data[y*self.width + self.x]
+
+    def __setitem__(self, y, value):
+        if not 0 <= y < self.height:
+            raise IndexError, "row {0} is outside the grid".format(y)
+        self.data[y*self.width + self.x] = value
+
+
+class Grid2D(object):
+    '''A 2D grid of numbers kept row by row in an array.array.
+
+    Parameters:
+        width [int]     : The number of columns, or the width of the image.
+        height [int]    : The number of rows, or the height of the image.
+        value [number]  : The value every position starts with.
+        typecode [str]  : The array.array type code of the values, such as
+                          'd' for floats or 'i' for integers.
+
+    Attributes:
+        width [int]         : The number of columns.
+        height [int]        : The number of rows.
+        typecode [str]      : The type code of the values.
+        data [array.array]  : The values row by row, so the value at (x,y)
+                              is data[y*width + x].
+
+    '''
+    __slots__ = ('width', 'height', 'typecode', 'data')
+
+    def __init__(self, width, height, value=0, typecode='d'):
+        self.width = width
+        self.height = height
+        self.typecode = typecode
+        self.data = array.array(typecode, [value])*(width*height)
+
+    @classmethod
+    def from_image(cls, img):
+        '''Creates a grid of the pixels of an 'L', 'I' or 'F' image.'''
+        if img.mode not in IMAGE_TYPECODES:
+            raise ValueError, "'{0}' images can't be made into a " \
+                              "grid".format(img.mode)
+        grd = cls(img.size[0], img.size[1], 0, IMAGE_TYPECODES[img.mode])
+        grd.data = array.array(grd.typecode, img.tobytes())
+        return grd
+
+    @property
+    def size(self):
+        '''The (width, height) of the grid.'''
+        return self.width, self.height
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            x, y = key
+            return self.data[y*self.width + x]
+        if not 0 <= key < self.width:
+            raise IndexError, "column {0} is outside the grid".format(key)
+        return Column(self, key)
+
+    def __setitem__(self, key, value):
+        x, y = key
+        self.data[y*self.width + x] = value
+
+    def max(self):
+        '''Finds the largest value in the grid.'''
+        return max(self.data)
+
+    def min(self):
+        '''Finds the smallest value in the grid.'''
+        return min(self.data)
+
+    def fill(self, value):
+        '''Sets every value in the grid to 'value'.'''
+        self.data[:] = array.array(self.typecode, [value])*len(self.data)
+
+    def copy(self):
+        '''Creates a copy of the grid with its own values.'''
+        grd = Grid2D(0, 0, 0, self.typecode)
+        grd.width, grd.height = self.width, self.height
+        grd.data = self.data[:]
+        return grd
+
+    def to_image(self):
+        '''Creates a PIL image of the values of the grid straight from the
+        bytes of its array.
+
+        On Exit:
+            Returns an 'L' image for 'B' grids, an 'I' image for 'h', 'H' and
+            'i' grids and an 'F' image for 'f' and 'd' grids, where 'd'
+            values are rounded to 32 bits.
+
+        '''
+        if self.typecode not in IMAGE_MODES:
+            raise ValueError, "'{0}' grids can't be made into an " \
+                              "image".format(self.typecode)
+        mode, rawMode = IMAGE_MODES[self.typecode]
+        return Image.frombytes(mode, self.size, self.data.tostring(), 'raw',
+                               rawMode)
+
+
+if __name__ == "__main__":
+    import doctest
+    import grid
+    nfail, ntests = doctest.testmod(grid)
+    print '{0} of {1} examples failed'.format(nfail, ntests)
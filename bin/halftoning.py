@@ -11,7 +11,25 @@ r'''
     colour for the background of the circles.
     
     Functions that are included are the halftoning function itself which does 
-    the halftoning process.
+    the halftoning process, and a generator for the circles of the halftoning
+    so they can be drawn by other means, such as vector files. The grid of
+    boxes, the centres of the circles and the radius of each luminosity are
+    cached for each geometry, so batches of images of the same size reuse 
+    them.
+    
+    The adaptive halftoning uses large boxes where the image is smooth and
+    splits them into smaller boxes where there is detail, which is found from
+    the variance of the luminosity of each box. The sums of the pixels of
+    any box are found from summed-area tables with four lookups, so the 
+    pixels are only looked at once however many boxes are tried. A budget 
+    of circles can be given, and the boxes with the most detail are split 
+    first until it is used up.
+    
+    The CMYK halftoning separates the image into cyan, magenta, yellow and
+    black inks and draws a screen of circles for each ink at its own angle,
+    the same as printed comics. Each screen samples the summed-area tables 
+    of its ink at the centres of its rotated grid, so the image is never 
+    rotated, and the screens are drawn as masks that are combined at once.
     
     Here is an example of how the Halftoning code works:
     
@@ -37,6 +55,11 @@ r'''
         >>> halfAVGB.show(command='display')
         >>> halfCust = halftoning(img, 5, 1, 4, (AVERAGE_COLOUR, (36,103,145)))
         >>> halfCust.show(command='display')
+        >>> halfAdapt = adaptive_halftoning(img, 16, 1, 4, BLACK_ON_WHITE, 
+        ...                                 levels=2, budget=2000)
+        >>> halfAdapt.show(command='display')
+        >>> halfCMYK = cmyk_halftoning(img, 8, 1, 4)
+        >>> halfCMYK.show(command='display')
         >>>
 
     To test/execute the examples in the module documentation make sure that 
@@ -45,9 +68,17 @@ r'''
     nfail, ntests = doctest.testmod(halftoning)
     
 '''
-from PIL import Image
+import math
+import heapq
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import izip, imap
+from operator import add, mul
+from PIL import Image, ImageChops
 import PILAddons as pila
 import colour as c
+import backends
+from grid import Grid2D
 
 AVERAGE_COLOUR = 'AVERAGE_COLOUR'
 BLACK_ON_WHITE = ((0,0,0), (255,255,255))
@@ -55,8 +86,20 @@ WHITE_ON_BLACK = ((255,255,255), (0,0,0))
 AVERAGE_COLOUR_ON_WHITE = (AVERAGE_COLOUR,  (255,255,255))
 AVERAGE_COLOUR_ON_BLACK = (AVERAGE_COLOUR, (0,0,0))
 
+GEOMETRY_CACHE_SIZE = 16
+cellCache = OrderedDict() # (size, box, origin) : cells of the grid
+centreCache = OrderedDict() # (size, box, origin, aalias) : circle centres
+radiusCache = OrderedDict() # (box, cRatio, aalias, dark) : radius of each level
+screenCache = OrderedDict() # (size, box, angle, origin) : screen circles
+RADIUS_LEVELS = 256 # The whole luminosities the radius of a circle is found for
+ADAPTIVE_DETAIL = 64.0 # The variance of the luminosity of a box to split it
+LUMIN_COEFFS = (0.2126, 0.7152, 0.0722) # The same as colour.luminosity()
+# The classic screen angles of the cyan, magenta, yellow and black inks
+CMYK_ANGLES = (15, 75, 0, 45)
 
-def halftoning(img, box, cRatio=1, aalias=4, colour=BLACK_ON_WHITE):
+
+def halftoning(img, box, cRatio=1, aalias=4, colour=BLACK_ON_WHITE, 
+               origin=(0,0)):
     '''Creates a halftoned PIL Image.
     
     Parameters:
@@ -76,6 +119,11 @@ def halftoning(img, box, cRatio=1, aalias=4, colour=BLACK_ON_WHITE):
                           Currently accepts RGB colours and 'AVERAGE_COLOUR' for
                           the foreground. Foreground is the colour of the 
                           cirlces that will be drawn.
+        origin [tuple]  : The (x,y) position of the top left of 'img' within
+                          a larger image that it has been cropped from. The 
+                          grid of boxes is kept in phase with the larger 
+                          image, so halftoned strips or tiles of an image 
+                          line up with halftoning the whole image at once.
     
     On Exit:
         Draws circles within relative size dependent on the luminosity of the
@@ -85,6 +133,68 @@ def halftoning(img, box, cRatio=1, aalias=4, colour=BLACK_ON_WHITE):
     
         
     '''
+    check_options(box, aalias, colour)
+    
+    img = img.convert('RGB')
+    cells = halftone_cells(img, box, cRatio, aalias, colour, origin)
+    return draw_cells(img.size, cells, aalias, colour[1])
+
+
+def adaptive_halftoning(img, box, cRatio=1, aalias=4, colour=BLACK_ON_WHITE,
+                        levels=2, detail=ADAPTIVE_DETAIL, budget=None, 
+                        origin=(0,0)):
+    '''Creates a halftoned PIL Image with boxes of different sizes, which 
+    are smaller where the image has more detail. See adaptive_cells().
+    
+    Parameters:
+        img [PIL Image] : The same as halftoning().
+        box [int]       : The width and height of the largest boxes, which 
+                          are used where the image is smooth.
+        cRatio [float]  : The same as halftoning().
+        aalias [int]    : The same as halftoning().
+        colour [tuple]  : The same as halftoning().
+        levels [int]    : The number of times a box can be split into four 
+                          smaller boxes. 'box' must divide by 2**levels.
+        detail [float]  : The variance of the luminosity of a box above 
+                          which it is split.
+        budget [int]    : The most circles that can be drawn, or None for 
+                          no limit. The boxes with the most detail are split
+                          first. It can't be less than the number of boxes 
+                          of size 'box' that cover the image.
+        origin [tuple]  : The same as halftoning(). Parts of an image only 
+                          line up with the whole image when there isn't a
+                          budget, since the budget is spent over the part.
+    
+    On Exit:
+        Returns the halftoned RGB PIL image.
+        
+    '''
+    check_options(box, aalias, colour)
+    
+    img = img.convert('RGB')
+    cells = adaptive_cells(img, box, cRatio, aalias, colour, levels, detail,
+                           budget, origin)
+    return draw_cells(img.size, cells, aalias, colour[1])
+
+
+def draw_cells(size, cells, aalias, background):
+    '''Draws the circles of halftoning on an image of the 'background' 
+    colour, 'aalias' times larger than 'size', and scales it down to 'size'
+    to anti-alias the circles.'''
+    htImg = Image.new('RGB', tuple(i*aalias for i in size), background)
+    htDraw = pila.Draw(htImg)
+    
+    cells = list(cells)
+    if cells:
+        cps, rads, finCols = zip(*cells)
+        htDraw.cp_circles(cps, rads, finCols)
+    
+    return htImg.resize(size, resample=Image.ANTIALIAS)
+
+
+def check_options(box, aalias, colour):
+    '''Checks the box, anti-alias and colour options for halftoning are 
+    valid, raising a ValueError explaining the problem if they are not.'''
     if box <= 0:
         raise ValueError('the value for box must be greater than 0')
     if aalias <= 0:
@@ -102,54 +212,504 @@ def halftoning(img, box, cRatio=1, aalias=4, colour=BLACK_ON_WHITE):
             c.rgb_check(colour[1])
     except ValueError as e:
         raise ValueError, "colour is incorrect: {0}".format(e.args[0])
+
+
+def halftone_cells(img, box, cRatio=1, aalias=1, colour=BLACK_ON_WHITE,
+                   origin=(0,0), backend=None):
+    '''Creates a generator for the circles of a halftoned image. The 
+    parameters are the same as halftoning(), along with the backend of the
+    'halftone_samples' kernel, which is chosen by backends.select() by 
+    default.
+    
+    On Exit:
+        Yields the centre point, radius and fill colour of the circle for each
+        box of 'img', scaled up by 'aalias'. The circles are in the order they
+        are drawn.
+        
+    '''
+    check_options(box, aalias, colour)
+    
+    # The circles are larger for darker boxes on a light background, and for
+    # lighter boxes on a dark background
+    dark = c.luminosity(colour[1]) < 127
+    radii = radius_table(box, cRatio, aalias, dark)
+    centres = cell_centres(img.size, box, origin, aalias)
+    average = colour[0] == AVERAGE_COLOUR
+    
+    samples = backends.run('halftone_samples', img.convert('RGB'), box, 
+                           origin, average, backend=backend)
+    for cp, (x, y, col, luminAverage, avgColour) in izip(centres, samples):
+        yield cp, radii[radius_level(luminAverage)], \
+              avgColour if average else colour[0]
+
+
+def cmyk_halftoning(img, box, cRatio=1, aalias=4, angles=CMYK_ANGLES,
+                    origin=(0,0), backend=None):
+    '''Creates a halftoned PIL Image from screens of cyan, magenta, yellow 
+    and black circles at different angles on white paper.
+    
+    Parameters:
+        img [PIL Image] : The same as halftoning().
+        box [int]       : The distance between the circles of each screen,
+                          and the size of the area sampled for each circle.
+        cRatio [float]  : The same as halftoning().
+        aalias [int]    : The same as halftoning().
+        angles [tuple]  : The angle in degrees of the cyan, magenta, yellow
+                          and black screens.
+        origin [tuple]  : The same as halftoning().
+        backend [str]   : The backend of the 'summed_area_tables' kernel.
+    
+    On Exit:
+        Returns the halftoned RGB PIL image. The circle of each ink is as 
+        large as a circle of halftoning() on white for the same amount of 
+        ink.
+        
+    '''
+    check_options(box, aalias, BLACK_ON_WHITE)
+    if len(angles) != 4:
+        raise ValueError, "there must be an angle for each of the 4 inks"
+    
+    img = img.convert('RGB')
+    xs, ys = screen_sides(img.size, box, origin)
+    tables = backends.run('summed_area_tables', cmyk_separation(img), xs, ys,
+                          backend=backend)
+    
+    radii = radius_table(box, cRatio, aalias, True)
+    masks = []
+    for table, angle in izip(tables, angles):
+        mask = Image.new('L', tuple(i*aalias for i in img.size), 0)
+        cells = list(screen_cells(table, img.size, box, angle, origin))
+        if cells:
+            cps, inks = zip(*cells)
+            pila.Draw(mask).cp_circles([(x*aalias, y*aalias) for x, y in cps],
+                                       [radii[radius_level(ink)] 
+                                        for ink in inks], 255)
+        masks.append(mask)
+    
+    # The inks are combined and turned back into RGB in one go
+    htImg = Image.merge('CMYK', masks).resize(img.size, 
+                                              resample=Image.ANTIALIAS)
+    return htImg.convert('RGB')
+
+
+def cmyk_separation(img):
+    '''Separates an RGB PIL image into 'L' images of the cyan, magenta, 
+    yellow and black ink of each pixel, where the black ink replaces as much
+    of the other three as it can.'''
+    cyan, magenta, yellow = [ImageChops.invert(band) for band in img.split()]
+    black = ImageChops.darker(ImageChops.darker(cyan, magenta), yellow)
+    return [ImageChops.subtract(ink, black) for ink in 
+            (cyan, magenta, yellow)] + [black]
+
+
+def screen_sides(size, box, origin=(0,0)):
+    '''Finds the x and y of the sides of the boxes of the summed-area tables
+    of cmyk_halftoning(). The tables are only needed every quarter of a box
+    to sample the boxes, in phase with the complete image.'''
+    step = max(1, box/4)
+    xs = sorted(set([0, size[0]] + range(-origin[0] % step, size[0], step)))
+    ys = sorted(set([0, size[1]] + range(-origin[1] % step, size[1], step)))
+    return xs, ys
+
+
+def screen_cells(table, size, box, angle, origin=(0,0)):
+    '''Creates a generator for the circles of one screen of 
+    cmyk_halftoning().
+    
+    Parameters:
+        table [Grid2D] : The summed-area table of the ink of the screen, from
+                         the 'summed_area_tables' kernel with the sides of 
+                         screen_sides().
+        size [tuple]   : The (width, height) of the image.
+        box [int]      : The distance between the circles.
+        angle [float]  : The angle of the screen in degrees.
+        origin [tuple] : The same as halftoning().
+        
+    On Exit:
+        Yields the centre point of each circle of the screen that has ink 
+        and the average ink of the box around it.
+        
+    '''
+    data = table.data
+    for cp, topLeft, topRight, bottomLeft, bottomRight, n in screen_grid(
+            size, box, angle, origin):
+        total = data[bottomRight] - data[topRight] - data[bottomLeft] + \
+                data[topLeft]
+        if total > 0:
+            yield cp, total/n
+
+
+def screen_grid(size, box, angle, origin=(0,0)):
+    '''Finds the circles of a screen rotated by 'angle' degrees, which are
+    cached for batches the same as cell_grid().
+    
+    On Exit:
+        Returns a tuple of the (x,y) centre of each circle whose box reaches
+        into the image, the positions in a summed-area table of the corners
+        of the box of the table nearest to the box of the circle, and its 
+        number of pixels.
+        
+    '''
+    def make():
+        width, height = size
+        xs, ys = screen_sides(size, box, origin)
+        stride = len(xs)
+        half = box/2.0
+        
+        def side(sides, pos):
+            # The index of the nearest of 'sides' to 'pos'
+            i = bisect_left(sides, pos, 1, len(sides) - 1)
+            return i - 1 if pos - sides[i-1] < sides[i] - pos else i
+        
+        cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+        # The screen is in phase with the complete image, so find the 
+        # range of the rows and columns of the screen that cover this part
+        corners = [(x + origin[0], y + origin[1]) for x in (0, width) 
+                   for y in (0, height)]
+        us = [(x*cos + y*sin)/box for x, y in corners]
+        vs = [(y*cos - x*sin)/box for x, y in corners]
+        cells = []
+        for i in xrange(int(math.floor(min(us))) - 1, int(max(us)) + 1):
+            for j in xrange(int(math.floor(min(vs))) - 1, int(max(vs)) + 1):
+                u, v = (i + 0.5)*box, (j + 0.5)*box
+                cx = u*cos - v*sin - origin[0]
+                cy = u*sin + v*cos - origin[1]
+                i0, i1 = side(xs, cx - half), side(xs, cx + half)
+                j0, j1 = side(ys, cy - half), side(ys, cy + half)
+                n = (xs[i1] - xs[i0])*(ys[j1] - ys[j0])
+                if n > 0:
+                    cells.append(((cx, cy), j0*stride + i0, j0*stride + i1,
+                                  j1*stride + i0, j1*stride + i1, n))
+        return tuple(cells)
+    return cached(screenCache, (tuple(size), box, angle, tuple(origin)), make)
+
+
+def adaptive_cells(img, box, cRatio=1, aalias=1, colour=BLACK_ON_WHITE,
+                   levels=2, detail=ADAPTIVE_DETAIL, budget=None, 
+                   origin=(0,0), backend=None):
+    '''Creates a generator for the circles of an adaptive halftoned image. 
+    The parameters are the same as adaptive_halftoning(), along with the 
+    backend of the 'summed_area_tables' kernel.
+    
+    The image starts as a grid of boxes of size 'box', in phase with 
+    halftoning() but without staggering the columns. The box with the most 
+    detail, which is the variance of its luminosity times its number of 
+    pixels, is split into four until none of the boxes have a variance 
+    above 'detail', they are the smallest size or the next split would go 
+    over 'budget'. The variance is of the 'L' luminosity of PIL, and the 
+    radius is from the luminosity of the average colour of the box.
+    
+    On Exit:
+        Yields the centre point, radius and fill colour of the circle for each
+        box of 'img', scaled up by 'aalias', ordered by x and then y. Raises
+        a ValueError if 'budget' is less than the number of boxes the image
+        starts with.
+        
+    '''
+    check_options(box, aalias, colour)
+    if levels < 0 or box % (1 << levels) != 0:
+        raise ValueError, "the box {0} can't be split {1} times".format(box,
+                                                                        levels)
     
     img = img.convert('RGB')
+    width, height = img.size
+    minBox = box >> levels
+    # The sides of every box are on a grid of the smallest boxes, so the
+    # tables are only needed there
+    xStart = (box/-2 - origin[0]) % box - box
+    yStart = (box/-2 - origin[1]) % box - box
+    xs = sorted(set(min(max(x, 0), width) for x in 
+                    xrange(xStart, width + minBox, minBox)))
+    ys = sorted(set(min(max(y, 0), height) for y in 
+                    xrange(yStart, height + minBox, minBox)))
+    bands = img.split() + (img.convert('L'),)
+    tables = backends.run('summed_area_tables', bands, xs, ys, (3,), 
+                          backend=backend)
+    xIndex = dict((x, i) for i, x in enumerate(xs))
+    yIndex = dict((y, j) for j, y in enumerate(ys))
+    stride = len(xs)
+    
+    def box_sums(x, y, size):
+        # The sums of R, G, B, L and L squared over the pixels of the box
+        i0, i1 = xIndex[max(x, 0)], xIndex[min(x+size, width)]
+        j0, j1 = yIndex[max(y, 0)], yIndex[min(y+size, height)]
+        topLeft, topRight = j0*stride + i0, j0*stride + i1
+        bottomLeft, bottomRight = j1*stride + i0, j1*stride + i1
+        return [t.data[bottomRight] - t.data[topRight] - t.data[bottomLeft] + 
+                t.data[topLeft] for t in tables]
+    
+    def has_pixels(x, y, size):
+        return x + size > 0 and y + size > 0 and x < width and y < height
+    
+    final = [] # The boxes that won't be split
+    cells = [] # A heap of the boxes to split, the most detail first
+    def add(x, y, size):
+        sums = box_sums(x, y, size)
+        n = ((min(x+size, width) - max(x, 0))*
+             (min(y+size, height) - max(y, 0)))
+        variance = sums[4]/n - (sums[3]/n)**2
+        cell = -variance*n, x, y, size, sums, n
+        if variance <= detail or size == minBox:
+            final.append(cell)
+        else:
+            heapq.heappush(cells, cell)
+    
+    for x in xrange(xStart, width, box):
+        for y in xrange(yStart, height, box):
+            if has_pixels(x, y, box):
+                add(x, y, box)
+    if budget is not None and budget < len(cells) + len(final):
+        raise ValueError, "the budget of {0} circles is less than the {1} " \
+                          "boxes of size {2}".format(budget, 
+                                                     len(cells) + len(final),
+                                                     box)
+    while cells:
+        score, x, y, size, sums, n = cells[0]
+        half = size/2
+        children = [(x + dx, y + dy) for dx in (0, half) for dy in (0, half)
+                    if has_pixels(x + dx, y + dy, half)]
+        if budget is not None and \
+           len(cells) + len(final) + len(children) - 1 > budget:
+            break
+        heapq.heappop(cells)
+        for cx, cy in children:
+            add(cx, cy, half)
+    final.extend(cells)
+    final.sort(key=lambda cell: cell[1:3])
+    
+    dark = c.luminosity(colour[1]) < 127
+    average = colour[0] == AVERAGE_COLOUR
+    rc, gc, bc = LUMIN_COEFFS
+    for score, x, y, size, (r, g, b, l, l2), n in final:
+        radii = radius_table(size, cRatio, aalias, dark)
+        luminAverage = (rc*r + gc*g + bc*b)/n
+        if average:
+            finCol = (int(r)//n, int(g)//n, int(b)//n)
+        else:
+            finCol = colour[0]
+        cp = ((x + size/2)*aalias, (y + size/2)*aalias)
+        yield cp, radii[radius_level(luminAverage)], finCol
+
+
+def cached(cache, key, make):
+    '''Finds 'key' in one of the geometry caches, calling make() to create
+    it if it isn't there. The least recently used is forgotten once the
+    cache has GEOMETRY_CACHE_SIZE items.'''
+    if key in cache:
+        cache[key] = value = cache.pop(key) # Most recently used is last
+        return value
+    while len(cache) >= GEOMETRY_CACHE_SIZE:
+        cache.popitem(last=False)
+    cache[key] = value = make()
+    return value
+
+
+def cell_grid(size, box, origin=(0,0)):
+    '''Finds the grid of halftoning boxes of an image. The grid is the same
+    for every image of the same size, so it is cached for batches.
+    
+    Parameters:
+        size [tuple]   : The (width, height) of the image.
+        box [int]      : The size of the boxes.
+        origin [tuple] : The same as halftoning().
+        
+    On Exit:
+        Returns a tuple of the x and y of the top left of each box that has
+        pixels in the image, the offset of its column and the (left, top, 
+        right, bottom) of its pixels within the image. The boxes are in the
+        order they are drawn. The boxes along the left and top edges start
+        outside the image and only sample the pixels inside it, rather than
+        wrapping around to the pixels on the opposite side of the image, so
+        strips and tiles of an image sample the same pixels as the whole.
+        
+    '''
+    def make():
+        width, height = size
+        cells = []
+        # The first box is half a box before the origin of the complete
+        # image, so find where the first box in this part of the image starts.
+        xStart = (box/-2 - origin[0]) % box - box
+        yStart = (box/-2 - origin[1]) % box - box
+        for x in xrange(xStart, width, box):
+            # Every other column is offset by half a box to stagger the circles
+            i = (x + origin[0] - box/-2) / box
+            col = 0 if i % 2 == 0 else box/2
+            for y in xrange(yStart, height, box):
+                # Pixels outside the image range are not part of the sample
+                sample = (max(x, 0), max(y, 0), min(x+box, width), 
+                          min(y+box+col, height))
+                if sample[0] < sample[2] and sample[1] < sample[3]:
+                    cells.append((x, y, col, sample))
+        return tuple(cells)
+    return cached(cellCache, (tuple(size), box, tuple(origin)), make)
+
+
+def cell_centres(size, box, origin=(0,0), aalias=1):
+    '''Finds the centre point of the circle of each box of cell_grid(), 
+    scaled up by 'aalias', which is also cached for batches.'''
+    def make():
+        return tuple(((x + box/2)*aalias, (y + box/2 + col)*aalias)
+                     for x, y, col, sample in cell_grid(size, box, origin))
+    return cached(centreCache, (tuple(size), box, tuple(origin), aalias), 
+                  make)
+
+
+def radius_level(luminosity):
+    '''Rounds the average luminosity, or ink, of a box to the nearest of the
+    RADIUS_LEVELS whole levels that radius_table() is indexed by.'''
+    return int(luminosity + 0.5)
+
+
+def radius_table(box, cRatio=1, aalias=1, dark=False):
+    '''Finds the radius of the halftoning circle for each whole luminosity,
+    which is kept for the next images with the same geometry.
+    
+    Parameters:
+        box [int]      : The size of the boxes.
+        cRatio [float] : The same as halftoning().
+        aalias [int]   : The same as halftoning().
+        dark [bool]    : Whether the background is dark, where the circles
+                         are larger for lighter boxes.
+                         
+    On Exit:
+        Returns a list of the radius for each luminosity from 0 to 255, 
+        which is looked up with radius_level().
+        
+    '''
+    def make():
+        scale = 1.25*cRatio
+        if dark:
+            return [((lumin / 255.0)*box*aalias/2)*scale 
+                    for lumin in xrange(RADIUS_LEVELS)]
+        return [((1 - lumin / 255.0)*box*aalias/2)*scale 
+                for lumin in xrange(RADIUS_LEVELS)]
+    return cached(radiusCache, (box, cRatio, aalias, dark), make)
+
+
+def box_samples(img, box, origin=(0,0), average=False):
+    '''The reference 'halftone_samples' kernel, which samples the pixels of
+    each halftoning box. See backends.
+    
+    Parameters:
+        img [PIL Image] : A PIL 'RGB' image object.
+        box [int]       : The size of the boxes.
+        origin [tuple]  : The same as halftoning().
+        average [bool]  : Whether to find the average colour of each box.
+        
+    On Exit:
+        Yields the x and y of the top left of each box that has pixels in
+        'img', the offset of its column, the average luminosity of its pixels
+        and their average colour, or None if 'average' is False. The boxes
+        are in the order they are drawn.
+        
+    '''
     imgPix = img.load()
+    width = img.size[0]
+    lumins = backends.run('luminosity', img)
     
-    htImg = Image.new('RGB', tuple(i*aalias for i in img.size), colour[1])
-    bgColourLumin = c.luminosity(colour[1]) # Background colour luminosity
+    for x, y, col, sample in cell_grid(img.size, box, origin):
+        extrema = img.crop(sample).getextrema()
+        if all(low == high for low, high in extrema):
+            # A flat box is one colour, so the pixels don't need to be
+            # looked at. The luminosities are still added up one by one
+            # so the average is exactly the same.
+            rgb = tuple(low for low, high in extrema)
+            n = (sample[2] - sample[0])*(sample[3] - sample[1])
+            luminAverage = float(sum([c.luminosity(rgb)]*n))/n
+            yield x, y, col, luminAverage, rgb if average else None
+            continue
+        
+        # The luminosity values of the pixels in the box area, column by 
+        # column
+        boxLumins = [lumins[n*width + v] for v in xrange(sample[0], sample[2])
+                     for n in xrange(sample[1], sample[3])]
+        # This is the luminosity average of the all pixels in the box area
+        luminAverage = float(sum(boxLumins))/len(boxLumins)
+        avgColour = None
+        if average:
+            avgColour = c.average_colours([imgPix[v,n] 
+                                           for v in xrange(sample[0], sample[2])
+                                           for n in xrange(sample[1], sample[3])])
+        yield x, y, col, luminAverage, avgColour
+
+
+def pixel_luminosities(img):
+    '''The reference 'luminosity' kernel, which finds the luminosity of 
+    every pixel of an image with colour.luminosity(). See backends.
     
-    htDraw = pila.Draw(htImg)
+    Parameters:
+        img [PIL Image] : A PIL 'RGB' image object.
+        
+    On Exit:
+        Returns a list of the float luminosity of each pixel of 'img', row by
+        row.
+        
+    '''
+    return [c.luminosity(rgb) for rgb in img.getdata()]
+
+
+def pil_pixel_luminosities(img):
+    '''The PIL 'luminosity' kernel. The parameters and results are the same
+    as pixel_luminosities(). PIL splits the bands of the image and each value
+    is looked up in a table of its weighted luminosity, so they only have to
+    be added up, in the same order as colour.luminosity().'''
+    tables = [[coeff*v for v in xrange(256)] for coeff in LUMIN_COEFFS]
+    red, green, blue = [map(table.__getitem__, bytearray(band.tobytes()))
+                        for table, band in izip(tables, img.split())]
+    return map(add, map(add, red, green), blue)
+
+
+def summed_area_tables(bands, xs, ys, squared=()):
+    '''The reference 'summed_area_tables' kernel, which adds up the pixels 
+    of images for adaptive_cells() and cmyk_halftoning(). See backends.
     
-    for i,x in enumerate(xrange(box/-2, img.size[0], box)):
-        col = 0 if i % 2 == 0 else box/2
-        for y in xrange(box/-2, img.size[1], box):
-            pixelColours = []
-            for v in xrange(x, x+box):
-                for n in xrange(y,y+box+col):
-                    try:
-                        pixelColours.append(imgPix[v,n])
-                    except IndexError:
-                        # This is so that an error isn't raised when pixels
-                        # Outside the image range are queried.
-                        pass 
-                             
-            if len(pixelColours) != 0:
-                # Create luminosity values for each of the rgb values in pixelColours
-                boxLumins = tuple(c.luminosity(rgb) for rgb in pixelColours)
-                
-                if colour[0] == AVERAGE_COLOUR:
-                    finCol = c.average_colours(pixelColours)
-                else:
-                    finCol = colour[0]
-                    
-                # This is the luminosity average of the all pixels in the box area
-                luminAverage = float(sum(boxLumins))/len(boxLumins)
-                
-                # This checks if the backgound colour's luminosity is less than
-                # less then half grey and creates a circle with radius for
-                # if the background is dark of light
-                if bgColourLumin >= 127:
-                    rad = ((1 - luminAverage / 255.0)*box*aalias/2)*(1.25*cRatio)
-                else:
-                    rad = ((luminAverage / 255.0 )*box*aalias/2)*(1.25*cRatio)
-                
-                # Centre point of the circle for the aaliased image
-                cp = (((x+box/2))*aalias,((y+box/2+col))*aalias)
-                
-                htDraw.cp_circle(cp, rad, finCol)
-    
-    return htImg.resize(img.size, resample=Image.ANTIALIAS)
+    Parameters:
+        bands [list]    : PIL 'L' images of the same size.
+        xs [list]       : The x of the sides of the boxes, in order, from 0 
+                          to the width of the images.
+        ys [list]       : The y of the sides of the boxes, in order, from 0 
+                          to the height of the images.
+        squared [tuple] : The index of each of 'bands' to also add up the 
+                          squares of the pixels of.
+                          
+    On Exit:
+        Returns a list of a Grid2D for each of 'bands' and then for the 
+        squares of each of 'squared', where grid[i, j] is the sum of the 
+        pixels to the left of xs[i] and above ys[j]. The sums are whole 
+        numbers.
+        
+    '''
+    width, height = bands[0].size
+    nx, ny = len(xs), len(ys)
+    bands = [bytearray(band.tobytes()) for band in bands]
+    nSums = len(bands) + len(squared)
+    tables = [Grid2D(nx, ny) for n in xrange(nSums)]
+    spans = zip(xs, xs[1:])
+    
+    for j in xrange(1, ny):
+        # The sums of each box of the row of boxes above ys[j]
+        rowSums = [[0]*(nx - 1) for n in xrange(nSums)]
+        squareSums = rowSums[len(bands):]
+        for y in xrange(ys[j-1], ys[j]):
+            rows = [band[y*width:(y+1)*width] for band in bands]
+            for n, (x0, x1) in enumerate(spans):
+                for sums, row in izip(rowSums, rows):
+                    sums[n] += sum(row[x0:x1])
+                for sums, b in izip(squareSums, squared):
+                    part = rows[b][x0:x1]
+                    sums[n] += sum(imap(mul, part, part))
+        for table, sums in izip(tables, rowSums):
+            data = table.data
+            total = 0
+            for i in xrange(1, nx):
+                total += sums[i-1]
+                data[j*nx + i] = data[(j-1)*nx + i] + total
+    return tables
+
+backends.register('halftone_samples', 'python', box_samples)
+backends.register('luminosity', 'python', pixel_luminosities)
+backends.register('luminosity', 'pil', pil_pixel_luminosities)
+backends.register('summed_area_tables', 'python', summed_area_tables)
 
 if __name__ == "__main__":
     f = 'lena.png'
@@ -179,3 +739,10 @@ if __name__ == "__main__":
      
     halfCust = halftoning(img, 5, 1, 4, (AVERAGE_COLOUR, (36,103,145)))
     halfCust.show(command='display')
+    
+    halfAdapt = adaptive_halftoning(img, 16, 1, 4, BLACK_ON_WHITE, levels=2,
+                                    budget=2000)
+    halfAdapt.show(command='display')
+    
+    halfCMYK = cmyk_halftoning(img, 8, 1, 4)
+    halfCMYK.show(command='display')
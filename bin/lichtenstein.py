@@ -42,6 +42,7 @@ import PIL.ImageOps as ImageOps
 import halftoning as ht
 import edgeDetect as ed
 import quantize as qt
+import backends
 
 
 DEFAULT_COLOURS = ((0,0,0), (255,255,255), (190,0,0), (0,16,115), (248,196,0))
@@ -49,7 +50,7 @@ DEFAULT_COLOURS = ((0,0,0), (255,255,255), (190,0,0), (0,16,115), (248,196,0))
 def lichtenstein(img, qtNewCols=DEFAULT_COLOURS, qtSigma=4, qtNCols=8,
                 edSigma=1.4, edThresH=0.2, edThresL=0.1, edColour=(0,0,0),
                 htBox=8, htColour=ht.AVERAGE_COLOUR_ON_WHITE, htCRatio=1,
-                aalias=2):
+                aalias=2, qtPalette=None, edField=None):
     '''Generates a Roy Lichtenstein RGB PIL image from a PIL image.
     
     Parameters:
@@ -79,32 +80,61 @@ def lichtenstein(img, qtNewCols=DEFAULT_COLOURS, qtSigma=4, qtNCols=8,
                             bigger or smaller in scale
         aalias [int]      : The anti-alias amount for the edges of all the 
                             processes
+        qtPalette [list]  : an optional palette of 3-tuple RGB values from
+                            quantize.estimate_palette() for the quantize
+                            process to reduce the image to, instead of the 
+                            adaptive colours of the image
+        edField [GradientField] : an optional edgeDetect.GradientField of 
+                                  'img' to find the edges from, so the edges
+                                  for new thresholds are found without 
+                                  repeating the rest of the edge detection. 
+                                  'edSigma' isn't used when it is given.
                             
         On Exit:
             Generates a Roy Lichtenstein image and returns an RGB PIL image.
         
         '''
     img = img.convert('RGB')
-    quantImg = qt.quantize(img, qtNewCols, qtNCols, qtSigma, aalias)
+    quantImg = qt.quantize(img, qtNewCols, qtNCols, qtSigma, aalias, qtPalette)
     halfImg = ht.halftoning(quantImg, htBox, htCRatio, aalias, htColour)
-    edgeImg = ed.canny_edge_detection(img, edSigma, edThresH, edThresL, edColour)
+    if edField is None:
+        edField = ed.GradientField(img, edSigma)
+    edgeMask = edField.edges(edThresH, edThresL, mode='L')
     
-    edgeMask = ImageOps.invert(pila.convert_rgba_to_mask(edgeImg))
-    
-    halfMask = Image.new('1', img.size)
-    
-    halfMaskPix = halfMask.load()
-    quantPix = quantImg.load()
+    return composite(quantImg, halfImg, edgeMask, qtNewCols, edColour)
+
+
+def composite(quantImg, halfImg, edgeImg, qtNewCols=DEFAULT_COLOURS,
+              edColour=(0,0,0)):
+    '''Combines the quantize, halftoning and edge detect images into the
+    final Roy Lichtenstein image.
     
+    Parameters:
+        quantImg [PIL Image] : the RGB image from the quantize process
+        halfImg [PIL Image]  : the RGB image from the halftoning process
+        edgeImg [PIL Image]  : the 'L' or '1' mask of the edges from the edge
+                               detect process, or its RGBA image
+        qtNewCols [tuple]    : the new colours used for the quantize process.
+                               The halftoning is shown wherever the quantize 
+                               image isn't one of these colours.
+        edColour [tuple]     : the RGB colour the edges are filled with when
+                               'edgeImg' is a mask
+                               
+    On Exit:
+        Returns an RGB PIL image with the edges drawn over the halftoning and
+        the new quantize colours.
+        
+    '''
     # Create a mask for the halftoning, making it visible where the colours
     # are still the orignal adaptive colours and not the new ones.
-    for x,y in pila.pixel_generator(*img.size):
-        if quantPix[x,y] in qtNewCols:
-            halfMaskPix[x,y] = 1
-        else:
-            halfMaskPix[x,y] = 0
-            
+    halfMask = backends.run('colour_mask', quantImg, qtNewCols)
+    
     compQuHt = Image.composite(quantImg, halfImg, halfMask) # Combine quant and half
+    if edgeImg.mode in ('L', '1'):
+        # Fill the edges with a single colour wherever the mask is set
+        pila.fill_masked(compQuHt, edColour, edgeImg)
+        return compQuHt.convert('RGB')
+    edgeMask = ImageOps.invert(pila.convert_rgba_to_mask(edgeImg))
     finalImg = Image.composite(compQuHt, edgeImg, edgeMask) # Combine compQuHt and edge
     return finalImg.convert('RGB')
         
@@ -25,26 +25,39 @@ else:
 									winsound.SND_ALIAS|winsound.SND_ASYNC)
 import lichtenstein as li
 import halftoning as ht
+import edgeDetect as ed
+import PILAddons as pila
 from colour import rgb2hex, hex2rgb
 SMALL_MONITOR_W, SMALL_MONITOR_H = 1280, 1024
+PREVIEW_SIZE = SMALL_MONITOR_W*2, SMALL_MONITOR_H*2
 
 
 class LichThread(threading.Thread):
     
     
-    def __init__(self, queue, img, val):
+    def __init__(self, queue, img, val, fields=None, imgKey=None):
         threading.Thread.__init__(self)
         self.queue = queue
         self.img = img
         self.values = val
+        # The last GradientField made is kept in 'fields' so that only the 
+        # edge linking is repeated when just the edge thresholds change.
+        self.fields = fields if fields is not None else {}
+        self.imgKey = imgKey
         
         
     def run(self):
         val = self.values
+        key = self.imgKey, float(val[3])
+        edField = self.fields.get(key)
+        if edField is None or self.imgKey is None:
+            edField = ed.GradientField(self.img.convert('RGB'), float(val[3]))
+            self.fields.clear()
+            self.fields[key] = edField
         lich = li.lichtenstein(self.img, val[0], float(val[1]), int(val[2]), 
                                float(val[3]), float(val[4]), float(val[5]), 
                                val[6], int(val[7]), val[8], float(val[9]), 
-                               int(val[10])+1)
+                               int(val[10])+1, edField=edField)
         self.queue.put("The Lichtenstein has finished generating")
         self.queue.put(lich)
 
@@ -64,8 +77,11 @@ class ImageViewer(tk.Canvas):
             self.set_image()
     
     def set_image(self, imgLoc=None):
+        # Only a reduced size preview is opened, the full image is opened 
+        # from 'imgLoc' when it is needed.
+        self._imgLoc = imgLoc
         if imgLoc != None:
-            self._image = Image.open(imgLoc)
+            self._image = pila.open_draft(imgLoc, PREVIEW_SIZE)
         else:
             self._image = Image.new('RGB', (512,512), 'white')
         if ImageTk != False:
@@ -161,8 +177,9 @@ class ImageViewer(tk.Canvas):
                                                     outline='black')
         self.update()
         
-    def change_image(self, pilImg):
+    def change_image(self, pilImg, imgLoc=None):
         self._image = pilImg
+        self._imgLoc = imgLoc
         if ImageTk != False:
             self.photo = ImageTk.PhotoImage(self._image)
             if self.photo.width() > self.winfo_width() or \
@@ -173,19 +190,22 @@ class ImageViewer(tk.Canvas):
         
     def change_image_dir(self, imgLoca):
         try:
-            pilImg = Image.open(imgLoca)
-            self.change_image(pilImg)
-        except IOError as e:
-            tkMsgBox.showerror('Invalid File', '{0}.'.format(e.args[0].capitalize()))
+            pilImg = pila.open_draft(imgLoca, PREVIEW_SIZE)
+            self.change_image(pilImg, imgLoca)
+        except (IOError, OSError) as e:
+            msg = e.strerror or e.args[0]
+            tkMsgBox.showerror('Invalid File', '{0}.'.format(msg.capitalize()))
         
     def get(self):
+        if self._imgLoc != None:
+            return Image.open(self._imgLoc)
         return self._image
         
     def show_image(self):
         if platform.system() == 'Windows':
-            self._image.show()
+            self.get().show()
         else:
-            self._image.show(command='display')
+            self.get().show(command='display')
 			
 			
 class ColourTable(tk.Canvas):
@@ -491,6 +511,7 @@ class App(tk.Tk):
         if platform.system() == 'Linux':
             self.fileOptSave['filetypes']
         self.PRESET_NAMES = self.PRESETS.keys()
+        self.edFields = {} # (image file, edge sigma) : GradientField
         
         self.create_widgets()
         
@@ -562,7 +583,7 @@ class App(tk.Tk):
                 
     def setup_lichtenstein(self):
         p = self.parameters
-        img = self.imgViewOrig._image
+        img = self.imgViewOrig.get()
         if p['htColour'][2].get() == True:
             htColour = ht.AVERAGE_COLOUR, p['htColour'][1].get()
         else:
@@ -589,7 +610,12 @@ class App(tk.Tk):
         else:
             self.prgWindow.start()
             self.queue = Queue.Queue()
-            LichThread(self.queue, img, values).start()
+            imgLoc = self.imgViewOrig._imgLoc
+            if imgLoc != None:
+                imgKey = os.path.abspath(imgLoc), os.path.getmtime(imgLoc)
+            else:
+                imgKey = None
+            LichThread(self.queue, img, values, self.edFields, imgKey).start()
             self.after(10, self.process_queue)
         
     def save_image(self):
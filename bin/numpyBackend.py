@@ -0,0 +1,204 @@
+r'''
+    Module containing the NumPy backend of the pixel kernels.
+
+    Importing this module registers a 'numpy' implementation of each kernel
+    with the backends module. NumPy is optional, so the backends module only
+    imports this when NumPy is installed, and otherwise the other backends
+    are used.
+
+    Every kernel gives exactly the same results as the reference Python
+    implementation. Whole arrays are used where the order of the arithmetic
+    doesn't change the result, such as the integer Sobel gradients, but the
+    sums of floats are still added up one after the other in the same order
+    as the reference, since adding them in any other order can change the
+    last bit of the result.
+
+    Here is an example of how the code works:
+
+        >>> from PIL import Image
+        >>> import backends
+        >>> import edgeDetect
+        >>> img = Image.new('RGB', (64,64), (90,30,200))
+        >>> candidates, maxMag = edge_candidates(img, 1.4)
+        >>> candidates == backends.run('edge_candidates', img, 1.4,
+        ...                            backend='python')[0]
+        True
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the numpyBackend module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(numpyBackend)
+
+'''
+import array
+import numpy as np
+from PIL import Image, ImageFilter
+import backends
+import halftoning as ht
+from grid import Grid2D
+
+LUMIN_COEFFS = (0.2126, 0.7152, 0.0722) # The same as colour.luminosity()
+# The (dx,dy) to the pixel after each pixel along each gradient direction, 
+# for 0, 45, 90 and 135 degrees. The pixel before it is the other way.
+NMS_STEPS = ((1,0), (1,1), (0,1), (-1,1))
+
+
+def edge_candidates(img, sigma=1.4, squared=False):
+    '''The NumPy 'edge_candidates' kernel. The parameters and results are
+    the same as edgeDetect.python_edge_candidates().
+
+    The working arrays are kept small, since many of these can run at once:
+    the gradients are int16, which the Sobel of an 'L' image always fits,
+    the directions are uint8 and the magnitudes are compared squared as
+    int32, which keeps their order exactly. The real magnitudes are only
+    found for the candidates and for the few pixels whose squared magnitude
+    equals a neighbour's, the same as edgeDetect.pil_edge_candidates().
+    '''
+    noNoise = img.convert('L').filter(ImageFilter.GaussianBlur(sigma))
+    pix = np.asarray(noNoise, dtype=np.int16)
+    height, width = pix.shape
+    if width < 3 or height < 3:
+        return [], 0 if squared else 0.0
+
+    # The Sobel gradients of the inner pixels, the border pixels are zero
+    gradX = np.zeros((height, width), np.int16)
+    gradY = np.zeros((height, width), np.int16)
+    gradX[1:-1,1:-1] = (pix[:-2,2:] + 2*pix[1:-1,2:] + pix[2:,2:] -
+                        pix[:-2,:-2] - 2*pix[1:-1,:-2] - pix[2:,:-2])
+    gradY[1:-1,1:-1] = (pix[2:,:-2] + 2*pix[2:,1:-1] + pix[2:,2:] -
+                        pix[:-2,:-2] - 2*pix[:-2,1:-1] - pix[:-2,2:])
+    del pix
+    absX = np.abs(gradX).astype(np.int32)
+    absY = np.abs(gradY).astype(np.int32)
+    magSq = absX*absX
+    magSq += absY*absY
+
+    # The same bins as edgeDetect.pil_gradient_directions(), as the index of
+    # each direction in NMS_STEPS
+    directions = np.full((height, width), 3, np.uint8)
+    absX += absY
+    absX *= absX # (|gx|+|gy|)**2
+    directions[(gradX.astype(np.int32)*gradY > 0)] = 1
+    directions[absX < 2*absY*absY] = 2
+    directions[absX <= 2*(magSq - absY*absY)] = 0
+    del absX, absY
+
+    # Each inner pixel is kept when it is larger than the pixels either side
+    # of it along its direction, and is tied when it is only as large as one
+    centre = magSq[1:-1,1:-1]
+    inner = directions[1:-1,1:-1]
+    keep = np.zeros(centre.shape, bool)
+    tied = np.zeros(centre.shape, bool)
+    for n, (dx, dy) in enumerate(NMS_STEPS):
+        ahead = magSq[1+dy:height-1+dy, 1+dx:width-1+dx]
+        behind = magSq[1-dy:height-1-dy, 1-dx:width-1-dx]
+        along = inner == n
+        keep |= along & (centre > ahead) & (centre > behind)
+        if not squared:
+            tied |= along & (centre >= ahead) & (centre >= behind)
+    tied &= ~keep
+    tied &= centre > 0
+
+    # The tied pixels are kept if their magnitude is still the largest
+    def magnitude(ys, xs):
+        return np.hypot(gradX[ys, xs].astype(float), gradY[ys, xs])
+    ys, xs = np.nonzero(tied)
+    ys += 1
+    xs += 1
+    steps = np.array(NMS_STEPS)[directions[ys, xs]]
+    dx, dy = steps[:,0], steps[:,1]
+    mag = magnitude(ys, xs)
+    keep[ys-1, xs-1] = ((mag > magnitude(ys+dy, xs+dx)) &
+                        (mag > magnitude(ys-dy, xs-dx)))
+
+    # Ordered by x and then y
+    xs, ys = np.nonzero(keep.T)
+    xs += 1
+    ys += 1
+    mags = magSq[ys, xs] if squared else magnitude(ys, xs)
+    candidates = zip(xs.tolist(), ys.tolist(), mags.tolist())
+    # The largest suppressed magnitude, where the rest of them are zero
+    if not len(mags):
+        return candidates, 0 if squared else 0.0
+    return candidates, mags.max().item()
+
+
+def luminosity_array(rgb):
+    '''Finds the luminosity of every pixel of an array of RGB pixels, in the
+    same order of arithmetic as colour.luminosity().'''
+    rc, gc, bc = LUMIN_COEFFS
+    return rc*rgb[:,:,0].astype(float) + gc*rgb[:,:,1] + bc*rgb[:,:,2]
+
+
+def luminosities(img):
+    '''The NumPy 'luminosity' kernel. The parameters and results are the 
+    same as halftoning.pixel_luminosities().'''
+    return luminosity_array(np.asarray(img.convert('RGB'))).ravel().tolist()
+
+
+def box_samples(img, box, origin=(0,0), average=False):
+    '''The NumPy 'halftone_samples' kernel. The parameters and results are
+    the same as halftoning.box_samples().'''
+    rgb = np.asarray(img.convert('RGB'), dtype=np.int64)
+    height, width = rgb.shape[:2]
+    lumin = luminosity_array(rgb)
+
+    samples = []
+    for x, y, col, (x0, y0, x1, y1) in ht.cell_grid((width, height), box,
+                                                    origin):
+        n = (x1 - x0)*(y1 - y0)
+        # Added up column by column in the same order as the reference
+        total = np.cumsum(lumin[y0:y1,x0:x1].T.ravel())[-1]
+        avgColour = None
+        if average:
+            sums = rgb[y0:y1,x0:x1].reshape(-1, 3).sum(axis=0)
+            avgColour = tuple(int(s) // n for s in sums)
+        samples.append((x, y, col, float(total)/n, avgColour))
+    return samples
+
+
+def summed_area_tables(bands, xs, ys, squared=()):
+    '''The NumPy 'summed_area_tables' kernel. The parameters and results are
+    the same as halftoning.summed_area_tables(). The sums are of whole
+    numbers, so they can be added up in any order.'''
+    planes = [np.asarray(band, dtype=np.int64) for band in bands]
+    planes += [planes[b]*planes[b] for b in squared]
+    nx, ny = len(xs), len(ys)
+    tables = []
+    for plane in planes:
+        boxes = np.add.reduceat(np.add.reduceat(plane, ys[:-1], axis=0),
+                                xs[:-1], axis=1)
+        sat = np.zeros((ny, nx))
+        sat[1:,1:] = boxes.cumsum(axis=0).cumsum(axis=1)
+        table = Grid2D(nx, ny)
+        table.data = array.array('d', sat.tobytes())
+        tables.append(table)
+    return tables
+
+
+def colour_mask(img, colours):
+    '''The NumPy 'colour_mask' kernel. The parameters and results are the
+    same as PILAddons.colour_mask().'''
+    pix = np.asarray(img)
+    if img.mode in ('L', 'P'):
+        match = np.in1d(pix, list(colours)).reshape(pix.shape)
+    else:
+        match = np.zeros(pix.shape[:2], bool)
+        for col in set(tuple(col) for col in colours):
+            match |= (pix == col).all(axis=2)
+    return Image.fromarray(match.astype(np.uint8)*255, 'L')
+
+
+backends.register('edge_candidates', 'numpy', edge_candidates)
+backends.register('halftone_samples', 'numpy', box_samples)
+backends.register('summed_area_tables', 'numpy', summed_area_tables)
+backends.register('colour_mask', 'numpy', colour_mask)
+backends.register('luminosity', 'numpy', luminosities)
+
+
+if __name__ == "__main__":
+    import doctest
+    import numpyBackend
+    nfail, ntests = doctest.testmod(numpyBackend)
+    print '{0} of {1} examples failed'.format(nfail, ntests)
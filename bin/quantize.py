@@ -11,7 +11,11 @@ r'''
     use of other PIL colour types will be added in the future, such as HSV,
     RGBA, HEX and PIL worded colours. The functions in the module consist of
     calculating the closeness of a colour to another and switching them using
-    colour switch, and the Colour Quantization function itself.
+    colour switch, and the Colour Quantization function itself. For large
+    images, or images that are quantized in parts, the palette can be 
+    estimated once from a downscaled proxy or a stratified sample of the 
+    pixels and then given to every call of quantize, and palette_error 
+    reports how close that estimate is to the palette of the whole image.
     
     Here are some examples of how the code works:
         
@@ -32,6 +36,9 @@ r'''
         >>> quantImg = quantize(img, newCols, nCols=len(curCols)+1, sigma=1)
         >>> img.show(command='display')
         >>> quantImg.show(command='display')
+        >>> pal = estimate_palette(img, len(curCols)+1, 4096, SAMPLE)
+        >>> estErr, fullErr = palette_error(img, pal, len(curCols)+1)
+        >>> quantImg = quantize(img, newCols, len(curCols)+1, 1, palette=pal)
         >>>
         
     To test/execute the examples in the module documentation make sure that 
@@ -40,8 +47,12 @@ r'''
     nfail, ntests = doctest.testmod(quantize)
     
 '''
-from PIL import Image, ImageFilter, ImageDraw
+import math
+import random
+from collections import OrderedDict
+from PIL import Image, ImageFilter, ImageDraw, ImageChops, ImageStat
 import colour as c
+import PILAddons as pila
 
 
 def colour_switch(curC, newC):
@@ -66,8 +77,10 @@ def colour_switch(curC, newC):
     if len(newC) > len(curC):
         raise ValueError, "more values are in new colours over current colours"
     cCloseness = {}
+    cCount = {} # The same colour can be in the current colours more than once
     for cCol in curC:
         cCloseness[cCol] = {}
+        cCount[cCol] = cCount.get(cCol, 0) + 1
         for nCol in newC:
             cCloseness[cCol][nCol] = sum([abs(cCol[i]-nCol[i]) for i in range(3)])
 
@@ -79,11 +92,168 @@ def colour_switch(curC, newC):
                 curCol, close = currentColour, comparisons[newColour]
 
         finalPalette[finalPalette.index(curCol)] = newColour
-        del cCloseness[curCol]
+        cCount[curCol] -= 1
+        if cCount[curCol] == 0:
+            del cCloseness[curCol]
 
     return finalPalette
 
-def quantize(img, newCols, nCols=8, sigma=4, aalias=4):
+PROXY = 'PROXY'
+SAMPLE = 'SAMPLE'
+
+PALETTE_CACHE_SIZE = 16
+paletteImages = OrderedDict() # palette : 'P' image from palette_image()
+
+
+def sample_pixels(img, nPixels, seed=0):
+    '''Takes a stratified sample of the pixels of an image. The image is 
+    split into a grid of equal squares and one random pixel is taken from each
+    square, so every area of the image is represented in the sample.
+    
+    Parameters:
+        img [PIL Image] : A PIL image object.
+        nPixels [int]   : The rough number of pixels to sample. The image is
+                          split into this many squares.
+        seed [hashable] : The seed for the random pixel picked in each square
+                          so that the same sample is taken each time.
+                          
+    On Exit:
+        Returns a list of the colours of the sampled pixels.
+        
+    '''
+    width, height = img.size
+    step = max(1, int(math.sqrt(float(width*height)/nPixels)))
+    rand = random.Random(seed)
+    pix = img.load()
+    return [pix[min(x+rand.randrange(step), width-1), 
+                min(y+rand.randrange(step), height-1)]
+            for y in xrange(0, height, step) for x in xrange(0, width, step)]
+
+
+def estimate_palette(img, nCols=8, maxPixels=262144, method=PROXY):
+    '''Estimates the adaptive palette of an image from a smaller version of
+    it rather than the full image.
+    
+    Parameters:
+        img [PIL Image]  : A PIL image object. Any colour mode can be used but
+                           RGB is preferred. This can also be the location of
+                           an image file, in which case only a reduced size 
+                           copy of the image is decoded.
+        nCols [int]      : The number of colours the palette is made of.
+        maxPixels [int]  : The most pixels that will be used to find the 
+                           palette. Images already smaller than this are used 
+                           at their full size.
+        method [str]     : Either 'PROXY' to use a downscaled copy of the 
+                           image, or 'SAMPLE' to use a stratified sample of
+                           its pixels from sample_pixels(). 
+                           
+    On Exit:
+        Returns a list of 'nCols' 3-tuple RGB colours which are the adaptive
+        colours of the image. This can be given to quantize() as the 'palette'
+        so that many images or parts of an image share the same colours.
+        
+    '''
+    if method not in (PROXY, SAMPLE):
+        raise ValueError, "'{0}' is not a palette estimate method".format(method)
+    if isinstance(img, basestring):
+        width, height = Image.open(img).size
+        scale = min(1.0, (float(maxPixels)/(width*height))**0.5)
+        img = pila.open_draft(img, (max(1, int(width*scale)), 
+                                    max(1, int(height*scale))))
+    img = img.convert('RGB')
+    width, height = img.size
+    if width*height <= maxPixels:
+        smallImg = img.filter(ImageFilter.BLUR)
+    elif method == PROXY:
+        scale = (float(maxPixels)/(width*height))**0.5
+        proxySize = max(1, int(width*scale)), max(1, int(height*scale))
+        smallImg = img.resize(proxySize, resample=Image.ANTIALIAS)
+        smallImg = smallImg.filter(ImageFilter.BLUR)
+    else:
+        return sample_palette(sample_pixels(img, maxPixels), nCols)
+    pImg = smallImg.convert("P", palette=Image.ADAPTIVE, colors=nCols)
+    return c.rgb_unflatten(pImg.getpalette()[:3*nCols])
+
+
+def sample_palette(colours, nCols=8):
+    '''Finds the adaptive palette of a sample of colours, such as the 
+    colours from sample_pixels() of one or many images.
+    
+    Parameters:
+        colours [list] : A list of 3-tuple RGB colours.
+        nCols [int]    : The number of colours the palette is made of.
+        
+    On Exit:
+        Returns a list of 'nCols' 3-tuple RGB colours which best represent 
+        the colours in 'colours'.
+        
+    '''
+    sampleImg = Image.new('RGB', (len(colours), 1))
+    sampleImg.putdata(colours)
+    pImg = sampleImg.convert("P", palette=Image.ADAPTIVE, colors=nCols)
+    return c.rgb_unflatten(pImg.getpalette()[:3*nCols])
+
+
+def palette_error(img, palette, nCols=8):
+    '''Measures how well an estimated palette matches an image compared to
+    the adaptive palette found from the whole image.
+    
+    Parameters:
+        img [PIL Image] : A PIL image object.
+        palette [list]  : A list of 3-tuple RGB colours, such as one from 
+                          estimate_palette().
+        nCols [int]     : The number of colours in the adaptive palette of
+                          the whole image.
+                          
+    On Exit:
+        Returns a 2-tuple of the mean error of each pixel's colour channels 
+        when 'img' is reduced to 'palette', and when it is reduced to the 
+        palette of the whole image.
+        
+    '''
+    img = img.convert('RGB')
+    fullImg = img.convert("P", palette=Image.ADAPTIVE, colors=nCols)
+    fullPalette = c.rgb_unflatten(fullImg.getpalette()[:3*nCols])
+    errors = []
+    for pal in (palette, fullPalette):
+        palImg = img.quantize(palette=palette_image(pal), dither=Image.NONE)
+        diff = ImageChops.difference(img, palImg.convert('RGB'))
+        errors.append(sum(ImageStat.Stat(diff).mean)/3)
+    return tuple(errors)
+
+
+def palette_image(palette):
+    '''Creates a 'P' image holding a palette which can be used to map the
+    colours of an image to that palette.
+    
+    Parameters:
+        palette [list] : A list of 3-tuple RGB colours. There can be no more 
+                         than 256 colours in the list.
+                         
+    On Exit:
+        Returns a 1x1 'P' PIL image with 'palette' as its colour palette. The
+        unused entries are filled with the first colour so no pixel is ever
+        matched to a colour that isn't in 'palette'. The image is kept for 
+        each palette so it is only made once when many images, such as the 
+        frames of an animation, are quantized to the same palette. Only the
+        PALETTE_CACHE_SIZE most recently used palettes are kept.
+        
+    '''
+    palette = tuple(tuple(col) for col in palette)
+    if palette in paletteImages:
+        # Most recently used is last
+        paletteImages[palette] = palImg = paletteImages.pop(palette)
+        return palImg
+    if len(palette) > 256:
+        raise ValueError, "too many palette colours have been specified"
+    palImg = pila.remap_palette(Image.new('P', (1,1)), palette, 'P')
+    while len(paletteImages) >= PALETTE_CACHE_SIZE:
+        paletteImages.popitem(last=False)
+    paletteImages[palette] = palImg
+    return palImg
+
+
+def quantize(img, newCols, nCols=8, sigma=4, aalias=4, palette=None):
     '''Creates a colour quantize image from a PIL Image with new colours.
     
     Parameters:
@@ -97,12 +267,32 @@ def quantize(img, newCols, nCols=8, sigma=4, aalias=4):
         sigma [float]   : The magnitude of the gaussian blur used on the image
                           to de-noise the image for a smoother result.
         aalias [int]    : The anti-alias amount for the edges of the pixels.
+        palette [list]  : An optional list of 3-tuple RGB colours, such as one
+                          from estimate_palette(), to reduce the image to 
+                          instead of finding the adaptive colours of 'img'. 
+                          Used when parts of an image are quantized separately
+                          and must share the same colours.
         
     On Exit:
         Returns an RGB PIL image with the number of colours 'nCols', with the
         colours from 'newCols' replacing their closest matches from the image,
         as well as a noise reduction of 'sigma' and anti alias of 'aalias'.
         
+    '''
+    finImg, curCols = adaptive_quantize(img, nCols, aalias, palette)
+    return recolour(finImg, curCols, newCols)
+
+
+def adaptive_quantize(img, nCols=8, aalias=4, palette=None):
+    '''Reduces an image to its adaptive colours, which is the first step of
+    quantize() before any new colours are switched in. The parameters are the
+    same as quantize().
+    
+    On Exit:
+        Returns a 'P' PIL image the size of 'img' reduced to 'nCols' colours,
+        along with a list of those colours. The image can be given to 
+        recolour() with any number of different new colours.
+        
     '''
     aaliasImg = img.resize((img.size[0]*aalias, img.size[1]*aalias), 
                            resample=Image.ANTIALIAS)
@@ -112,16 +302,34 @@ def quantize(img, newCols, nCols=8, sigma=4, aalias=4):
     #in newer version. See the documentation for more details.
     aaliasImg = aaliasImg.filter(ImageFilter.BLUR)
     
-    finImg = aaliasImg.convert("P", palette=Image.ADAPTIVE, colors=nCols)
-    
-    curCols = c.rgb_unflatten(finImg.getpalette()[:3*nCols])
-    
-    finalPalette = colour_switch(curCols, newCols)
+    if palette is None:
+        finImg = aaliasImg.convert("P", palette=Image.ADAPTIVE, colors=nCols)
+        curCols = c.rgb_unflatten(finImg.getpalette()[:3*nCols])
+    else:
+        curCols = list(palette)
+        finImg = aaliasImg.convert('RGB').quantize(palette=palette_image(curCols),
+                                                   dither=Image.NONE)
     
-    finImg.putpalette(c.rgb_flatten(finalPalette))
+    return finImg.resize(img.size, resample=Image.ANTIALIAS), curCols
+
+
+def recolour(pImg, curCols, newCols):
+    '''Switches the new colours into an image from adaptive_quantize(), 
+    which is the last step of quantize().
     
-    finImg = finImg.resize(img.size, resample=Image.ANTIALIAS)
-    return finImg.convert('RGB')
+    Parameters:
+        pImg [PIL Image] : A 'P' PIL image from adaptive_quantize(). It isn't
+                           changed.
+        curCols [list]   : The list of colours from adaptive_quantize().
+        newCols [list]   : A list of 3-tuple RGB colours to replace there 
+                           closest matching colour on the image.
+                           
+    On Exit:
+        Returns an RGB PIL image with the colours from 'newCols' replacing 
+        their closest matches in 'curCols'.
+        
+    '''
+    return pila.remap_palette(pImg, colour_switch(curCols, newCols))
 
 
 if __name__ == '__main__':
@@ -141,4 +349,6 @@ if __name__ == '__main__':
     quantImg = quantize(img, newCols, nCols=len(curCols)+1, sigma=1)
     img.show(command='display')
     quantImg.show(command='display')
+    pal = estimate_palette(img, len(curCols)+1, 4096, SAMPLE)
+    print palette_error(img, pal, len(curCols)+1)
     
@@ -0,0 +1,221 @@
+r'''
+    Module for the golden image regression corpus of each process.
+
+    The only expected results in exampleResults are JPEGs, which lose detail
+    and were made with an older version of PIL, so they can't show whether a
+    faster version of a process gives exactly the same image. The corpus
+    made here is a set of lossless PNG reference images, one for each case
+    of the quantize, halftoning, Canny Edge Detect and lichtenstein
+    processes, generated from synthetic images by the current code.
+
+    The corpus is kept in exampleResults/06_regression along with the input
+    images and 'manifest.json', which records the process, input and
+    parameters of every case and a hash of the pixels of its reference. The
+    hash is of the mode, size and pixels, so it doesn't depend on how the PNG
+    file was compressed. Any other implementation of a process must pass
+    check_corpus() before it is used. Each case is given the same input and
+    parameters and must give the same pixels, or be within a tolerance when
+    an approximation is allowed.
+
+    The references are the output of the original code for every case it
+    can make, apart from the halftoning and lichtenstein cases, which 
+    differ along the left and top edges. The boxes there start outside the
+    image, and the original code also sampled the pixels on the opposite 
+    side of the image for them, since PIL wraps negative pixel positions. 
+    They now only sample the pixels inside the image, so halftoned strips 
+    and tiles line up with the whole image. The radius of each circle is
+    also now looked up for the average luminosity of its box rounded to a
+    whole level from 0 to 255, rather than for the exact average. This 
+    moves the edge of a few circles by a pixel of the anti-aliased image in
+    halftoning-black, halftoning-average, lichtenstein-default and 
+    lichtenstein-custom, and every other circle is the same. The original 
+    code couldn't make the 'L' edge mask of canny-mask.
+
+    Here is an example of how the code works:
+
+        >>> import shutil, tempfile, StringIO
+        >>> corpusDir, report = tempfile.mkdtemp(), StringIO.StringIO()
+        >>> make_corpus(corpusDir)
+        >>> check_corpus(corpusDir, out=report)
+        []
+        >>> fast = {'quantize': lambda img, **p: qt.quantize(img, **p)}
+        >>> check_corpus(corpusDir, stages=fast, tolerance=2, out=report)
+        []
+        >>> shutil.rmtree(corpusDir)
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the regression module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(regression)
+
+'''
+import os
+import sys
+import json
+import hashlib
+from PIL import Image
+import PILAddons as pila
+import lichtenstein as li
+import halftoning as ht
+import edgeDetect as ed
+import quantize as qt
+import tileCheck as tc
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, 'exampleResults', '06_regression')
+MANIFEST = 'manifest.json'
+
+# The reference implementation of each process, all called as
+# function(img, **params) and returning a PIL image.
+STAGES = {'quantize': qt.quantize,
+          'halftoning': ht.halftoning,
+          'canny_edge_detection': ed.canny_edge_detection,
+          'lichtenstein': li.lichtenstein}
+
+# Each case is its name, process, input (width, height) and seed for
+# tileCheck.test_image() and the parameters for the process.
+CASES = (('quantize-default', 'quantize', (128,96), 1,
+          {'newCols': li.DEFAULT_COLOURS}),
+         ('quantize-4cols', 'quantize', (97,61), 2,
+          {'newCols': ((255,255,255), (20,20,20)), 'nCols': 4, 'aalias': 3}),
+         ('quantize-thin', 'quantize', (53,1), 3,
+          {'newCols': li.DEFAULT_COLOURS, 'nCols': 8, 'aalias': 1}),
+         ('halftoning-black', 'halftoning', (128,96), 1,
+          {'box': 8, 'colour': ht.BLACK_ON_WHITE}),
+         ('halftoning-average', 'halftoning', (97,61), 2,
+          {'box': 5, 'cRatio': 1.3, 'aalias': 2,
+           'colour': ht.AVERAGE_COLOUR_ON_WHITE}),
+         ('halftoning-dark', 'halftoning', (61,47), 3,
+          {'box': 11, 'cRatio': 0.7, 'aalias': 1,
+           'colour': ht.WHITE_ON_BLACK}),
+         ('canny-default', 'canny_edge_detection', (128,96), 1, {}),
+         ('canny-wide', 'canny_edge_detection', (97,61), 2,
+          {'sigma': 2.2, 'thresHigh': 0.3, 'thresLow': 0.05,
+           'lineCol': (200,10,30)}),
+         ('canny-mask', 'canny_edge_detection', (61,47), 3,
+          {'sigma': 1.0, 'mode': 'L'}),
+         ('lichtenstein-default', 'lichtenstein', (128,96), 1, {}),
+         ('lichtenstein-custom', 'lichtenstein', (97,61), 2,
+          {'qtNCols': 6, 'edSigma': 1.8, 'edColour': (125,0,0), 'htBox': 6,
+           'htColour': ht.AVERAGE_COLOUR_ON_BLACK, 'htCRatio': 1.1,
+           'aalias': 3}),
+         ('lichtenstein-prime', 'lichtenstein', (53,41), 3,
+          {'htBox': 5, 'edThresH': 0.25, 'aalias': 1}))
+
+
+def pixel_hash(img):
+    '''Finds the SHA-1 hash of the mode, size and pixels of an image.'''
+    sha = hashlib.sha1('{0} {1}x{2}\n'.format(img.mode, *img.size))
+    sha.update(img.tobytes())
+    return sha.hexdigest()
+
+
+def input_name(size, seed):
+    '''Finds the file name of the input image of a case.'''
+    return 'input-{0}x{1}-{2}.png'.format(size[0], size[1], seed)
+
+
+def make_corpus(corpusDir=CORPUS_DIR, cases=CASES):
+    '''Generates the reference images of every case with the reference
+    implementations.
+
+    Parameters:
+        corpusDir [str] : The folder to write the corpus to.
+        cases [tuple]   : The cases to generate, in the same format as
+                          CASES.
+
+    On Exit:
+        Writes the input images, the reference PNG image of each case and the
+        manifest to 'corpusDir', replacing any that were already there.
+
+    '''
+    if not os.path.isdir(corpusDir):
+        os.makedirs(corpusDir)
+    manifest = []
+    for name, stage, size, seed, params in cases:
+        inName = input_name(size, seed)
+        img = tc.test_image(size, seed)
+        img.save(os.path.join(corpusDir, inName))
+        ref = STAGES[stage](img, **params)
+        ref.save(os.path.join(corpusDir, name+'.png'))
+        manifest.append({'name': name, 'stage': stage, 'input': inName,
+                         'inputHash': pixel_hash(img), 'params': params,
+                         'file': name+'.png', 'hash': pixel_hash(ref),
+                         'mode': ref.mode, 'size': ref.size})
+    with open(os.path.join(corpusDir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def check_corpus(corpusDir=CORPUS_DIR, stages=None, tolerance=0,
+                 outDir=None, out=None):
+    '''Checks the processes against the reference images of the corpus.
+
+    Parameters:
+        corpusDir [str]   : The folder of the corpus.
+        stages [dict]     : The implementations to check for any of the
+                            processes in STAGES, called in the same way.
+                            Processes that aren't given use the reference
+                            implementation.
+        tolerance [int]   : The largest difference allowed in any band of any
+                            pixel. This is zero unless the implementation is
+                            allowed to approximate.
+        outDir [str]      : The folder the images of failed cases are saved
+                            to. By default these aren't saved.
+        out [file]        : Where the result of every case is written. None
+                            writes it to sys.stdout.
+
+    On Exit:
+        Writes the result of every case to 'out' and returns a list of the
+        names of the cases that failed.
+
+    '''
+    if out is None:
+        out = sys.stdout
+    funcs = dict(STAGES)
+    funcs.update(stages or {})
+    with open(os.path.join(corpusDir, MANIFEST)) as f:
+        manifest = json.load(f)
+
+    failures = []
+    for case in manifest:
+        name = case['name']
+        img = Image.open(os.path.join(corpusDir, case['input']))
+        img.load()
+        if pixel_hash(img) != case['inputHash']:
+            raise ValueError, "the input of '{0}' has changed".format(name)
+        params = dict((str(k), v) 
+                      for k, v in pila.tuples(case['params']).items())
+        try:
+            res = funcs[case['stage']](img, **params)
+        except Exception as e:
+            out.write('{0:<24} FAIL {1!r}\n'.format(name, e))
+            failures.append(name)
+            continue
+        if pixel_hash(res) == case['hash']:
+            out.write('{0:<24} ok   identical\n'.format(name))
+            continue
+
+        ref = Image.open(os.path.join(corpusDir, case['file']))
+        ref.load()
+        if res.mode != ref.mode or res.size != ref.size:
+            out.write('{0:<24} FAIL {1} {2} instead of {3} {4}\n'.format(
+                      name, res.mode, res.size, ref.mode, ref.size))
+            failures.append(name)
+            continue
+        maxDev, meanDev, nDiff = tc.compare(ref, res)
+        passed = maxDev <= tolerance
+        out.write('{0:<24} {1} max {2:>3} mean {3:.4f} pixels {4}\n'.format(
+                  name, 'ok  ' if passed else 'FAIL', maxDev, meanDev, nDiff))
+        if not passed:
+            failures.append(name)
+            if outDir is not None:
+                tc.dump_diff(name, ref, res, outDir, ('reference', 'result'))
+    return failures
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['make']:
+        make_corpus()
+    else:
+        sys.exit(1 if check_corpus() else 0)
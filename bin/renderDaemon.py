@@ -0,0 +1,471 @@
+r'''
+    Module for a rendering daemon that keeps the processes loaded and warm.
+
+    Every batch run or GUI worker that starts Python to render an image pays
+    for starting Python, importing PIL and its file plugins and the modules
+    here, and filling the caches of circle stamps, radius tables and box
+    grids again. For small images such as thumbnails this takes longer than
+    the rendering itself. The daemon is started once and renders every job
+    sent to it in a pool of worker processes, which import everything and
+    warm up their caches when they start and keep them for every job after.
+
+    Jobs are sent over a Unix domain socket, or a localhost TCP port where
+    there aren't Unix sockets, by Client. Each message is a JSON header of
+    the job and the bytes of an image, which can be an image file or the raw
+    pixels of a PIL image. A job can also give the location of an image file
+    to read and of a file to save the result to, so only the locations are
+    sent. Images can also be handed over in shared memory with sharedImage,
+    in both directions, so that only a handle is sent. The client releases
+    a result in shared memory once it has read it, and the daemon releases
+    it when the client sends its next message or goes, in case it didn't. 
+    The connection stays open for any number of jobs, and the daemon runs 
+    the jobs of several clients at once.
+
+    The daemon reads and writes files with the permissions of the user that
+    started it, so only that user can connect to its Unix socket, which is 
+    kept in a folder of their own by default. Any local user can connect to
+    a TCP port, so jobs sent over TCP can't give the locations of files or 
+    use shared memory, and Client sends their images instead.
+
+    Here is an example of how the code works:
+
+        >>> from PIL import Image
+        >>> import multiprocessing
+        >>> daemon = multiprocessing.Process(target=serve,
+        ...                                  args=('render.sock', 2))
+        >>> daemon.start()
+        >>> client = Client('render.sock')
+        >>> img = Image.new('RGB', (128,96), (90,30,200))
+        >>> lich = client.render('lichtenstein', img, htBox=6)
+        >>> lich.size
+        (128, 96)
+        >>> half = client.render('halftoning', img, box=8,
+        ...                      colour=ht.BLACK_ON_WHITE)
+        >>> client.stop()
+        >>> client.close()
+        >>> daemon.join()
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the renderDaemon module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(renderDaemon)
+
+'''
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import tempfile
+import threading
+import multiprocessing
+import SocketServer
+from cStringIO import StringIO
+from PIL import Image
+import PILAddons as pila
+import lichtenstein as li
+import halftoning as ht
+import edgeDetect as ed
+import quantize as qt
+import backends
+import sharedImage as sh
+
+if hasattr(socket, 'AF_UNIX'):
+    # A folder only the user can use, so no one else can reach the socket
+    RUNTIME_DIR = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(
+        tempfile.gettempdir(), 'lichtenstein-{0}'.format(os.getuid()))
+    DEFAULT_ADDRESS = os.path.join(RUNTIME_DIR, 'lichtenstein.sock')
+else:
+    DEFAULT_ADDRESS = ('127.0.0.1', 8617)
+LOCALHOST = ('127.0.0.1', 'localhost')
+HEADER = struct.Struct('!IQ') # The lengths of the JSON header and the data
+# The parts of a job that are locations the daemon reads or writes
+PATH_KEYS = ('file', 'outFile', 'shared')
+
+# The processes the daemon can run, all called as function(img, **params)
+# and returning a PIL image.
+PROCESSES = {'lichtenstein': li.lichtenstein,
+             'quantize': qt.quantize,
+             'halftoning': ht.halftoning,
+             'adaptive_halftoning': ht.adaptive_halftoning,
+             'cmyk_halftoning': ht.cmyk_halftoning,
+             'canny_edge_detection': ed.canny_edge_detection}
+
+
+def send_message(sock, header, data=''):
+    '''Sends a JSON header and the bytes that go with it over a socket.'''
+    header = json.dumps(header)
+    sock.sendall(HEADER.pack(len(header), len(data)) + header)
+    if data:
+        sock.sendall(data)
+
+
+def receive_exactly(sock, size):
+    '''Receives 'size' bytes from a socket, raising an EOFError if it closes
+    first.'''
+    parts = []
+    while size > 0:
+        part = sock.recv(min(size, 1 << 20))
+        if not part:
+            raise EOFError, "the connection was closed"
+        parts.append(part)
+        size -= len(part)
+    return ''.join(parts)
+
+
+def receive_message(sock):
+    '''Receives a message sent by send_message().
+
+    On Exit:
+        Returns the header and the bytes of the message. Raises an EOFError
+        if the socket is closed before the next message.
+
+    '''
+    headerSize, dataSize = HEADER.unpack(receive_exactly(sock, HEADER.size))
+    header = json.loads(receive_exactly(sock, headerSize))
+    return header, receive_exactly(sock, dataSize)
+
+
+def warm_up():
+    '''Loads the PIL file plugins and fills the caches of a worker process
+    by rendering a small image with the default options.'''
+    Image.init()
+    img = Image.new('RGB', (64,64))
+    pix = img.load()
+    for x in xrange(64):
+        for y in xrange(64):
+            pix[x,y] = (x*4, 128, y*4)
+    li.lichtenstein(img)
+    ht.halftoning(img, 8, 1, 4, ht.BLACK_ON_WHITE)
+
+
+def run_job(header, data):
+    '''Runs a job in a worker process of the daemon.
+
+    Parameters:
+        header [dict] : The job. 'process' is the name of one of PROCESSES
+                        and 'params' are its parameters. The image is read
+                        from the file at 'file' or the sharedImage handle at
+                        'shared' if one is given, otherwise 'data' is the 
+                        raw pixels of an image of 'mode' and 'size', or an 
+                        image file if they aren't given. The result is saved
+                        to the file at 'outFile' if it is given, shared if
+                        'shared' is given, otherwise it is sent back as an 
+                        image file of 'format', or as raw pixels if the 
+                        format is None.
+        data [str]    : The bytes of the image.
+
+    On Exit:
+        Returns the header and bytes of the reply.
+
+    '''
+    process = header.get('process')
+    if process not in PROCESSES:
+        raise ValueError, "'{0}' is not one of {1}".format(process,
+                                                           sorted(PROCESSES))
+    if header.get('file'):
+        img = Image.open(header['file'])
+    elif header.get('shared'):
+        path, mode, size = header['shared']
+        img = sh.crop_shared(sh.ImageHandle(path, mode, tuple(size)))
+    elif header.get('mode'):
+        img = Image.frombytes(header['mode'], tuple(header['size']), data)
+    else:
+        img = Image.open(StringIO(data))
+    params = dict((str(k), v) for k, v in
+                  pila.tuples(header.get('params', {})).iteritems())
+    res = PROCESSES[process](img, **params)
+
+    if header.get('outFile'):
+        res.save(header['outFile'])
+        return {'outFile': header['outFile']}, ''
+    if header.get('shared'):
+        return {'shared': sh.share(res)}, ''
+    if header.get('format') is None:
+        return {'mode': res.mode, 'size': res.size}, res.tobytes()
+    out = StringIO()
+    res.save(out, header['format'])
+    return {'format': header['format']}, out.getvalue()
+
+
+class RenderHandler(SocketServer.BaseRequestHandler):
+    '''Receives the jobs of a client and sends back their results. Each job
+    is run in the worker pool of the server, and errors are sent back to the
+    client instead of stopping the daemon.'''
+    def handle(self):
+        shared = [] # The handles of the results sent in shared memory
+        try:
+            self.handle_jobs(shared)
+        except socket.error:
+            pass # The client went without closing the connection
+        finally:
+            # The client may have gone before it read its last result
+            for handle in shared:
+                sh.release(handle)
+
+    def handle_jobs(self, shared):
+        while True:
+            try:
+                header, data = receive_message(self.request)
+            except EOFError:
+                return
+            # The client has read the results it was sent before this
+            while shared:
+                sh.release(shared.pop())
+            process = header.get('process')
+            if process == 'ping':
+                send_message(self.request, {'pid': os.getpid(),
+                             'workers': self.server.workers,
+                             'processes': sorted(PROCESSES)})
+            elif process == 'stop':
+                send_message(self.request, {})
+                # shutdown() waits for serve_forever(), so it can't be
+                # called from the thread of a request
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            else:
+                start = time.time()
+                try:
+                    if not self.server.private and \
+                       any(header.get(key) for key in PATH_KEYS):
+                        raise ValueError, "jobs sent over TCP can't use " \
+                                          "the locations of files"
+                    reply, res = self.server.pool.apply(run_job,
+                                                        (header, data))
+                except Exception as e:
+                    send_message(self.request, {'error': '{0}: {1}'.format(
+                                 type(e).__name__, e)})
+                    continue
+                if 'shared' in reply:
+                    shared.append(reply['shared'])
+                reply['seconds'] = time.time() - start
+                send_message(self.request, reply, res)
+
+
+class UnixRenderServer(SocketServer.ThreadingMixIn,
+                       SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPRenderServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def check_private(path):
+    '''Raises a ValueError unless the file or folder at 'path' belongs to 
+    the user and no one else can use it.'''
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0077:
+        raise ValueError, "'{0}' must belong to the user and not be open " \
+                          "to anyone else".format(path)
+
+
+def connect(address=DEFAULT_ADDRESS):
+    '''Connects a socket to a daemon at the Unix socket location or the
+    (host, port) 'address'. A Unix socket must belong to the user, so it
+    can't be one another user has put there.'''
+    if isinstance(address, basestring):
+        if os.path.exists(address):
+            check_private(address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock
+
+
+def serve(address=DEFAULT_ADDRESS, workers=None):
+    '''Runs the daemon until it is sent a stop message or interrupted.
+
+    Parameters:
+        address [str][tuple] : The location of the Unix socket to listen on,
+                               or the (host, port) of a localhost TCP port.
+                               The socket can only be used by the user, and
+                               its folder is made if it isn't there.
+        workers [int]        : The number of worker processes, or None for
+                               the number of CPUs.
+
+    On Exit:
+        Stops the worker processes and removes the Unix socket.
+
+    '''
+    if isinstance(address, basestring):
+        directory = os.path.dirname(os.path.abspath(address))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        if address == DEFAULT_ADDRESS:
+            check_private(directory)
+        if os.path.exists(address):
+            try:
+                connect(address).close()
+            except socket.error:
+                os.remove(address) # Left behind by a daemon that has gone
+            else:
+                raise ValueError, "a daemon is already running at " \
+                                  "'{0}'".format(address)
+        # The socket is made private as it is made, so no one else can 
+        # connect before it is changed
+        oldMask = os.umask(0077)
+        try:
+            server = UnixRenderServer(address, RenderHandler)
+        finally:
+            os.umask(oldMask)
+        os.chmod(address, 0600)
+        server.private = True
+    else:
+        if address[0] not in LOCALHOST:
+            raise ValueError, "the daemon can only listen on localhost, not " \
+                              "'{0}'".format(address[0])
+        server = TCPRenderServer(tuple(address), RenderHandler)
+        server.private = False
+
+    server.pool = multiprocessing.Pool(workers, warm_up)
+    server.workers = workers or multiprocessing.cpu_count()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.close()
+        server.pool.join()
+        if isinstance(address, basestring) and os.path.exists(address):
+            os.remove(address)
+
+
+class Client(object):
+    '''A connection to a running daemon, which any number of jobs can be
+    sent over.
+
+    Parameters:
+        address [str][tuple] : The same as serve().
+        timeout [float]      : The seconds to keep trying to connect for,
+                               such as while the daemon is starting.
+
+    '''
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=10):
+        # Only jobs sent over a Unix socket can use the locations of files
+        self.private = isinstance(address, basestring)
+        end = time.time() + timeout
+        while True:
+            try:
+                self.sock = connect(address)
+                break
+            except socket.error:
+                if time.time() > end:
+                    raise
+                time.sleep(0.05)
+
+    def request(self, header, data=''):
+        '''Sends a message to the daemon and returns its reply, raising a
+        ValueError with the error of the daemon if the job failed.'''
+        send_message(self.sock, header, data)
+        reply, data = receive_message(self.sock)
+        if 'error' in reply:
+            raise ValueError, reply['error']
+        return reply, data
+
+    def render(self, process, img, outFile=None, format=None, shared=True,
+               **params):
+        '''Renders an image with the daemon.
+
+        Parameters:
+            process [str]        : The name of one of PROCESSES.
+            img [PIL Image][str] : The image, the location of an image file
+                                   the daemon reads itself, or a file object
+                                   of an image file. Over TCP the file is 
+                                   read and sent.
+            outFile [str]        : The location for the daemon to save the
+                                   result to, instead of sending it back. 
+                                   Over TCP the result is sent back and 
+                                   saved here.
+            format [str]         : The PIL format of the image file the
+                                   result is sent back as, or None to send
+                                   its raw pixels.
+            shared [bool]        : Whether to hand a PIL image and the result
+                                   over in shared memory instead of sending
+                                   their pixels, when 'format' is None and
+                                   the daemon is on a Unix socket.
+
+            The rest of the parameters are given to the process and must be
+            JSON types, where tuples are sent as lists and turned back into
+            tuples.
+
+        On Exit:
+            Returns the resulting PIL image, or 'outFile' when the daemon
+            saves it.
+
+        '''
+        header = {'process': process, 'params': params, 'format': format}
+        data = ''
+        handle = None
+        if outFile and self.private:
+            header['outFile'] = os.path.abspath(outFile)
+        if isinstance(img, basestring):
+            if self.private:
+                header['file'] = os.path.abspath(img)
+            else:
+                with open(img, 'rb') as f:
+                    data = f.read()
+        elif hasattr(img, 'read'):
+            data = img.read()
+        elif shared and self.private and format is None and img.mode != 'P':
+            handle = header['shared'] = sh.share(img)
+        else:
+            header['mode'], header['size'] = img.mode, img.size
+            data = img.tobytes()
+
+        try:
+            reply, data = self.request(header, data)
+        finally:
+            if handle is not None:
+                sh.release(handle)
+        if 'outFile' in reply:
+            return outFile
+        if 'shared' in reply:
+            path, mode, size = reply['shared']
+            result = sh.ImageHandle(path, mode, tuple(size))
+            try:
+                res = sh.crop_shared(result)
+            finally:
+                sh.release(result)
+        elif 'mode' in reply:
+            res = Image.frombytes(reply['mode'], tuple(reply['size']), data)
+        else:
+            res = Image.open(StringIO(data))
+            res.load()
+        if outFile:
+            res.save(outFile)
+            return outFile
+        return res
+
+    def ping(self):
+        '''Finds the process ID, number of workers and processes of the
+        daemon.'''
+        return self.request({'process': 'ping'})[0]
+
+    def stop(self):
+        '''Stops the daemon once the jobs it is running have finished.'''
+        self.request({'process': 'stop'})
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    # renderDaemon.py [stop] [socket location or port] [workers]
+    args = sys.argv[1:]
+    stop = args[:1] == ['stop']
+    if stop:
+        args = args[1:]
+    address = DEFAULT_ADDRESS
+    if args:
+        address = ('127.0.0.1', int(args[0])) if args[0].isdigit() else \
+                  args[0]
+    if stop:
+        Client(address, timeout=0).stop()
+    else:
+        serve(address, int(args[1]) if len(args) > 1 else None)
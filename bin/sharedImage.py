@@ -0,0 +1,172 @@
+r'''
+    Module for handing PIL images between processes through shared memory.
+
+    A pool of processes is normally given PIL images as (mode, size, bytes)
+    tuples, which are pickled and sent through a pipe, so each image is
+    copied into a string, through the pipe and into a new image again. For
+    large images this takes far longer than the work done on them. Here an
+    image is instead copied once into a memory-mapped file, in /dev/shm
+    where there is one so it never goes to disk, and only a small handle of
+    the file, mode and size is sent. Any process can then map the file as a
+    PIL image without copying it, or crop out only the part it needs.
+
+    PIL keeps the pixels of 'RGB' images in 4 bytes, the same as 'RGBX', so
+    'RGB' images are shared as 'RGBX' and the image mapped from them is an
+    'RGBX' image. crop_shared() gives an image of the original mode. Images
+    mapped from a file are read only, and PIL copies them before changing
+    them.
+
+    The file of an image stays until release() is called, which can be
+    done as soon as every process that needs it has mapped it. gather() 
+    collects the images shared by a pool of processes so that none of their
+    files are lost when one of the processes fails.
+
+    Here is an example of how the code works:
+
+        >>> from PIL import Image
+        >>> img = Image.new('RGB', (8000,6250), (90,30,200))
+        >>> handle = share(img)
+        >>> mapped = open_shared(handle)
+        >>> mapped.mode, mapped.getpixel((10,10))
+        ('RGBX', (90, 30, 200, 255))
+        >>> part = crop_shared(handle, (0, 0, 100, 50))
+        >>> part.mode, part.size
+        ('RGB', (100, 50))
+        >>> release(handle)
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the sharedImage module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(sharedImage)
+
+'''
+import os
+import sys
+import mmap
+import tempfile
+from collections import namedtuple
+from PIL import Image
+
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# The raw mode each mode is kept in, for the modes PIL can map straight from
+# memory. Images of other modes are copied when they are opened.
+MAP_RAWMODES = {'L': 'L', 'RGB': 'RGBX', 'RGBX': 'RGBX', 'RGBA': 'RGBA',
+                'CMYK': 'CMYK', 'I;16': 'I;16'}
+PIXEL_SIZES = {'L': 1, 'RGBX': 4, 'RGBA': 4, 'CMYK': 4, 'I;16': 2}
+
+# The location of the memory-mapped file, and the mode and (width, height)
+# of its image. This is all that is sent between processes.
+ImageHandle = namedtuple('ImageHandle', ('path', 'mode', 'size'))
+
+
+def map_file(path, size=None):
+    '''Maps a file into memory, first making it 'size' bytes long if it is
+    given.'''
+    with open(path, 'r+b') as f:
+        if size is not None:
+            f.truncate(size)
+        return mmap.mmap(f.fileno(), size or 0)
+
+
+def raw_image(handle, buf):
+    '''Creates a PIL image of a handle that uses the memory of 'buf'.'''
+    rawMode = MAP_RAWMODES.get(handle.mode, handle.mode)
+    return Image.frombuffer(rawMode, handle.size, buf, 'raw', rawMode, 0, 1)
+
+
+def share(img, directory=SHARED_DIR):
+    '''Copies a PIL image into a new memory-mapped file.
+
+    Parameters:
+        img [PIL Image] : The image. 'P' images must be converted first,
+                          since their palette isn't shared.
+        directory [str] : The folder for the file. By default this is
+                          /dev/shm, or the temporary folder without it.
+
+    On Exit:
+        Returns the ImageHandle of the shared image.
+
+    '''
+    if img.mode == 'P':
+        raise ValueError, "the palette of 'P' images can't be shared"
+    img.load()
+    fd, path = tempfile.mkstemp('.img', 'lichtenstein-', directory)
+    os.close(fd)
+    handle = ImageHandle(path, img.mode, img.size)
+    if img.mode in MAP_RAWMODES:
+        # The pixels are copied straight from the image into the file
+        pixelSize = PIXEL_SIZES[MAP_RAWMODES[img.mode]]
+        buf = map_file(path, max(img.size[0]*img.size[1]*pixelSize, 1))
+        raw_image(handle, buf).im.paste(img.im, (0, 0) + img.size)
+    else:
+        data = img.tobytes()
+        buf = map_file(path, max(len(data), 1))
+        buf[:len(data)] = data
+    buf.close()
+    return handle
+
+
+def open_shared(handle):
+    '''Maps a shared image into memory as a read only PIL image without
+    copying it. 'RGB' images are 'RGBX' images, and images of modes that
+    can't be mapped are copied.'''
+    return raw_image(handle, map_file(handle.path))
+
+
+def crop_shared(handle, box=None):
+    '''Copies a box of a shared image, or the whole image when 'box' is
+    None, into an ordinary PIL image of the mode of the image.'''
+    img = open_shared(handle)
+    if box is not None:
+        img = img.crop(box)
+    if img.mode != handle.mode:
+        return img.convert(handle.mode)
+    return img.copy() if img.readonly else img
+
+
+def release(handle):
+    '''Removes the file of a shared image. Processes that have already
+    mapped it can still use it.'''
+    try:
+        os.remove(handle.path)
+    except OSError:
+        pass
+
+
+def gather(results):
+    '''Collects the ImageHandles of the results of a pool of processes, 
+    such as from Pool.imap(), carrying on past any that raise an error so 
+    that every image that was shared is found.
+    
+    Parameters:
+        results [iterator] : The ImageHandle of each result, in an iterator
+                             that goes on to the next result after an error.
+                             
+    On Exit:
+        Returns a list of the handles. If any of the results raised an 
+        error, every handle is released and the first error is raised.
+        
+    '''
+    handles, error = [], None
+    results = iter(results)
+    while True:
+        try:
+            handles.append(next(results))
+        except StopIteration:
+            break
+        except Exception:
+            if error is None:
+                error = sys.exc_info()
+    if error is not None:
+        for handle in handles:
+            release(handle)
+        raise error[0], error[1], error[2]
+    return handles
+
+
+if __name__ == "__main__":
+    import doctest
+    import sharedImage
+    nfail, ntests = doctest.testmod(sharedImage)
+    print '{0} of {1} examples failed'.format(nfail, ntests)
@@ -0,0 +1,648 @@
+r'''
+    Module for generating Roy Lichtenstein images in horizontal strips so that
+    very large images can be created without holding them in memory.
+
+    The lichtenstein() function needs the whole image, each of the full size
+    images from the quantize, halftoning and edge detect processes and the
+    anti-aliased halftoning image, which is 'aalias' squared times bigger, in
+    memory at once. Here the image is instead worked on one strip at a time.
+    Each strip is processed with enough rows either side of it (the halo) so
+    that the gaussian blurs, Sobel and non maximum suppression and the boxes
+    of the halftoning are the same as when processing the whole image. Every
+    finished strip is written straight to the output file. The rows of each
+    strip are read with StripSource, which reads just those rows from files
+    that store them uncompressed, such as PPM, BMP, TGA and uncompressed TIFF
+    files, so for these the memory used depends on the strip size and not
+    the image size. PNG, JPEG and other compressed files, and images already
+    in memory, are decoded as a whole once and the strips cropped out of
+    them, so they still take memory for the whole source image, though not
+    for any of the images made from it.
+
+    To keep the strips consistent with each other, the quantize palette is
+    estimated once from a sample of the whole image and the edge thresholds
+    are made relative to the largest gradient magnitude of the whole image,
+    which is found from a first pass over the strips. The only difference
+    from the whole image is the edge linking, which can only follow an edge
+    'linkHalo' rows beyond the strip it is in.
+
+    As well as a PNG file, the strips can be written straight into a Deep Zoom
+    tile pyramid for web viewers with DeepZoomWriter. Each level of the 
+    pyramid keeps only the rows needed for its current row of tiles, so the 
+    pyramid is made while the image renders without holding the full image
+    or decoding it again afterwards. The strips don't depend on each other,
+    so they can also be generated across a pool of processes a few at a 
+    time with 'workers'. Each strip with its halo and each finished strip 
+    are handed between the processes in shared memory with sharedImage, so
+    they aren't copied through pipes.
+
+    Here is an example of how the code works:
+
+        >>> f = 'lena.png'
+        >>> try:
+        ...     img = Image.open(f)
+        ... except IOError:
+        ...     img = Image.new('RGB', (512,512))
+        ...     pix = img.load()
+        ...     colRatio = 255.0/img.size[0]
+        ...     for x,y in pila.pixel_generator(*img.size):
+        ...         pix[x,y] = (int(x*colRatio),0,int(y*colRatio))
+        ...
+        >>> lichtenstein_strips(img, 'lichtenstein-strips.png', stripHeight=64)
+        >>> Image.open('lichtenstein-strips.png').show(command='display')
+        >>> dzi = DeepZoomWriter('lichtenstein.dzi', img.size, 128, 1, 'jpg')
+        >>> lichtenstein_strips(img, dzi, stripHeight=64)
+        >>> lichtenstein_strips(img, 'lichtenstein-strips.png', workers=4)
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the streaming module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(streaming)
+
+'''
+import math
+import multiprocessing
+import os
+import struct
+import zlib
+from PIL import Image
+import PILAddons as pila
+import lichtenstein as li
+import halftoning as ht
+import edgeDetect as ed
+import quantize as qt
+import backends
+import sharedImage as sh
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+PNG_COLOUR_TYPES = {'L': 0, 'RGB': 2, 'RGBA': 6}
+QUANT_HALO = 6 # The rows either side of a strip that affect its quantize image
+
+
+class PNGStripWriter(object):
+    '''Writes a PNG file a strip of rows at a time.
+
+    Parameters:
+        fileName [str] : The location of the PNG file to write.
+        size [tuple]   : The (width, height) of the complete image.
+        mode [str]     : The PIL colour mode of the image. Can be 'L', 'RGB'
+                         or 'RGBA'.
+        level [int]    : The zlib compression level from 0 to 9.
+
+    Attributes:
+        rows [int] : The number of rows that have been written so far.
+
+    '''
+    def __init__(self, fileName, size, mode='RGB', level=6):
+        if mode not in PNG_COLOUR_TYPES:
+            raise ValueError, "'{0}' images can't be written".format(mode)
+        self.size = size
+        self.mode = mode
+        self.rows = 0
+        self._file = open(fileName, 'wb')
+        self._compressor = zlib.compressobj(level)
+        self._file.write(PNG_SIGNATURE)
+        self._write_chunk('IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8,
+                                              PNG_COLOUR_TYPES[mode], 0, 0, 0))
+
+    def _write_chunk(self, tag, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(tag + data)
+        self._file.write(struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    def write(self, strip):
+        '''Adds the rows of an image strip to the bottom of the PNG file.
+
+        Parameters:
+            strip [PIL Image] : An image with the same width as the complete
+                                image. It will be converted to the mode of the
+                                PNG file.
+
+        On Exit:
+            Compresses the rows of 'strip' and writes them to the file.
+
+        '''
+        if strip.size[0] != self.size[0]:
+            raise ValueError, "the strip is not the width of the image"
+        if self.rows + strip.size[1] > self.size[1]:
+            raise ValueError, "more rows have been written than the image has"
+        data = strip.convert(self.mode).tobytes()
+        rowBytes = len(data)/strip.size[1]
+        # Each row starts with a filter type byte, and 0 is no filtering
+        rows = ''.join('\x00' + data[i:i+rowBytes]
+                       for i in xrange(0, len(data), rowBytes))
+        compressed = self._compressor.compress(rows)
+        if compressed:
+            self._write_chunk('IDAT', compressed)
+        self.rows += strip.size[1]
+
+    def close(self):
+        '''Finishes the PNG file once all the rows have been written.'''
+        if self.rows != self.size[1]:
+            raise RuntimeError, "only {0} of the {1} rows have been " \
+                                "written".format(self.rows, self.size[1])
+        self._write_chunk('IDAT', self._compressor.flush())
+        self._write_chunk('IEND', '')
+        self._file.close()
+
+
+def stack_rows(top, bottom):
+    '''Joins two images of the same width, one on top of the other. Either 
+    can be None, in which case the other image is returned.'''
+    if top is None:
+        return bottom
+    if bottom is None:
+        return top
+    img = Image.new(top.mode, (top.size[0], top.size[1]+bottom.size[1]))
+    img.paste(top, (0, 0))
+    img.paste(bottom, (0, top.size[1]))
+    return img
+
+
+class PyramidLevel(object):
+    '''Cuts the tiles for one level of a Deep Zoom image pyramid from the 
+    strips of rows it is given.
+    
+    Parameters:
+        dirName [str]  : The folder the tiles of the level are saved in.
+        size [tuple]   : The (width, height) of the level.
+        tileSize [int] : The width and height of each tile.
+        overlap [int]  : The number of pixels each tile overlaps its 
+                         neighbours by.
+        fmt [str]      : The file extension of the tiles, such as 'png' or 
+                         'jpg'.
+                         
+    Attributes:
+        rows [int] : The number of rows that have been written so far.
+        
+    '''
+    def __init__(self, dirName, size, tileSize=256, overlap=0, fmt='png'):
+        self.dirName = dirName
+        self.size = size
+        self.tileSize = tileSize
+        self.overlap = overlap
+        self.fmt = fmt
+        self.rows = 0
+        self._band = None # The rows that are still needed for tiles
+        self._bandTop = 0
+        self._pending = None # The rows that haven't been scaled down yet
+        self._tileRow = 0
+        if not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        
+    def _save_tiles(self):
+        width, height = self.size
+        tile, ov = self.tileSize, self.overlap
+        while self._tileRow*tile < height:
+            r = self._tileRow
+            top, bottom = max(r*tile - ov, 0), min((r+1)*tile + ov, height)
+            if self.rows < bottom:
+                break
+            for c, x in enumerate(xrange(0, width, tile)):
+                box = (max(x-ov, 0), top-self._bandTop, 
+                       min(x+tile+ov, width), bottom-self._bandTop)
+                fileName = os.path.join(self.dirName, 
+                                        '{0}_{1}.{2}'.format(c, r, self.fmt))
+                self._band.crop(box).save(fileName)
+            # Only keep the rows that the next row of tiles overlaps
+            keep = (r+1)*tile - ov
+            self._band = self._band.crop((0, keep-self._bandTop, width, 
+                                          self._band.size[1]))
+            self._bandTop = keep
+            self._tileRow += 1
+            
+    def _scale_down(self, nRows):
+        width = self.size[0]
+        rows = self._pending.crop((0, 0, width, nRows))
+        if nRows < self._pending.size[1]:
+            self._pending = self._pending.crop((0, nRows, width, 
+                                                self._pending.size[1]))
+        else:
+            self._pending = None
+        # Pairs of rows are averaged together, so the strips of the next 
+        # level join up without seams
+        return rows.resize(((width+1)/2, (nRows+1)/2), resample=Image.BOX)
+        
+    def write(self, strip):
+        '''Adds a strip of rows to the bottom of the level, saving any rows
+        of tiles that are complete.
+        
+        On Exit:
+            Returns the rows of the next level down that can be made from the
+            rows written so far, or None if there are none yet.
+            
+        '''
+        if strip.size[0] != self.size[0]:
+            raise ValueError, "the strip is not the width of the level"
+        if self.rows + strip.size[1] > self.size[1]:
+            raise ValueError, "more rows have been written than the level has"
+        self._band = stack_rows(self._band, strip)
+        self._pending = stack_rows(self._pending, strip)
+        self.rows += strip.size[1]
+        self._save_tiles()
+        nRows = self._pending.size[1] - self._pending.size[1] % 2
+        if nRows == 0:
+            return None
+        return self._scale_down(nRows)
+    
+    def close(self):
+        '''Finishes the level once all of its rows have been written.
+        
+        On Exit:
+            Returns the last rows of the next level down, or None if there 
+            are none left.
+            
+        '''
+        if self.rows != self.size[1]:
+            raise RuntimeError, "only {0} of the {1} rows have been " \
+                                "written".format(self.rows, self.size[1])
+        if self._pending is None:
+            return None
+        return self._scale_down(self._pending.size[1])
+
+
+class DeepZoomWriter(object):
+    '''Writes a Deep Zoom image pyramid a strip of rows at a time. Every 
+    level of the pyramid is built from the strips as they arrive, so the full
+    image is never held in memory.
+    
+    Parameters:
+        fileName [str] : The location of the '.dzi' file to write. The tiles
+                         are saved in a folder next to it with '_files' in 
+                         place of '.dzi'.
+        size [tuple]   : The (width, height) of the complete image.
+        tileSize [int] : The width and height of each tile.
+        overlap [int]  : The number of pixels each tile overlaps its 
+                         neighbours by.
+        fmt [str]      : The file extension of the tiles, such as 'png' or 
+                         'jpg'.
+                         
+    '''
+    def __init__(self, fileName, size, tileSize=256, overlap=0, fmt='png'):
+        if not fileName.endswith('.dzi'):
+            raise ValueError, "'{0}' is not a .dzi file".format(fileName)
+        if tileSize <= 0:
+            raise ValueError('the value for tileSize must be greater than 0')
+        self.fileName = fileName
+        self.size = size
+        self.tileSize = tileSize
+        self.overlap = overlap
+        self.fmt = fmt
+        tileDir = fileName[:-4] + '_files'
+        
+        # The top level is the full image and each level below is half the
+        # size, down to a single pixel at level 0.
+        maxLevel = 0
+        while (1 << maxLevel) < max(size):
+            maxLevel += 1
+        self.levels = []
+        width, height = size
+        for level in xrange(maxLevel, -1, -1):
+            self.levels.append(PyramidLevel(os.path.join(tileDir, str(level)), 
+                                            (width, height), tileSize, 
+                                            overlap, fmt))
+            width, height = (width+1)/2, (height+1)/2
+            
+    def write(self, strip):
+        '''Adds the rows of an image strip to the bottom of every level of 
+        the pyramid.'''
+        for level in self.levels:
+            strip = level.write(strip)
+            if strip is None:
+                break
+            
+    def close(self):
+        '''Finishes the pyramid once all the rows have been written and 
+        writes the '.dzi' file.'''
+        carry = []
+        for level in self.levels:
+            strips = [level.write(strip) for strip in carry] + [level.close()]
+            carry = [strip for strip in strips if strip is not None]
+        with open(self.fileName, 'w') as dzi:
+            dzi.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008"'
+                      ' Format="{0}" Overlap="{1}" TileSize="{2}">\n'
+                      '  <Size Width="{3}" Height="{4}"/>\n'
+                      '</Image>\n'.format(self.fmt, self.overlap, 
+                                          self.tileSize, *self.size))
+
+
+def strip_bounds(height, stripHeight):
+    '''Creates a generator for the rows covered by each strip of an image.
+
+    Parameters:
+        height [int]      : The height of the image.
+        stripHeight [int] : The number of rows in each strip. The last strip
+                            may be shorter.
+
+    On Exit:
+        Yields the first row and the row after the last of each strip.
+
+    '''
+    if stripHeight <= 0:
+        raise ValueError('the value for stripHeight must be greater than 0')
+    for y in xrange(0, height, stripHeight):
+        yield y, min(y+stripHeight, height)
+
+
+def halftone_halo(box, cRatio):
+    '''Finds how many rows of the image can affect a row of a halftoning image
+    with the boxes 'box' and circle ratio 'cRatio'. This covers the rows
+    sampled for any circle drawn over that row and the rows used by the
+    ANTIALIAS filter.'''
+    return 2*box + int(math.ceil(box*1.25*cRatio/2.0)) + 4
+
+
+def crop_rows(img, top, bottom):
+    '''Crops the rows from 'top' to 'bottom' out of 'img', keeping inside the
+    image.
+
+    On Exit:
+        Returns the cropped image and the row of 'img' it starts at.
+
+    '''
+    top, bottom = max(top, 0), min(bottom, img.size[1])
+    return img.crop((0, top, img.size[0], bottom)), top
+
+
+class StripSource(object):
+    '''Reads the RGB rows of an image a strip at a time.
+
+    If the image is in a file that stores its rows uncompressed in one block,
+    such as a PPM, BMP, TGA or uncompressed TIFF file, only the rows asked 
+    for are read from the file. Any other image is decoded as a whole the
+    first time rows are read from it and the rows are cropped out of that.
+
+    Parameters:
+        img [PIL Image] : a PIL Image object or the location of an image file.
+
+    Attributes:
+        size [tuple]    : the (width, height) of the image.
+        streamed [bool] : whether only the rows asked for are read.
+
+    '''
+    def __init__(self, img):
+        if isinstance(img, basestring):
+            img = Image.open(img)
+        self.size = img.size
+        self._img = img
+        self._layout = self._raw_layout(img)
+        self.streamed = self._layout is not None
+
+    @staticmethod
+    def _raw_layout(img):
+        # The file, offset, row length, raw mode and orientation of the rows
+        # of an image that is a single uncompressed block in its file
+        tile = getattr(img, 'tile', None)
+        fileName = getattr(img, 'filename', None)
+        if not fileName or not tile or len(tile) != 1:
+            return None
+        decoder, extents, offset, args = tile[0]
+        if decoder != 'raw' or extents != (0, 0) + img.size or \
+                img.mode not in ('L', 'RGB', 'RGBA', 'RGBX', 'CMYK'):
+            return None
+        if not isinstance(args, tuple):
+            args = (args, 0, 1)
+        rawmode, stride, orientation = (args + (0, 1))[:3]
+        if not stride:
+            try:
+                stride = len(Image.new(img.mode, (img.size[0], 1)).tobytes(
+                                                                'raw', rawmode))
+            except Exception:
+                return None
+        return fileName, offset, stride, rawmode, orientation
+
+    def rows(self, top, bottom):
+        '''Reads the rows from 'top' to 'bottom', keeping inside the image.
+
+        On Exit:
+            Returns the RGB image of the rows and the row of the image it 
+            starts at.
+
+        '''
+        width, height = self.size
+        top, bottom = max(top, 0), min(bottom, height)
+        if self._layout is None:
+            cropImg, top = crop_rows(self._img, top, bottom)
+            return cropImg.convert('RGB'), top
+        fileName, offset, stride, rawmode, orientation = self._layout
+        # Images stored bottom up have their last row first in the file
+        first = top if orientation > 0 else height-bottom
+        with open(fileName, 'rb') as f:
+            f.seek(offset + first*stride)
+            data = f.read((bottom-top)*stride)
+        img = Image.frombytes(self._img.mode, (width, bottom-top), data, 'raw',
+                              rawmode, stride, orientation)
+        return img.convert('RGB'), top
+
+    def proxy(self, maxPixels=262144, stripHeight=64):
+        '''Makes a copy of the image scaled down a strip at a time, for 
+        quantize.estimate_palette().
+
+        On Exit:
+            Returns an RGB image with at most 'maxPixels' pixels.
+
+        '''
+        width, height = self.size
+        factor = int(math.ceil(math.sqrt(float(width*height)/maxPixels)))
+        if factor <= 1:
+            return self.rows(0, height)[0]
+        proxyImg = None
+        for y0, y1 in strip_bounds(height, stripHeight*factor):
+            stripImg = self.rows(y0, y1)[0]
+            proxyImg = stack_rows(proxyImg, stripImg.resize(
+                            (max(1, width/factor), max(1, (y1-y0)/factor)),
+                            resample=Image.BOX))
+        return proxyImg
+
+
+def max_magnitude(img, sigma=1.4, stripHeight=64):
+    '''Finds the largest suppressed gradient magnitude of an image one strip
+    at a time.
+
+    Parameters:
+        img [PIL Image]   : a PIL Image object or a StripSource.
+        sigma [float]     : the amount of gaussian blur used for the edge
+                            detect process.
+        stripHeight [int] : the number of rows in each strip.
+
+    On Exit:
+        Returns the maximum value of edgeDetect.suppressed_magnitudes() for
+        the whole of 'img'.
+
+    '''
+    source = img if isinstance(img, StripSource) else StripSource(img)
+    halo = ed.blur_halo(sigma)
+    maxMag = 0
+    for y0, y1 in strip_bounds(source.size[1], stripHeight):
+        cropImg, top = source.rows(y0-halo, y1+halo)
+        candidates, _ = backends.run('edge_candidates', cropImg, sigma)
+        # Only the candidates have a suppressed magnitude above zero
+        for x,y,mag in candidates:
+            if y0 <= y+top < y1:
+                maxMag = max(maxMag, mag)
+    return maxMag
+
+
+def make_strip(cropImg, top, rows, maxMag, params):
+    '''Generates a single strip of a Roy Lichtenstein image.
+
+    Parameters:
+        cropImg [PIL Image] : the RGB rows of the image for the strip along 
+                              with its halo.
+        top [int]           : the row of the whole image 'cropImg' starts at.
+        rows [tuple]        : the first row of the strip and the row after its
+                              last.
+        maxMag [float]      : the largest gradient magnitude of the whole 
+                              image.
+        params [dict]       : the lichtenstein_strips() parameters.
+
+    On Exit:
+        Returns the RGB image of the rows of the strip.
+
+    '''
+    p = params
+    quantImg = qt.quantize(cropImg, p['qtNewCols'], p['qtNCols'], p['qtSigma'],
+                           p['aalias'], p['qtPalette'])
+    halfImg = ht.halftoning(quantImg, p['htBox'], p['htCRatio'], p['aalias'],
+                            p['htColour'], (0, top))
+    edgeMask = ed.canny_edge_detection(cropImg, p['edSigma'], p['edThresH'],
+                                       p['edThresL'], maxMag=maxMag, mode='L')
+    finalImg = li.composite(quantImg, halfImg, edgeMask, p['qtNewCols'],
+                            p['edColour'])
+    return finalImg.crop((0, rows[0]-top, cropImg.size[0], rows[1]-top))
+
+
+def render_strip(job):
+    '''Generates a single strip in a process of the pool used by 
+    lichtenstein_strips().
+
+    Parameters:
+        job [tuple] : the sharedImage.ImageHandle of the rows of the strip
+                      with its halo, the row of the image they start at and
+                      the rest of the make_strip() parameters.
+
+    On Exit:
+        Returns the ImageHandle of the strip.
+
+    '''
+    handle, top, rows, maxMag, params = job
+    cropImg = sh.crop_shared(handle)
+    return sh.share(make_strip(cropImg, top, rows, maxMag, params))
+
+
+def lichtenstein_strips(img, outFile, qtNewCols=li.DEFAULT_COLOURS, qtSigma=4,
+                        qtNCols=8, edSigma=1.4, edThresH=0.2, edThresL=0.1,
+                        edColour=(0,0,0), htBox=8,
+                        htColour=ht.AVERAGE_COLOUR_ON_WHITE, htCRatio=1,
+                        aalias=2, stripHeight=64, linkHalo=16,
+                        qtPalette=None, workers=1):
+    '''Generates a Roy Lichtenstein image from a PIL image one strip at a time
+    and writes it to a file as it goes.
+
+    Parameters:
+        img [PIL Image]   : a PIL Image object. Best results are created from
+                            RGB images. This can also be the location of an 
+                            image file, which for uncompressed files is read
+                            a strip at a time (see StripSource). Any other
+                            image is held whole in memory while it renders.
+        outFile [str]     : the location of the PNG file to write, or of the
+                            '.dzi' file of a Deep Zoom pyramid to write. It 
+                            can also be an object with the same write(strip)
+                            and close() methods as PNGStripWriter, such as a
+                            DeepZoomWriter, which each strip is given to.
+        stripHeight [int] : the number of rows of the image made at once.
+        linkHalo [int]    : the number of rows beyond a strip that the edge
+                            linking can follow an edge.
+        qtPalette [list]  : the palette every strip is quantized to. By 
+                            default it is estimated from a proxy of 'img'
+                            with quantize.estimate_palette().
+        workers [int]     : the number of processes generating strips. Only
+                            twice this many strips, and their rows of 'img',
+                            are held at once. None uses the number of CPUs.
+
+        The rest of the parameters are the same as lichtenstein.lichtenstein().
+
+    On Exit:
+        Generates a Roy Lichtenstein image a strip at a time, writing each
+        strip to 'outFile' in order from the top of the image.
+
+    '''
+    source = StripSource(img)
+    if qtPalette is None:
+        qtPalette = qt.estimate_palette(source.proxy() if source.streamed 
+                                        else img, qtNCols)
+    del img
+    width, height = source.size
+    if isinstance(outFile, basestring):
+        if outFile.endswith('.dzi'):
+            outFile = DeepZoomWriter(outFile, source.size)
+        else:
+            outFile = PNGStripWriter(outFile, source.size)
+
+    maxMag = max_magnitude(source, edSigma, stripHeight)
+
+    # The quantize image has its own halo for the ANTIALIAS resize and blur
+    # which the halftoning then needs to be correct for its whole halo.
+    halo = max(halftone_halo(htBox, htCRatio) + QUANT_HALO,
+               ed.blur_halo(edSigma) + linkHalo)
+
+    params = {'qtNewCols': qtNewCols, 'qtSigma': qtSigma, 'qtNCols': qtNCols,
+              'edSigma': edSigma, 'edThresH': edThresH, 'edThresL': edThresL,
+              'edColour': edColour, 'htBox': htBox, 'htColour': htColour,
+              'htCRatio': htCRatio, 'aalias': aalias, 'qtPalette': qtPalette}
+    bounds = list(strip_bounds(height, stripHeight))
+
+    if workers == 1:
+        for rows in bounds:
+            cropImg, top = source.rows(rows[0]-halo, rows[1]+halo)
+            outFile.write(make_strip(cropImg, top, rows, maxMag, params))
+    else:
+        # Only the rows of the strips in the current batch are shared with
+        # the processes, so the whole image is never copied
+        pool = multiprocessing.Pool(workers)
+        try:
+            batch = 2*(workers or multiprocessing.cpu_count())
+            for i in xrange(0, len(bounds), batch):
+                handles = []
+                try:
+                    jobs = []
+                    for rows in bounds[i:i+batch]:
+                        cropImg, top = source.rows(rows[0]-halo, rows[1]+halo)
+                        handles.append(sh.share(cropImg))
+                        jobs.append((handles[-1], top, rows, maxMag, params))
+                    del cropImg
+                    strips = sh.gather(pool.imap(render_strip, jobs))
+                    try:
+                        for strip in strips:
+                            outFile.write(sh.crop_shared(strip))
+                            sh.release(strip)
+                    finally:
+                        # The strips that weren't written if writing failed
+                        for strip in strips:
+                            sh.release(strip)
+                finally:
+                    for handle in handles:
+                        sh.release(handle)
+        finally:
+            pool.close()
+            pool.join()
+
+    outFile.close()
+
+
+if __name__ == "__main__":
+    f = 'lena.png'
+    try:
+        img = Image.open(f)
+    except IOError:
+        img = Image.new('RGB', (512,512))
+        pix = img.load()
+        colRatio = 255.0/img.size[0]
+        for x,y in pila.pixel_generator(*img.size):
+            pix[x,y] = (int(x*colRatio),0,int(y*colRatio))
+
+    lichtenstein_strips(img, 'lichtenstein-strips.png', stripHeight=64)
+    Image.open('lichtenstein-strips.png').show(command='display')
+    dzi = DeepZoomWriter('lichtenstein.dzi', img.size, 128, 1, 'jpg')
+    lichtenstein_strips(img, dzi, stripHeight=64)
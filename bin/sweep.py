@@ -0,0 +1,243 @@
+r'''
+    Module for generating many variants of a Roy Lichtenstein image from
+    ranges of parameters without repeating any of the work they share.
+
+    Calling lichtenstein.lichtenstein() for every variant redoes the same
+    blur, Sobel gradients, adaptive palette and halftoning each time, even
+    when only one parameter has changed. Instead, the generation is split
+    into stages, each of which depends on some of the parameters and on the
+    results of earlier stages:
+
+        quantize  : the adaptive colours of the image (qtNCols, aalias,
+                    qtPalette)
+        recolour  : the new colours switched in (qtNewCols)
+        halftone  : the halftoning of the recoloured image (htBox, htCRatio,
+                    aalias, htColour)
+        gradient  : the edgeDetect.GradientField (edSigma)
+        edges     : the mask of the linked edges (edThresH, edThresL)
+        composite : the final image with the edges filled in (edColour)
+
+    Each stage is only computed once for every unique combination of the
+    parameters it depends on, so for example one gradient is used for every
+    pair of edge thresholds. The result of a stage is only kept until the
+    last variant that uses it has been made, so a large sweep only holds 
+    the results the remaining variants still need. The number of times each
+    stage was computed and the time that was saved are reported once the 
+    variants are made.
+
+    A sweep is often used to pick the parameters for an image before making
+    it at its full size, so a size can be given to make smaller variants.
+    An image file is then decoded straight to a reduced size where the 
+    format allows it, with PILAddons.open_draft().
+
+    Here is an example of how the code works:
+
+        >>> f = 'lena.png'
+        >>> try:
+        ...     img = Image.open(f)
+        ... except IOError:
+        ...     img = Image.new('RGB', (256,256))
+        ...     pix = img.load()
+        ...     colRatio = 255.0/img.size[0]
+        ...     for x,y in pila.pixel_generator(*img.size):
+        ...         pix[x,y] = (int(x*colRatio),0,int(y*colRatio))
+        ...
+        >>> swp = Sweep(img, htBox=(6,8,10), edThresH=(0.2,0.3), edThresL=(0.1,))
+        >>> for params, lich in swp.variants():
+        ...     lich.save('lich-{htBox}-{edThresH}.png'.format(**params))
+        ...
+        >>> print swp.report() # doctest: +ELLIPSIS
+        quantize   computed    1 of    6 times, ...s
+        recolour   computed    1 of    6 times, ...s
+        halftone   computed    3 of    6 times, ...s
+        gradient   computed    1 of    6 times, ...s
+        edges      computed    2 of    6 times, ...s
+        composite  computed    6 of    6 times, ...s
+        Took ...s, saving about ...s over making each variant on its own
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the sweep module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(sweep)
+
+'''
+import inspect
+import itertools
+import time
+from PIL import Image
+import PILAddons as pila
+import lichtenstein as li
+import halftoning as ht
+import edgeDetect as ed
+import quantize as qt
+
+# The name of each stage, the parameters it depends on and the stages it
+# uses the results of, in the order they are computed. quantize() doesn't use
+# 'qtSigma', so no stage depends on it.
+STAGES = (('quantize', ('qtNCols', 'aalias', 'qtPalette'), ()),
+          ('recolour', ('qtNewCols',), ('quantize',)),
+          ('halftone', ('htBox', 'htCRatio', 'aalias', 'htColour'),
+                       ('recolour',)),
+          ('gradient', ('edSigma',), ()),
+          ('edges', ('edThresH', 'edThresL'), ('gradient',)),
+          ('composite', ('qtNewCols', 'edColour'),
+                        ('recolour', 'halftone', 'edges')))
+
+
+def freeze(value):
+    '''Turns lists, such as lists of colours, into tuples so that the value
+    can be used as a dictionary key.'''
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class Sweep(object):
+    '''Generates every combination of a set of ranges of lichtenstein()
+    parameters, sharing the stages that combinations have in common.
+
+    Parameters:
+        img [PIL Image] : a PIL Image object. Best results are created from
+                          RGB images. This can also be the location of an 
+                          image file.
+        size [tuple]    : The (width, height) the image is scaled down to 
+                          fit within before the variants are made, or None
+                          to use it at its full size.
+        ranges          : Each of the parameters of lichtenstein.lichtenstein()
+                          to vary, given by name, as a list of its values. Any
+                          parameter not given uses its default value.
+
+    Attributes:
+        computed [dict] : The number of times each stage has been computed.
+        needed [dict]   : The number of times each stage would have been
+                          computed if every variant was made on its own.
+        seconds [dict]  : The total time in seconds spent on each stage.
+
+    '''
+    def __init__(self, img, size=None, **ranges):
+        args, _, _, defaults = inspect.getargspec(li.lichtenstein)
+        self.defaults = dict(zip(args[-len(defaults):], defaults))
+        del self.defaults['edField'] # The gradient stage makes these
+        for name in ranges:
+            if name not in self.defaults:
+                raise ValueError, "'{0}' is not a lichtenstein " \
+                                  "parameter".format(name)
+        if isinstance(img, basestring):
+            if size is None:
+                img = Image.open(img)
+            else:
+                img = pila.open_draft(img, size)
+        elif size is not None:
+            img = img.copy()
+            img.thumbnail(size, Image.ANTIALIAS)
+        self.img = img.convert('RGB')
+        self.ranges = ranges
+        self.computed = dict((stage, 0) for stage, _, _ in STAGES)
+        self.needed = dict((stage, 0) for stage, _, _ in STAGES)
+        self.seconds = dict((stage, 0.0) for stage, _, _ in STAGES)
+        self._cache = {} # (stage, key) : result
+
+    def _compute(self, stage, p, inputs):
+        img = self.img
+        if stage == 'quantize':
+            return qt.adaptive_quantize(img, p['qtNCols'], p['aalias'],
+                                        p['qtPalette'])
+        elif stage == 'recolour':
+            pImg, curCols = inputs[0]
+            return qt.recolour(pImg, curCols, p['qtNewCols'])
+        elif stage == 'halftone':
+            return ht.halftoning(inputs[0], p['htBox'], p['htCRatio'],
+                                 p['aalias'], p['htColour'])
+        elif stage == 'gradient':
+            return ed.GradientField(img, p['edSigma'])
+        elif stage == 'edges':
+            return inputs[0].edges(p['edThresH'], p['edThresL'], mode='L')
+        else:
+            return li.composite(inputs[0], inputs[1], inputs[2],
+                                p['qtNewCols'], p['edColour'])
+
+    def _keys(self, p):
+        # The key of the result of each stage for the parameters 'p', which
+        # includes the keys of the stages it uses
+        keys = {}
+        for stage, params, depends in STAGES:
+            keys[stage] = (stage, tuple(freeze(p[n]) for n in params),
+                           tuple(keys[d] for d in depends))
+        return keys
+
+    def variants(self):
+        '''Creates a generator for every combination of the parameter ranges.
+
+        On Exit:
+            Yields a dictionary of all the lichtenstein() parameters used for
+            each variant along with its generated RGB PIL image.
+
+        '''
+        names = sorted(self.ranges)
+        combos = []
+        for values in itertools.product(*[self.ranges[n] for n in names]):
+            p = self.defaults.copy()
+            p.update(zip(names, values))
+            combos.append(p)
+        # The last variant that uses each result, after which it is dropped
+        lastUse = {}
+        for i, p in enumerate(combos):
+            for key in self._keys(p).itervalues():
+                lastUse[key] = i
+
+        for i, p in enumerate(combos):
+            keys, results = self._keys(p), {}
+            for stage, params, depends in STAGES:
+                self.needed[stage] += 1
+                if keys[stage] not in self._cache:
+                    start = time.time()
+                    self._cache[keys[stage]] = self._compute(
+                        stage, p, [results[d] for d in depends])
+                    self.seconds[stage] += time.time() - start
+                    self.computed[stage] += 1
+                results[stage] = self._cache[keys[stage]]
+            for key in keys.itervalues():
+                if lastUse[key] == i:
+                    del self._cache[key]
+            yield p, results['composite']
+
+    def report(self):
+        '''Summarises the work done by the sweep.
+
+        On Exit:
+            Returns a string listing how many times each stage was computed
+            compared to making every variant on its own, and an estimate of
+            the time that was saved.
+
+        '''
+        lines = []
+        saved = 0.0
+        for stage, _, _ in STAGES:
+            computed, needed = self.computed[stage], self.needed[stage]
+            if computed:
+                saved += self.seconds[stage]/computed*(needed - computed)
+            lines.append('{0:<10} computed {1:>4} of {2:>4} times, '
+                         '{3:.2f}s'.format(stage, computed, needed,
+                                           self.seconds[stage]))
+        total = sum(self.seconds.itervalues())
+        lines.append('Took {0:.2f}s, saving about {1:.2f}s over making each '
+                     'variant on its own'.format(total, saved))
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    f = 'lena.png'
+    try:
+        img = Image.open(f)
+    except IOError:
+        img = Image.new('RGB', (256,256))
+        pix = img.load()
+        colRatio = 255.0/img.size[0]
+        for x,y in pila.pixel_generator(*img.size):
+            pix[x,y] = (int(x*colRatio),0,int(y*colRatio))
+
+    swp = Sweep(img, htBox=(6,8,10), edThresH=(0.2,0.3), edThresL=(0.1,))
+    for params, lich in swp.variants():
+        lich.save('lich-{htBox}-{edThresH}.png'.format(**params))
+    print swp.report()
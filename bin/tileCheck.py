@@ -0,0 +1,374 @@
+r'''
+    Module for checking that tiled and parallel Roy Lichtenstein images are
+    the same as generating the whole image at once.
+
+    The quantize, halftoning and edge detect processes can each be run on
+    tiles of an image with a halo of extra pixels around them, and the strips
+    of streaming.lichtenstein_strips() can be generated across a pool of
+    processes. These should give exactly the same pixels as running each
+    process on the whole image, however the tiles are cut. The checks here
+    run every process on the whole image and then again for a range of tile
+    sizes and numbers of processes, on images with awkward sizes such as a
+    single row or column and prime sizes, and compare the results.
+
+    Each comparison reports the largest and mean difference of any band of
+    any pixel and the number of pixels that are different. A check passes
+    when the largest difference is within the tolerance of its process, which
+    is zero unless an approximation is allowed. When a check fails, the whole
+    image result, the tiled result and an image of the pixels that differ are
+    saved so the seams can be seen.
+
+    Here is an example of how the code works:
+
+        >>> import shutil, tempfile, StringIO
+        >>> outDir, report = tempfile.mkdtemp(), StringIO.StringIO()
+        >>> failures = run_checks(sizes=((1,37), (31,29)), tileSizes=(7,16),
+        ...                       workers=(1,2), outDir=outDir, out=report)
+        >>> len(failures)
+        0
+        >>> report.getvalue().splitlines()[-1]
+        '0 checks failed'
+        >>> shutil.rmtree(outDir)
+        >>> compare(Image.new('L', (4,4), 10), Image.new('L', (4,4), 12))
+        (2, 2.0, 16)
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the tileCheck module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(tileCheck)
+
+'''
+import os
+import sys
+import random
+import multiprocessing
+from itertools import imap
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+import lichtenstein as li
+import halftoning as ht
+import edgeDetect as ed
+import quantize as qt
+import streaming as st
+import sharedImage as sh
+
+SIZES = ((1,1), (1,37), (37,1), (2,53), (31,29), (97,61), (128,96))
+TILE_SIZES = (5, 16, 33)
+WORKERS = (1, 3)
+STAGES = ('quantize', 'halftone', 'edges', 'lichtenstein')
+TOLERANCES = dict((stage, 0) for stage in STAGES)
+
+
+class StripCollector(object):
+    '''Collects the strips from streaming.lichtenstein_strips() into a single
+    image, which is kept in 'img'.'''
+    def __init__(self):
+        self.img = None
+
+    def write(self, strip):
+        self.img = st.stack_rows(self.img, strip)
+
+    def close(self):
+        pass
+
+
+def test_image(size, seed=0):
+    '''Creates an image with shapes, gradients and noise to check with.
+
+    Parameters:
+        size [tuple] : The (width, height) of the image.
+        seed [int]   : The seed for the random shapes and noise.
+
+    On Exit:
+        Returns an RGB PIL image which is the same for the same 'size' and
+        'seed'.
+
+    '''
+    rand = random.Random(seed)
+    width, height = size
+    img = Image.new('RGB', size, (rand.randrange(256), 128, 64))
+    drw = ImageDraw.Draw(img)
+    for _ in xrange(max(4, width*height/400)):
+        x, y = rand.randrange(-10, width), rand.randrange(-10, height)
+        bbox = (x, y, x+rand.randint(1, 40), y+rand.randint(1, 40))
+        fill = tuple(rand.randrange(256) for _ in xrange(3))
+        if rand.random() < 0.5:
+            drw.ellipse(bbox, fill=fill)
+        else:
+            drw.rectangle(bbox, fill=fill)
+    noise = Image.frombytes('RGB', size,
+                            bytes(bytearray(rand.randrange(32)
+                                            for _ in xrange(width*height*3))))
+    return ImageChops.add(img, noise)
+
+
+def tile_bounds(size, tileSize):
+    '''Creates a generator for the tiles of an image.
+
+    Parameters:
+        size [tuple]   : The (width, height) of the image.
+        tileSize [int] : The width and height of each tile. The tiles on the
+                         right and bottom may be smaller.
+
+    On Exit:
+        Yields the (left, top, right, bottom) box of each tile.
+
+    '''
+    width, height = size
+    for y in xrange(0, height, tileSize):
+        for x in xrange(0, width, tileSize):
+            yield x, y, min(x+tileSize, width), min(y+tileSize, height)
+
+
+def stage_halo(stage, params):
+    '''Finds the number of pixels around a tile needed to make 'stage' the
+    same as for the whole image.'''
+    if stage == 'quantize':
+        return st.QUANT_HALO
+    elif stage == 'halftone':
+        return st.halftone_halo(params['htBox'], params['htCRatio'])
+    elif stage == 'edges':
+        return ed.blur_halo(params['edSigma']) + params['linkHalo']
+    raise ValueError, "'{0}' can't be run in tiles".format(stage)
+
+
+def run_stage(stage, img, origin, params):
+    '''Runs a single process on an image or a tile of an image.
+
+    Parameters:
+        stage [str]     : 'quantize', 'halftone' or 'edges'.
+        img [PIL Image] : The image or tile. For 'halftone' this is the
+                          quantize image.
+        origin [tuple]  : The (x,y) position of 'img' in the whole image.
+        params [dict]   : The lichtenstein() parameters along with 'maxMag',
+                          the largest gradient magnitude of the whole image.
+
+    On Exit:
+        Returns the image made by the process for 'img'.
+
+    '''
+    p = params
+    if stage == 'quantize':
+        return qt.quantize(img, p['qtNewCols'], p['qtNCols'], p['qtSigma'],
+                           p['aalias'], p['qtPalette'])
+    elif stage == 'halftone':
+        return ht.halftoning(img, p['htBox'], p['htCRatio'], p['aalias'],
+                             p['htColour'], origin)
+    elif stage == 'edges':
+        return ed.canny_edge_detection(img, p['edSigma'], p['edThresH'],
+                                       p['edThresL'], maxMag=p['maxMag'],
+                                       mode='L')
+    raise ValueError, "'{0}' isn't a stage".format(stage)
+
+
+def run_tile(job):
+    '''Runs a process on a single tile. This is called by each process of the
+    pool.
+
+    Parameters:
+        job [tuple] : The stage, the sharedImage.ImageHandle of the whole 
+                      image, the box of the tile with its halo, the box of 
+                      the tile within it and the parameters.
+
+    On Exit:
+        Returns the ImageHandle of the result for the tile without its halo.
+
+    '''
+    stage, handle, haloBox, box, params = job
+    tile = sh.crop_shared(handle, haloBox)
+    res = run_stage(stage, tile, haloBox[:2], params)
+    return sh.share(res.crop(box))
+
+
+def tiled(stage, img, tileSize, workers, params):
+    '''Runs a process on every tile of an image and joins the results.
+
+    Parameters:
+        stage [str]     : 'quantize', 'halftone' or 'edges'.
+        img [PIL Image] : The whole image.
+        tileSize [int]  : The width and height of the tiles.
+        workers [int]   : The number of processes the tiles are run across.
+        params [dict]   : The parameters for run_stage().
+
+    On Exit:
+        Returns the joined image of the tiles.
+
+    '''
+    halo = stage_halo(stage, params)
+    width, height = img.size
+    # The processes crop their own tiles out of the shared image
+    source = sh.share(img)
+    jobs = []
+    for x0, y0, x1, y1 in tile_bounds(img.size, tileSize):
+        left, top = max(x0-halo, 0), max(y0-halo, 0)
+        jobs.append((stage, source, (left, top, min(x1+halo, width), 
+                     min(y1+halo, height)), (x0-left, y0-top, x1-left, y1-top),
+                     params))
+
+    try:
+        if workers == 1:
+            results = sh.gather(imap(run_tile, jobs))
+        else:
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = sh.gather(pool.imap(run_tile, jobs))
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        sh.release(source)
+
+    out = None
+    try:
+        for (x0, y0, _, _), res in zip(tile_bounds(img.size, tileSize), 
+                                       results):
+            if out is None:
+                out = Image.new(res.mode, img.size)
+            out.paste(sh.open_shared(res), (x0, y0))
+    finally:
+        for res in results:
+            sh.release(res)
+    return out
+
+
+def compare(ref, img):
+    '''Compares two images.
+
+    Parameters:
+        ref [PIL Image] : The expected image.
+        img [PIL Image] : The image to compare with it.
+
+    On Exit:
+        Returns the largest difference of any band of any pixel, the mean
+        difference over every band and pixel and the number of pixels that
+        are different.
+
+    '''
+    if ref.size != img.size:
+        raise ValueError, "the sizes {0} and {1} are different".format(
+                          ref.size, img.size)
+    diff = ImageChops.difference(ref, img.convert(ref.mode))
+    maxDev = max(high for _, high in diff.getextrema()) \
+             if len(diff.getbands()) > 1 else diff.getextrema()[1]
+    mean = ImageStat.Stat(diff).mean
+    meanDev = sum(mean)/len(mean)
+    changed = diff.convert('L').point([0] + [1]*255)
+    nDiff = sum(changed.histogram()[1:])
+    return maxDev, meanDev, nDiff
+
+
+def dump_diff(name, ref, img, outDir, labels=('serial', 'tiled')):
+    '''Saves the expected image, the image that was checked and a black and
+    white image of the pixels that are different to 'outDir'. The first two
+    are named with 'labels'.'''
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    diff = ImageChops.difference(ref, img.convert(ref.mode)).convert('L')
+    ref.save(os.path.join(outDir, '{0}-{1}.png'.format(name, labels[0])))
+    img.save(os.path.join(outDir, '{0}-{1}.png'.format(name, labels[1])))
+    diff.point([0] + [255]*255).save(os.path.join(outDir, name+'-diff.png'))
+
+
+def run_checks(sizes=SIZES, tileSizes=TILE_SIZES, workers=WORKERS,
+               tolerances=TOLERANCES, outDir='tileCheck', out=None,
+               **params):
+    '''Checks every process run in tiles, and every lichtenstein image run in
+    strips, against running it on the whole image.
+
+    Parameters:
+        sizes [tuple]      : The (width, height) of each test image.
+        tileSizes [tuple]  : The tile sizes, and strip heights, to check.
+        workers [tuple]    : The numbers of processes to check.
+        tolerances [dict]  : The largest difference allowed for each of
+                             STAGES.
+        outDir [str]       : The folder the images of failed checks are
+                             saved to.
+        out [file]         : Where the report of every check is written. 
+                             None writes it to sys.stdout.
+        params             : Any of the parameters of
+                             lichtenstein.lichtenstein() and 'linkHalo' from
+                             streaming.lichtenstein_strips(), given by name.
+
+    On Exit:
+        Writes the result of every check to 'out' and returns a list of the
+        names of the checks that failed.
+
+    '''
+    p = {'qtNewCols': li.DEFAULT_COLOURS, 'qtSigma': 4, 'qtNCols': 8,
+         'edSigma': 1.4, 'edThresH': 0.2, 'edThresL': 0.1,
+         'edColour': (0,0,0), 'htBox': 8,
+         'htColour': ht.AVERAGE_COLOUR_ON_WHITE, 'htCRatio': 1, 'aalias': 2,
+         'linkHalo': 16}
+    p.update(params)
+    if out is None:
+        out = sys.stdout
+    failures = []
+
+    def check(name, ref, img, stage):
+        try:
+            maxDev, meanDev, nDiff = compare(ref, img)
+        except ValueError as e:
+            out.write('{0:<40} FAIL {1}\n'.format(name, e.args[0]))
+            failures.append(name)
+            return
+        passed = maxDev <= tolerances.get(stage, 0)
+        out.write('{0:<40} {1} max {2:>3} mean {3:.4f} pixels {4}\n'.format(
+                  name, 'ok  ' if passed else 'FAIL', maxDev, meanDev, nDiff))
+        if not passed:
+            failures.append(name)
+            dump_diff(name, ref, img, outDir)
+
+    for size in sizes:
+        img = test_image(size)
+        p['qtPalette'] = params.get('qtPalette') or \
+                         qt.estimate_palette(img, p['qtNCols'])
+        field = ed.GradientField(img, p['edSigma'])
+        p['maxMag'] = field.maxMag
+        serial = {}
+        serial['quantize'] = run_stage('quantize', img, (0,0), p)
+        serial['halftone'] = run_stage('halftone', serial['quantize'], (0,0),
+                                       p)
+        serial['edges'] = field.edges(p['edThresH'], p['edThresL'], mode='L')
+        serial['lichtenstein'] = li.composite(serial['quantize'],
+                                              serial['halftone'],
+                                              serial['edges'], p['qtNewCols'],
+                                              p['edColour'])
+
+        for tileSize in tileSizes:
+            for nWorkers in workers:
+                suffix = '{0}x{1}-tile{2}-workers{3}'.format(size[0], size[1],
+                                                             tileSize, nWorkers)
+                for stage in ('quantize', 'halftone', 'edges'):
+                    src = serial['quantize'] if stage == 'halftone' else img
+                    name = '{0}-{1}'.format(stage, suffix)
+                    try:
+                        res = tiled(stage, src, tileSize, nWorkers, p)
+                    except Exception as e:
+                        out.write('{0:<40} FAIL {1!r}\n'.format(name, e))
+                        failures.append(name)
+                        continue
+                    check(name, serial[stage], res, stage)
+
+                name = 'lichtenstein-{0}'.format(suffix)
+                collector = StripCollector()
+                stripParams = dict((k, v) for k, v in p.iteritems()
+                                   if k != 'maxMag')
+                try:
+                    st.lichtenstein_strips(img, collector,
+                                           stripHeight=tileSize,
+                                           workers=nWorkers, **stripParams)
+                except Exception as e:
+                    out.write('{0:<40} FAIL {1!r}\n'.format(name, e))
+                    failures.append(name)
+                    continue
+                check(name, serial['lichtenstein'], collector.img,
+                      'lichtenstein')
+
+    out.write('{0} checks failed\n'.format(len(failures)))
+    return failures
+
+
+if __name__ == "__main__":
+    outDir = sys.argv[1] if len(sys.argv) > 1 else 'tileCheck'
+    failures = run_checks(outDir=outDir)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,223 @@
+r'''
+    Module for exporting Roy Lichtenstein images as SVG vector files.
+
+    The idea behind this module is to create prints of any size without the
+    halftoning having to be drawn with an enormous anti-alias amount to get
+    crisp circles. Instead of drawing the image, the halftoning circles are
+    written as SVG circles straight from halftoning.halftone_cells(), the
+    areas of the quantize image that use the new colours are written as
+    paths and the edges from the Canny Edge Detect are written as polylines.
+    The size of the file and the time taken to create it depends on the number
+    of circles and not the number of pixels in the print.
+
+    The layers are stacked in the same way as lichtenstein.lichtenstein().
+    The halftoning is clipped to the areas that don't have a new colour, the
+    new colour areas are drawn on top of it and the edges are drawn on top of
+    everything. Files ending in '.svgz' are compressed with gzip.
+
+    Here is an example of how the code works:
+
+        >>> f = 'lena.png'
+        >>> try:
+        ...     img = Image.open(f)
+        ... except IOError:
+        ...     img = Image.new('RGB', (512,512))
+        ...     pix = img.load()
+        ...     colRatio = 255.0/img.size[0]
+        ...     for x,y in pila.pixel_generator(*img.size):
+        ...         pix[x,y] = (int(x*colRatio),0,int(y*colRatio))
+        ...
+        >>> lichtenstein_svg(img, 'lichtenstein.svg')
+        >>> lichtenstein_svg(img, 'lichtenstein.svgz', htBox=15)
+        >>>
+
+    To test/execute the examples in the module documentation make sure that
+    you have imported the vector module and do the following:
+    import doctest
+    nfail, ntests = doctest.testmod(vector)
+
+'''
+import gzip
+import re
+from PIL import Image
+import PILAddons as pila
+import backends
+import lichtenstein as li
+import halftoning as ht
+import edgeDetect as ed
+import quantize as qt
+from colour import rgb2hex
+
+SVG_HEADER = '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" ' \
+             'width="{0}" height="{1}" viewBox="0 0 {0} {1}">\n'
+SET_RUN = re.compile('[^\x00]+') # A run of set pixels in a row of a mask
+
+
+def region_rectangles(img, colours):
+    '''Finds the rectangles that make up the areas of an image which are each
+    of a set of colours.
+
+    Parameters:
+        img [PIL Image] : An RGB PIL image object.
+        colours [list]  : A list of the 3-tuple RGB colours to find.
+
+    On Exit:
+        Returns a dictionary of each colour in 'colours' to a list of the
+        (x, y, width, height) rectangles covering the pixels of that colour.
+        Runs of pixels along each row are joined with the same runs on the
+        rows below them.
+
+    '''
+    width, height = img.size
+    rects = dict((col, []) for col in colours)
+    for col in rects:
+        # The runs of each row are found in the bytes of the colour's mask
+        data = backends.run('colour_mask', img, [col]).tobytes()
+        openRuns = {} # (x0, x1) : the row the run started on
+        lastRow = None
+        for y in xrange(height + 1):
+            row = data[y*width:(y+1)*width]
+            if row == lastRow:
+                # The same runs carry on down from the row above
+                continue
+            lastRow = row
+            runs = set(m.span() for m in SET_RUN.finditer(row))
+            for run in sorted(openRuns):
+                if run not in runs:
+                    x0, x1 = run
+                    top = openRuns.pop(run)
+                    rects[col].append((x0, top, x1-x0, y-top))
+            for run in runs:
+                openRuns.setdefault(run, y)
+    return rects
+
+
+def edge_polylines(edgeMask):
+    '''Joins the edge pixels of an edge detect image into lines.
+
+    Parameters:
+        edgeMask [PIL Image] : An 'L' or '1' mask from canny_edge_detection()
+                               where the edges are the pixels that are set.
+
+    On Exit:
+        Returns a list of polylines, each a list of the (x,y) pixels along the
+        line. Every edge pixel is in exactly one line.
+
+    '''
+    edges = set(pila.mask_pixels(edgeMask))
+    lines = []
+    for start in sorted(edges):
+        if start not in edges:
+            continue
+        edges.remove(start)
+        line = [start]
+        # Follow the edge from the start pixel, then go back and follow it
+        # the other way from the start pixel
+        for _ in xrange(2):
+            x, y = line[-1]
+            while True:
+                for nxt in pila.adjacent_pixels(x,y):
+                    if nxt in edges:
+                        edges.remove(nxt)
+                        line.append(nxt)
+                        x, y = nxt
+                        break
+                else:
+                    break
+            line.reverse()
+        lines.append(line)
+    return lines
+
+
+def lichtenstein_svg(img, fileName, qtNewCols=li.DEFAULT_COLOURS, qtSigma=4,
+                     qtNCols=8, edSigma=1.4, edThresH=0.2, edThresL=0.1,
+                     edColour=(0,0,0), htBox=8,
+                     htColour=ht.AVERAGE_COLOUR_ON_WHITE, htCRatio=1,
+                     aalias=2, qtPalette=None):
+    '''Generates a Roy Lichtenstein image from a PIL image as an SVG file.
+
+    Parameters:
+        img [PIL Image] : a PIL Image object. Best results are created from
+                          RGB images.
+        fileName [str]  : the location of the SVG file to write. If it ends
+                          in '.svgz' the file will be compressed.
+
+        The rest of the parameters are the same as lichtenstein.lichtenstein().
+        'aalias' is only used for the quantize process since the halftoning
+        circles don't need to be anti-aliased.
+
+    On Exit:
+        Writes an SVG file of the Roy Lichtenstein image to 'fileName' with
+        the halftoning as circles, the new quantize colours as paths and the
+        edges as polylines.
+
+    '''
+    img = img.convert('RGB')
+    width, height = img.size
+    quantImg = qt.quantize(img, qtNewCols, qtNCols, qtSigma, aalias, qtPalette)
+    edgeMask = ed.canny_edge_detection(img, edSigma, edThresH, edThresL,
+                                       mode='L')
+    newCols = [tuple(col) for col in qtNewCols]
+
+    if fileName.endswith('.svgz'):
+        svg = gzip.open(fileName, 'wb')
+    else:
+        svg = open(fileName, 'w')
+    svg.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    svg.write(SVG_HEADER.format(width, height))
+
+    # The halftoning can only be seen where there isn't a new colour, so it
+    # is clipped to the areas of all the other colours.
+    otherCols = [col for _, col in quantImg.getcolors(width*height)
+                 if col not in newCols]
+    clipRects = region_rectangles(quantImg, otherCols)
+    svg.write('<defs><clipPath id="halftone"><path d="')
+    for rects in clipRects.itervalues():
+        for x, y, w, h in rects:
+            svg.write('M{0} {1}h{2}v{3}h-{2}z'.format(x, y, w, h))
+    svg.write('"/></clipPath></defs>\n')
+
+    svg.write('<g clip-path="url(#halftone)">\n')
+    svg.write('<rect width="{0}" height="{1}" fill="{2}"/>\n'.format(
+              width, height, rgb2hex(*htColour[1])))
+    for (cx, cy), rad, fill in ht.halftone_cells(quantImg, htBox, htCRatio, 1,
+                                                 htColour):
+        if rad > 0:
+            svg.write('<circle cx="{0}" cy="{1}" r="{2:.2f}" fill="{3}"/>'
+                      '\n'.format(cx, cy, rad, rgb2hex(*fill)))
+    svg.write('</g>\n')
+
+    for col, rects in region_rectangles(quantImg, newCols).iteritems():
+        if rects:
+            svg.write('<path fill="{0}" d="'.format(rgb2hex(*col)))
+            for x, y, w, h in rects:
+                svg.write('M{0} {1}h{2}v{3}h-{2}z'.format(x, y, w, h))
+            svg.write('"/>\n')
+
+    # The edges go through the centre of each pixel with square ends so that
+    # a line of a single pixel is still drawn.
+    svg.write('<g fill="none" stroke="{0}" stroke-width="1" '
+              'stroke-linecap="square" stroke-linejoin="miter">\n'.format(
+              rgb2hex(*edColour)))
+    for line in edge_polylines(edgeMask):
+        points = ' '.join('{0}.5,{1}.5'.format(x, y) for x, y in line)
+        if len(line) == 1:
+            points += ' ' + points
+        svg.write('<polyline points="{0}"/>\n'.format(points))
+    svg.write('</g>\n</svg>\n')
+    svg.close()
+
+
+if __name__ == "__main__":
+    f = 'lena.png'
+    try:
+        img = Image.open(f)
+    except IOError:
+        img = Image.new('RGB', (512,512))
+        pix = img.load()
+        colRatio = 255.0/img.size[0]
+        for x,y in pila.pixel_generator(*img.size):
+            pix[x,y] = (int(x*colRatio),0,int(y*colRatio))
+
+    lichtenstein_svg(img, 'lichtenstein.svg')
+    lichtenstein_svg(img, 'lichtenstein.svgz', htBox=15)